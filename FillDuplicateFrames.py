@@ -1,5 +1,11 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy
 import vapoursynth as vs
 from vapoursynth import core
+import probe
 
 '''
 call using:
@@ -8,9 +14,17 @@ from FillDuplicateFrames import FillDuplicateFrames
 fdf = FillDuplicateFrames(clip, debug=True, thresh=0.001, method='SVP')
 //fdf = FillDuplicateFrames(clip, debug=True, thresh=0.001, method='MV')
 //fdf = FillDuplicateFrames(clip, debug=True, thresh=0.001, method='RIFE', rifeSceneThr=0.15)
+//fdf = FillDuplicateFrames(clip, thresh=0.001, method='SVP', diffsFile=source + '.diffs.npz', source=source)
 clip = fdf.out
 
 Replaces duplicate frames with interpolations.
+The difference of every frame to the one before it is computed once, before
+the first frame is served. With diffsFile, these differences are saved, so
+that later runs on the same source can skip that pass. They are stored along
+with the identity of the source file and the format of the clip, and are only
+used again if both still match.
+The interpolations of the last smoothCacheSize runs of duplicates are kept, so
+frames of the same run that are requested by different threads share them.
 v0.0.3
 0.0.3 allow to set device_index for RIFE and support RGBH input for RIFE
 0.0.4 removed RGBH since 
@@ -18,14 +32,50 @@ v0.0.3
 
 class FillDuplicateFrames:
   # constructor
-  def __init__(self, clip: vs.VideoNode, thresh: float=0.001, method: str='SVP', debug: bool=False, rifeSceneThr: float=0.15, device_index: int=0):
+  def __init__(self, clip: vs.VideoNode, thresh: float=0.001, method: str='SVP', debug: bool=False, rifeSceneThr: float=0.15, device_index: int=0, diffsFile: str=None, smoothCacheSize: int=16, source: str=None):
       self.clip = core.std.PlaneStats(clip, clip[0]+clip)
       self.thresh = thresh
       self.debug = debug
       self.method = method
-      self.smooth = None
+      self.smoothCache = OrderedDict() # (start, end) -> interpolated clip, least recently used first
+      self.smoothCacheSize = smoothCacheSize
+      self.smoothBuilding = {} # (start, end) -> event that is set once that clip is built
+      self.smoothLock = threading.Lock()
       self.rifeSceneThr = rifeSceneThr
       self.device_index = device_index
+      self.diffsFile = diffsFile
+      self.diffsKey = json.dumps([probe.identity(source) if source is not None else None, clip.format.name, clip.width, clip.height, len(clip), clip.fps_num, clip.fps_den]) # what the saved differences must have been computed from
+      self.diffs = None  # PlaneStatsDiff of every frame
+      self.unique = None # sorted numbers of the frames that are not duplicates
+
+  def analyse(self):
+    # compute PlaneStatsDiff of the whole clip once, rendering frames in parallel, or load it from diffsFile
+    if self.diffs is not None:
+      return
+    if self.diffsFile is not None and os.path.exists(self.diffsFile):
+      try:
+        with numpy.load(self.diffsFile) as saved:
+          if str(saved['key']) == self.diffsKey and len(saved['diffs']) == len(self.clip):
+            self.diffs = saved['diffs']
+      except (OSError, ValueError, KeyError, TypeError, AttributeError): # not written by this version, or damaged
+        pass
+    if self.diffs is None:
+      self.diffs = numpy.fromiter((f.props['PlaneStatsDiff'] for f in self.clip.frames()), dtype=numpy.float32, count=len(self.clip))
+      if self.diffsFile is not None:
+        with open(self.diffsFile + '.temp', 'wb') as f: # never leave a half-written file
+          numpy.savez(f, diffs=self.diffs, key=numpy.array(self.diffsKey))
+        os.replace(self.diffsFile + '.temp', self.diffsFile)
+    self.unique = numpy.flatnonzero(self.diffs > self.thresh)
+
+  def previous_unique(self, n):
+    # last non duplicate frame at or before n, or None
+    i = numpy.searchsorted(self.unique, n, side='right') - 1
+    return int(self.unique[i]) if i >= 0 else None
+
+  def next_unique(self, n):
+    # first non duplicate frame at or after n, or None
+    i = numpy.searchsorted(self.unique, n, side='left')
+    return int(self.unique[i]) if i < len(self.unique) else None
           
   def interpolate(self, n, f):
     out = self.get_current_or_interpolate(n)
@@ -33,7 +83,7 @@ class FillDuplicateFrames:
       return out.text.Text(text="avg: "+str(f.props['PlaneStatsDiff']),alignment=8)
     return out
 
-  def interpolateWithRIFE(self, clip, n, start, end, rifeModel=22, rifeTTA=False, rifeUHD=False):
+  def interpolateWithRIFE(self, clip, start, end, rifeModel=22, rifeTTA=False, rifeUHD=False):
     if clip.format.id != vs.RGBS:
       raise ValueError(f'FillDuplicateFrames: "clip" needs to be RGBS when using \'{self.method}\'!')
       
@@ -41,25 +91,16 @@ class FillDuplicateFrames:
       clip = core.misc.SCDetect(clip=clip,threshold=self.rifeSceneThr)
     num = end - start
     
-    self.smooth = core.rife.RIFE(clip, model=rifeModel, factor_num=num, tta=rifeTTA,uhd=rifeUHD,gpu_id=self.device_index)
-    self.smooth_start = start
-    self.smooth_end   = end
-    return self.smooth[n-start]
+    return core.rife.RIFE(clip, model=rifeModel, factor_num=num, tta=rifeTTA,uhd=rifeUHD,gpu_id=self.device_index)
    
-  def interpolateWithMV(self, clip, n, start, end):   
+  def interpolateWithMV(self, clip, start, end):   
     num = end - start
     sup = core.mv.Super(clip, pel=2, hpad=0, vpad=0)
     bvec = core.mv.Analyse(sup, blksize=16, isb=True, chroma=True, search=3, searchparam=1)
     fvec = core.mv.Analyse(sup, blksize=16, isb=False, chroma=True, search=3, searchparam=1)
-    self.smooth = core.mv.FlowFPS(clip, sup, bvec, fvec, num=num, den=1, mask=2)
-    self.smooth_start = start
-    self.smooth_end   = end
-    out = self.smooth[n-start]
-    if self.debug:
-      return out.text.Text(text="MV",alignment=9)
-    return out
+    return core.mv.FlowFPS(clip, sup, bvec, fvec, num=num, den=1, mask=2)
 
-  def interpolateWithSVP(self, clip, n, start, end):   
+  def interpolateWithSVP(self, clip, start, end):   
     if clip.format.id != vs.YUV420P8:
       raise ValueError(f'FillDuplicateFrames: "clip" needs to be YUV420P8 when using \'{self.method}\'!')
     if self.method == 'SVP':
@@ -68,13 +109,46 @@ class FillDuplicateFrames:
       super = core.svp1.Super(clip,"{gpu:1}")
     vectors = core.svp1.Analyse(super["clip"],super["data"],clip,"{}")
     num = end - start
-    self.smooth = core.svp2.SmoothFps(clip,super["clip"],super["data"],vectors["clip"],vectors["data"],f"{{rate:{{num:{num},den:1,abs:true}}}}")
-    self.smooth_start = start
-    self.smooth_end   = end
-    out = self.smooth[n-start]
-    if self.debug:
-      return out.text.Text(text="SVP",alignment=9)
-    return out
+    return core.svp2.SmoothFps(clip,super["clip"],super["data"],vectors["clip"],vectors["data"],f"{{rate:{{num:{num},den:1,abs:true}}}}")
+
+  def build_smooth(self, start, end):
+    #interpolating two frame clip  into end-start+1 fps
+    clip = self.clip[start] + self.clip[end]
+    clip = clip.std.AssumeFPS(fpsnum=1, fpsden=1)
+    if self.method == 'SVP' or self.method == 'SVPcpu':  
+      return self.interpolateWithSVP(clip, start, end)
+    elif self.method == 'RIFE':
+      return self.interpolateWithRIFE(clip, start, end)
+    elif self.method == 'MV':
+      return self.interpolateWithMV(clip, start, end)
+    else:
+      raise ValueError(f'FillDuplicateFrames: "method" \'{self.method}\' is not supported atm.')
+
+  def get_smooth(self, start, end):
+    # interpolated clip for the run of duplicates between start and end, built once and shared between threads
+    key = (start, end)
+    while True:
+      with self.smoothLock:
+        if key in self.smoothCache:
+          self.smoothCache.move_to_end(key)
+          return self.smoothCache[key]
+        building = self.smoothBuilding.get(key)
+        if building is None: # nobody is building it yet, so this thread does
+          building = self.smoothBuilding[key] = threading.Event()
+          break
+      building.wait() # then look in the cache again
+
+    try:
+      smooth = self.build_smooth(start, end)
+      with self.smoothLock:
+        self.smoothCache[key] = smooth
+        while len(self.smoothCache) > self.smoothCacheSize:
+          self.smoothCache.popitem(last=False)
+    finally:
+      with self.smoothLock:
+        del self.smoothBuilding[key]
+      building.set()
+    return smooth
   
   def get_current_or_interpolate(self, n):
     if self.is_not_duplicate(n):
@@ -84,47 +158,31 @@ class FillDuplicateFrames:
       return self.clip[n]
 
     #dublicate frame, frame is interpolated
-    for start in reversed(range(n+1)):
-      if self.is_not_duplicate(start):
-        break
-    else: #there are all black frames preceding n, return current n frame // will be executed then for-look does not end with a break
+    start = self.previous_unique(n)
+    if start is None: #there are all black frames preceding n, return current n frame
       if self.debug:
         return self.clip[n].text.Text(text="Input (2)", alignment=9)
       return self.clip[n]
   
-    for end in range(n, len(self.clip)):
-      if self.is_not_duplicate(end):
-        break
-    else:
+    end = self.next_unique(n)
+    if end is None:
       #there are all duplicate frames to the end, return current n frame
       if self.debug:
         return self.clip[n].text.Text(text="Input(3)", alignment=9)
       return self.clip[n]
 
-    #does interpolated smooth clip exist for requested n frame? Use n frame from it.
-    if self.smooth is not None and start >= self.smooth_start and end <= self.smooth_end:
-      if self.debug:
-        return self.smooth[n-start].text.Text(text=self.method, alignment=9)
-      return self.smooth[n-start]
-
-    #interpolating two frame clip  into end-start+1 fps
-    clip = self.clip[start] + self.clip[end]
-    clip = clip.std.AssumeFPS(fpsnum=1, fpsden=1)
-    if self.method == 'SVP' or self.method == 'SVPcpu':  
-      return self.interpolateWithSVP(clip, n, start, end)
-    elif self.method == 'RIFE':
-      return self.interpolateWithRIFE(clip, n, start, end)
-    elif self.method == 'MV':
-      return self.interpolateWithMV(clip, n, start, end)
-    else:
-      raise ValueError(f'FillDuplicateFrames: "method" \'{self.method}\' is not supported atm.')
+    out = self.get_smooth(start, end)[n-start]
+    if self.debug:
+      return out.text.Text(text=self.method, alignment=9)
+    return out
 
   def is_not_duplicate(self, n):
-    return self.clip.get_frame(n).props['PlaneStatsDiff'] > self.thresh
+    return self.diffs[n] > self.thresh
   
   @property
   def out(self):
     self.clip = core.std.PlaneStats(self.clip, self.clip[0] + self.clip)
+    self.analyse()
     return core.std.FrameEval(self.clip, self.interpolate, prop_src=self.clip)
     
     
@@ -12,28 +12,17 @@ class Attachment:
 		self.aid = -1 #Filled by encode.py.
 		self.file_name = "" #Where the attachment is extracted to.
 
-	def from_mkv(self, mkv_attachment):
+	def from_mkvmerge(self, mkv_attachment):
+		"""
+		Fills in the metadata from an attachment in MKVMerge's JSON
+		identification.
+		:param mkv_attachment: One of the elements of "attachments" in the
+		identification.
+		"""
 		print("Parsing attachment:")
-		for line in mkv_attachment.split("\n"):
-			if line.startswith("|"):
-				line = line[1:]
-			line = line.strip()
-			if line.startswith("+"):
-				line = line[1:]
-			line = line.strip()
-
-			if line.startswith("File name: "):
-				line = line[len("File name: "):]
-				self.internal_name = line
-				print("  Internal name:", self.internal_name)
-			elif line.startswith("MIME type: "):
-				line = line[len("MIME type: "):]
-				self.mime = line
-				print("  MIME type:", self.mime)
-			elif line.startswith("File UID: "):
-				line = line[len("File UID: "):]
-				try:
-					self.uid = int(line)
-					print("  UID:", self.uid)
-				except ValueError: #Not an integer.
-					pass
+		self.internal_name = mkv_attachment.get("file_name", "")
+		print("  Internal name:", self.internal_name)
+		self.mime = mkv_attachment.get("content_type", "")
+		print("  MIME type:", self.mime)
+		self.uid = mkv_attachment.get("properties", {}).get("uid", -1)
+		print("  UID:", self.uid)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import json #To store the manifest.
+import os #To check whether files are still complete.
+import threading #To allow completing stages from multiple threads.
+
+import attachment #To restore attachment metadata.
+import track #To restore track metadata.
+
+class Manifest:
+	"""
+	Records which stages of a job are complete, and which files they produced.
+
+	The manifest is stored in the work directory of the job. When a job is
+	retried, every stage whose files are still there with the same size can be
+	skipped.
+	"""
+
+	def __init__(self, work_directory):
+		os.makedirs(work_directory, exist_ok=True)
+		self.file_name = os.path.join(work_directory, "manifest.json")
+		self.lock = threading.Lock()
+		self.stages = {}
+		if os.path.exists(self.file_name):
+			try:
+				with open(self.file_name) as f:
+					self.stages = json.load(f)
+			except ValueError: #Corrupt, e.g. because we crashed while writing it. Start over.
+				print("Manifest", self.file_name, "is corrupt. Starting over.")
+
+	def stage(self, name, check_files=True):
+		"""
+		Gets the results of a stage, if it was completed.
+		:param name: The name of the stage.
+		:param check_files: Whether all files produced by the stage need to be
+		complete still.
+		:return: The data stored with the stage, or None if the stage was not
+		completed or some of its files are missing or incomplete.
+		"""
+		with self.lock:
+			if name not in self.stages:
+				return None
+			stage = self.stages[name]
+		if check_files and not all(self.is_valid(file_name) for file_name in stage["files"]):
+			return None
+		return stage["data"]
+
+	def complete(self, name, files=(), data=None):
+		"""
+		Marks a stage as completed.
+		:param name: The name of the stage.
+		:param files: The files that the stage produced. They are considered
+		complete with their current size.
+		:param data: Any JSON-serialisable data to store with the stage.
+		"""
+		with self.lock:
+			self.stages[name] = {
+				"files": {file_name: os.path.getsize(file_name) for file_name in files},
+				"data": data
+			}
+			#Write to a temporary file first, so that the manifest is never half-written.
+			with open(self.file_name + ".temp", "w") as f:
+				json.dump(self.stages, f)
+			os.replace(self.file_name + ".temp", self.file_name)
+
+	def is_valid(self, file_name):
+		"""
+		Checks whether a file that a stage produced is still complete.
+		:param file_name: The file to check.
+		:return: True if the file still has the size it had when its stage was
+		completed, or False if it's missing, incomplete or not recorded.
+		"""
+		with self.lock:
+			for stage in self.stages.values():
+				if file_name in stage["files"]:
+					return os.path.exists(file_name) and os.path.getsize(file_name) == stage["files"][file_name]
+		return False
+
+def save_track(track_metadata):
+	"""
+	Converts the metadata of a track into something that can be stored in a
+	manifest.
+	"""
+	return dict(vars(track_metadata))
+
+def load_track(data):
+	"""
+	Restores the metadata of a track from a manifest.
+	"""
+	result = track.Track()
+	result.__dict__.update(data)
+	return result
+
+def save_attachment(attachment_metadata):
+	"""
+	Converts the metadata of an attachment into something that can be stored in
+	a manifest.
+	"""
+	return dict(vars(attachment_metadata))
+
+def load_attachment(data):
+	"""
+	Restores the metadata of an attachment from a manifest.
+	"""
+	result = attachment.Attachment()
+	result.__dict__.update(data)
+	return result
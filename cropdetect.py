@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+#Finds the black borders around the picture of a video, such as letterboxing.
+#This needs NumPy. It's imported when it's needed, so that the rest of Autoencode works without it.
+
+import sys #To report the crop without mixing it into the video that VSPipe writes to stdout.
+
+def border_bounds(frames, fuzz=0.1, maximum=255):
+	"""
+	Finds the part of a set of frames within their black borders.
+
+	The bounds include the picture of all of the frames, so that dark frames
+	don't get cropped further than the rest.
+	:param frames: The frames, as a NumPy array of frames by height by width,
+	optionally by channels. A single frame without the first dimension works
+	too.
+	:param fuzz: How bright a pixel may be to still count as black, as a
+	fraction of the maximum brightness. This is the same as ImageMagick's fuzz.
+	:param maximum: The maximum brightness of a pixel.
+	:return: The top, bottom, left and right bounds of the picture, with the
+	bottom and right bounds exclusive. If the frames are completely black, this
+	is the whole frame.
+	"""
+	import numpy
+
+	frames = numpy.asarray(frames)
+	if frames.ndim == 2: #A single frame without channels.
+		frames = frames[numpy.newaxis]
+	elif frames.ndim == 3 and frames.shape[-1] in (3, 4): #A single frame with channels.
+		frames = frames[numpy.newaxis]
+	if frames.ndim == 4: #Look at the brightest channel.
+		frames = frames.max(axis=3)
+	content = (frames > fuzz * maximum).any(axis=0)
+	rows = content.any(axis=1).nonzero()[0]
+	columns = content.any(axis=0).nonzero()[0]
+	if len(rows) == 0:
+		return 0, content.shape[0], 0, content.shape[1]
+	return int(rows[0]), int(rows[-1]) + 1, int(columns[0]), int(columns[-1]) + 1
+
+class ShotCropper:
+	"""
+	Crops a stream of frames with one crop box per shot.
+
+	The crop box of a shot is found from its first few frames, and then reused
+	for the rest of the shot. If a later frame of the shot has picture outside
+	of the box, the box is widened to include it, from that frame on. A new
+	shot starts when a frame is very different from the one before it.
+	"""
+
+	def __init__(self, sample_frames=24, scene_threshold=0.15, fuzz=0.1):
+		"""
+		Starts cropping a new stream.
+		:param sample_frames: How many frames at the start of each shot to find
+		the crop box from.
+		:param scene_threshold: How different two consecutive frames need to be
+		to start a new shot, from 0 to 1.
+		:param fuzz: How bright a pixel may be to still count as black, from 0
+		to 1.
+		"""
+		self.sample_frames = sample_frames
+		self.scene_threshold = scene_threshold
+		self.fuzz = fuzz
+		self.pending = [] #Frames of the current shot that are waiting for its crop box.
+		self.box = None #The crop box of the current shot, once it's known.
+		self.previous = None #A thumbnail of the previous frame, to detect shot changes.
+
+	def add(self, frame, data=None):
+		"""
+		Adds the next frame of the stream.
+		:param frame: The frame, as a NumPy array of height by width by
+		channels, with 8 bits per channel.
+		:param data: Anything to return along with the frame, such as its file
+		name.
+		:return: A list of (frame, data, box) for the frames whose crop box is
+		known now, in order. The box is the top, bottom, left and right bounds,
+		with the bottom and right bounds exclusive.
+		"""
+		import numpy
+
+		result = []
+		thumbnail = frame[::8, ::8].astype(numpy.int16)
+		if self.previous is not None and numpy.abs(thumbnail - self.previous).mean() > self.scene_threshold * 255:
+			result += self.flush() #New shot.
+		self.previous = thumbnail
+
+		if self.box is not None:
+			if frame.max() > self.fuzz * 255: #Completely black frames have no picture to include.
+				top, bottom, left, right = border_bounds(frame, self.fuzz)
+				self.box = (min(self.box[0], top), max(self.box[1], bottom), min(self.box[2], left), max(self.box[3], right))
+			result.append((frame, data, self.box))
+			return result
+		self.pending.append((frame, data))
+		if len(self.pending) >= self.sample_frames:
+			self.box = border_bounds([pending_frame for pending_frame, pending_data in self.pending], self.fuzz)
+			result += [(pending_frame, pending_data, self.box) for pending_frame, pending_data in self.pending]
+			self.pending = []
+		return result
+
+	def flush(self):
+		"""
+		Ends the current shot.
+		:return: A list of (frame, data, box) for the frames that were still
+		waiting for the crop box of the shot.
+		"""
+		result = []
+		if self.pending:
+			box = border_bounds([pending_frame for pending_frame, pending_data in self.pending], self.fuzz)
+			result = [(pending_frame, pending_data, box) for pending_frame, pending_data in self.pending]
+		self.pending = []
+		self.box = None
+		return result
+
+def find_crop(clip, samples=32, fuzz=0.1, modulo=2):
+	"""
+	Finds how much black border to crop off a VapourSynth clip.
+
+	The luma of frames spread evenly over the clip is combined, so the crop is
+	the same for the whole clip.
+	:param clip: The clip to analyse.
+	:param samples: How many frames to look at.
+	:param fuzz: How bright a pixel may be to still count as black, from 0 to
+	1.
+	:param modulo: The crop on each side is rounded down to a multiple of this,
+	to keep chroma subsampling intact.
+	:return: A dictionary with the left, right, top and bottom crop, as accepted
+	by std.Crop. If NumPy is not installed, nothing is cropped.
+	"""
+	try:
+		import numpy
+	except ImportError:
+		print("NumPy is not installed. Not cropping.", file=sys.stderr)
+		return {"left": 0, "right": 0, "top": 0, "bottom": 0}
+
+	samples = min(samples, clip.num_frames)
+	frames = []
+	for sample in range(samples):
+		frame = clip.get_frame(clip.num_frames * (2 * sample + 1) // (2 * samples))
+		frames.append(numpy.array(frame[0], copy=True)) #Luma only.
+	maximum = (1 << clip.format.bits_per_sample) - 1 if clip.format.sample_type == 0 else 1 #Integer or float samples.
+	top, bottom, left, right = border_bounds(numpy.stack(frames), fuzz, maximum)
+
+	def down(value):
+		return value // modulo * modulo
+	crop = {
+		"left": down(left),
+		"right": down(clip.width - right),
+		"top": down(top),
+		"bottom": down(clip.height - bottom)
+	}
+	print("Cropping", crop, file=sys.stderr)
+	return crop
+
+def crop_clip(clip, **kwargs):
+	"""
+	Crops the black borders off a VapourSynth clip.
+	:param clip: The clip to crop.
+	:param kwargs: Parameters for find_crop.
+	:return: The cropped clip.
+	"""
+	return clip.std.Crop(**find_crop(clip, **kwargs))
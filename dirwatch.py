@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import ctypes  # To call inotify in the C library.
+import ctypes.util  # To find the C library.
+import os  # To walk the directories to watch.
+import select  # To wait for events with a timeout.
+import struct  # To parse the inotify events.
+
+# Flags from sys/inotify.h.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+event_header = struct.Struct("iIII")  # Watch descriptor, mask, cookie, length of the name.
+
+class DirectoryWatcher:
+    """
+    Reports the files that are written or moved into a directory tree.
+
+    This uses Linux' inotify, so the directories don't need to be scanned to
+    find new files. Only files that were closed after writing or that were
+    moved into the tree are reported, so files are not reported while they are
+    still being copied.
+    """
+
+    def __init__(self, directory, exclude=()):
+        """
+        Starts watching a directory tree.
+        :param directory: The root of the tree to watch.
+        :param exclude: Directories that should not be watched, such as where
+        the output gets written.
+        """
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, "Could not initialise inotify: " + os.strerror(error))
+        self.exclude = set(exclude)
+        self.watches = {}  # For each watch descriptor, the directory it watches.
+        self.add_tree(directory)
+
+    def add_tree(self, directory):
+        """
+        Starts watching a directory and all of its subdirectories.
+        :param directory: The root of the tree to start watching.
+        :return: The files that are already in the tree. These may have been
+        written before the watch was in place.
+        """
+        files = []
+        for root, dirs, filenames in os.walk(directory):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) not in self.exclude]
+            watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(root), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if watch_descriptor < 0:
+                error = ctypes.get_errno()
+                print("Could not watch", root, ":", os.strerror(error))
+                continue
+            self.watches[watch_descriptor] = root
+            files += [os.path.join(root, filename) for filename in filenames]
+        return files
+
+    def read(self, timeout):
+        """
+        Waits for files to be written.
+        :param timeout: How long to wait for events, in seconds.
+        :return: A tuple of the files that were written or moved in, and whether
+        events were lost because the kernel's event queue overflowed. If events
+        were lost, the tree needs to be scanned to find all files.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], False
+
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return [], False
+        files = []
+        overflowed = False
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, cookie, name_length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            if mask & IN_IGNORED:  # Directory was deleted.
+                self.watches.pop(watch_descriptor, None)
+                continue
+            if watch_descriptor not in self.watches:
+                continue
+            path = os.path.join(self.watches[watch_descriptor], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and path not in self.exclude:
+                    files += self.add_tree(path)  # Files may have been placed in it before we started watching it.
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                files.append(path)
+        return files, overflowed
+
+    def close(self):
+        os.close(self.fd)
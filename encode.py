@@ -1,19 +1,72 @@
 #!/usr/bin/env python
 
 import argparse #To parse command line arguments.
+import concurrent.futures #To encode chunks of video in parallel.
 import errno #To recognise OS errors.
 import glob #To find concatenated files.
+import hashlib #To name index files after the identity of their source.
+import itertools #To give each parallel chunk encoder a NUMA node.
 import os #To delete files as clean-up.
 import os.path #To parse file names (used for file type detection).
 import re #To parse the stream info output.
 import shutil #To move files.
 import subprocess #To call the encoders and muxers.
+import sys #To find the Python interpreter for helper scripts.
+import threading #To not index the same file twice at the same time.
+import time #To find old index files.
 import uuid #To rename files to something that doesn't exist yet.
 
 import attachment #To demux attachments.
+import checkpoint #To resume jobs that were interrupted.
+import cropdetect #To crop the black borders off frames.
+import fingerprint #To skip duplicate titles of discs.
+import mvcache #To forget the motion vectors of finished encodes.
+import probe #To find the tracks in input files.
+import scratch #To place intermediate files on fast storage.
 import track #To demux tracks.
 
-def process(input_filename, output_filename, preset):
+#Where to keep the FFMS2 indexes of video sources, so that all passes and retries can reuse them. Set to None to index in the work directory.
+index_cache_directory = os.path.join(os.path.expanduser("~"), ".cache", "autoencode", "ffindex")
+#Indexes that weren't used for this many seconds are removed from the cache.
+index_cache_age = 30 * 24 * 3600
+#Where to keep the motion vectors of the filters, so that later passes and retries don't need to search them again. This takes a lot of space, so by default it's off.
+vector_cache_file = None
+#How many chunks of a video to encode at the same time. With 1, videos are encoded in one piece.
+parallel_chunks = 1
+#The presets whose videos get their black borders cropped off. Off by default, since a video whose edges are dark in every sampled frame would lose picture.
+crop_presets = []
+
+_streamed_codecs = ["flac", "aac", "truehd", "ac3", "dts", "h264", "h265", "mpg", "vc1"] #Codecs that get re-encoded, so they can be read from the MKV file instead of being extracted.
+_index_locks = {} #For each index file, a lock held while it's being created.
+_index_locks_lock = threading.Lock()
+
+def process(input_filename, output_filename, preset, guid=None, progress=None, on_title=None):
+	"""
+	Transcodes one input file with a preset.
+
+	Audio and video are processed in a work directory. Intermediate files are
+	placed on the scratch tiers configured in the scratch module, if any. If
+	processing fails, the work directory and the intermediate files are kept,
+	so that a retry with the same guid can skip all stages that were already
+	completed.
+	:param input_filename: The file to transcode.
+	:param output_filename: Where to store the result.
+	:param preset: The name of the preset to transcode with.
+	:param guid: The name of the work directory. To resume an earlier attempt,
+	this must be the same as in that attempt. If not given, a new one is
+	generated.
+	:param progress: A function that is called with the name of each stage of
+	the process once it's completed, and optionally the number of the track
+	that the stage applies to.
+	:param on_title: If the input is a disc, a function that is called with the
+	file name of each title as soon as it's extracted, so that it can be
+	encoded while the rest of the disc is still being extracted. If not given,
+	the titles are found when the directory is scanned again.
+	"""
+	def report(state, track_nr=None):
+		if progress is not None:
+			progress(state, track_nr=track_nr)
+
 	#Ensure that the path for the output filename exists.
 	try:
 		os.makedirs(os.path.dirname(output_filename))
@@ -33,7 +86,10 @@ def process(input_filename, output_filename, preset):
 	print("==== OUTPUT:", output_filename)
 	print("==== PRESET:", preset)
 
-	guid = uuid.uuid4().hex #A new file name that is almost guaranteed to not exist yet.
+	if guid is None:
+		guid = uuid.uuid4().hex #A new file name that is almost guaranteed to not exist yet.
+	workspace = scratch.Workspace(guid)
+	work_directory = workspace.directory
 	extension = os.path.splitext(input_filename)[1]
 	extension = extension.lower()
 
@@ -41,25 +97,16 @@ def process(input_filename, output_filename, preset):
 	try:
 		if preset == "uhd" or preset == "hdanime":
 			if extension == ".mkv":
-				#Demuxing.
-				tracks, attachments = extract_mkv(input_filename, guid) #Encoding.
-				dirty_files = [trk.file_name for trk in tracks] + [attachment.file_name for attachment in attachments]
-				for track_metadata in tracks:
-					if track_metadata.codec == "flac":
-						encode_opus(track_metadata)
-					elif track_metadata.codec == "aac" or track_metadata.codec == "truehd":
-						original_filename = track_metadata.file_name
-						encode_flac(track_metadata)
-						if os.path.exists(original_filename):
-							os.remove(original_filename)
-						encode_opus(track_metadata)
-					elif track_metadata.codec == "h264" or track_metadata.codec == "h265":
-						encode_h265(track_metadata, preset)
-					else:
-						print("Unknown codec:", track_metadata.codec)
-				#Muxing.
-				mux_mkv(tracks, attachments, guid, input_filename)
-				shutil.move(guid + "-out.mkv", output_filename)
+				manifest = checkpoint.Manifest(work_directory)
+				report("probing")
+				tracks, attachments = demux(manifest, workspace, lambda: extracted_size(input_filename, streaming=True), lambda prefix: extract_mkv(input_filename, prefix, streaming=True))
+				report("demuxed")
+				encode_tracks(tracks, preset, manifest, report, workspace)
+				report("encoded")
+				muxed_file = mux(manifest, tracks, attachments, workspace, input_filename)
+				report("muxed")
+				shutil.move(muxed_file, output_filename)
+				dirty_files += workspace.directories()
 			else:
 				raise Exception("Unknown file extension for UHD or HDAnime: {extension}".format(extension=extension))
 		elif preset == "hd":
@@ -67,37 +114,28 @@ def process(input_filename, output_filename, preset):
 				if os.path.basename(input_filename) != "index.bdmv" or os.path.basename(os.path.dirname(input_filename)) != "BDMV":
 					print("Skipping {input_filename} because it's not the right BDMV file.".format(input_filename=input_filename))
 				else:
-					split_bluray(os.path.dirname(os.path.dirname(input_filename)))
+					manifest = checkpoint.Manifest(work_directory)
+					split_bluray(os.path.dirname(os.path.dirname(input_filename)), on_title, manifest=manifest)
 					#After splitting the blu-ray, delete all original blu-ray files. Instead we'll process the split versions.
 					dirty_files.append(os.path.dirname(input_filename))
+					dirty_files += workspace.directories()
 			elif extension == ".m2ts":
 				all_paths = [input_filename]
 				if os.path.exists(os.path.join(os.path.dirname(os.path.dirname(input_filename)), "index.bdmv")):
 					#If there is an index.bdmv file, skip all .m2ts files and process that one instead as titles.
 					print("Skipping {input_filename} because there is an index.bdmv file with titles.".format(input_filename=input_filename))
 				else:
-					#Demuxing.
-					tracks = extract_m2ts(input_filename, guid)
-					dirty_files = [trk.file_name for trk in tracks]
-					for track_metadata in tracks:
-						if track_metadata.codec in ["flac", "ac3", "pcm_bluray", "dts"]:
-							original_filename = track_metadata.file_name
-							encode_flac(track_metadata)
-							if os.path.exists(original_filename):
-								os.remove(original_filename)
-							encode_opus(track_metadata)
-							dirty_files.append(track_metadata.file_name)
-						elif track_metadata.codec in ["mpg", "h264", "vc1"]:
-							encode_h265(track_metadata, preset)
-							dirty_files.append(track_metadata.file_name)
-						elif track_metadata.codec == "pgs":
-							pass #Leave image-encoded subs as-is for now.
-						else:
-							print("Unknown codec:", track_metadata.codec)
-					#Muxing.
-					mux_mkv(tracks, [], guid, input_filename)
-					shutil.move(guid + "-out.mkv", os.path.splitext(output_filename)[0] + ".mkv")
+					manifest = checkpoint.Manifest(work_directory)
+					report("probing")
+					tracks, attachments = demux(manifest, workspace, lambda: file_size(input_filename), lambda prefix: (extract_m2ts(input_filename, prefix), []))
+					report("demuxed")
+					encode_tracks(tracks, preset, manifest, report, workspace)
+					report("encoded")
+					muxed_file = mux(manifest, tracks, [], workspace, input_filename)
+					report("muxed")
+					shutil.move(muxed_file, os.path.splitext(output_filename)[0] + ".mkv")
 					dirty_files += all_paths
+					dirty_files += workspace.directories()
 			else:
 				raise Exception("Unknown file extension for HD: {extension}".format(extension=extension))
 		elif preset == "dvd" or preset == "dedup" or preset == "dvd-lo":
@@ -107,8 +145,8 @@ def process(input_filename, output_filename, preset):
 				all_paths = [input_filename]
 				#Only process the zeroth file of DVD files.
 				match = re.search(r"VTS_\d+_(\d+).VOB$", input_filename)
-				if os.path.exists(os.path.join(os.path.dirname(input_filename), "VIDEO_TS.IFO")):
-					#If there is a VIDEO_TS.IFO file, skip all .VOB files and process that one instead as titles.
+				if os.path.basename(input_filename).upper().startswith("VTS_") and os.path.exists(os.path.join(os.path.dirname(input_filename), "VIDEO_TS.IFO")):
+					#If there is a VIDEO_TS.IFO file, skip all .VOB files of the DVD and process that one instead as titles. Titles that were already extracted from it can be processed.
 					print("Skipping {input_filename} because there is an .IFO file with titles.".format(input_filename=input_filename))
 				elif match:
 					basename = input_filename[:-len(match.group(1)) - 4]
@@ -140,43 +178,35 @@ def process(input_filename, output_filename, preset):
 						input_ffmpegname = input_filename
 
 				if input_ffmpegname is not None:
-					#Demuxing.
+					manifest = checkpoint.Manifest(work_directory)
+					report("probing")
 					if extension == ".vob":
-						tracks = extract_vob(input_ffmpegname, guid)
+						tracks, attachments = demux(manifest, workspace, lambda: file_size(input_ffmpegname), lambda prefix: (extract_vob(input_ffmpegname, prefix), []))
 					elif extension == ".m2ts":
-						tracks = extract_m2ts(input_ffmpegname, guid)
+						tracks, attachments = demux(manifest, workspace, lambda: file_size(input_ffmpegname), lambda prefix: (extract_m2ts(input_ffmpegname, prefix), []))
 					else:
 						raise Exception("Did you forget to add an extract function for the new container format?")
-					dirty_files = [trk.file_name for trk in tracks]
-					for track_metadata in tracks:
-						if track_metadata.codec == "ac3":
-							original_filename = track_metadata.file_name
-							encode_flac(track_metadata)
-							if os.path.exists(original_filename):
-								os.remove(original_filename)
-							encode_opus(track_metadata)
-							dirty_files.append(track_metadata.file_name)
-						elif track_metadata.codec in ["mpg", "h264", "vc1"]:
-							encode_h265(track_metadata, preset)
-							dirty_files.append(track_metadata.file_name)
-						elif track_metadata.codec == "sub":
-							pass #Leave image-encoded subs as-is for now.
-						else:
-							print("Unknown codec:", track_metadata.codec)
-					#Muxing.
-					mux_mkv(tracks, [], guid, input_filename)
-					shutil.move(guid + "-out.mkv", os.path.splitext(output_filename)[0] + ".mkv")
+					report("demuxed")
+					encode_tracks(tracks, preset, manifest, report, workspace)
+					report("encoded")
+					muxed_file = mux(manifest, tracks, [], workspace, input_filename)
+					report("muxed")
+					shutil.move(muxed_file, os.path.splitext(output_filename)[0] + ".mkv")
 					dirty_files += all_paths
+					dirty_files += workspace.directories()
 			elif extension == ".ifo":
 				if os.path.basename(input_filename) != "VIDEO_TS.IFO":
 					print("Skipping {input_filename} because it's not the right IFO file.".format(input_filename=input_filename))
 				else:
-					split_dvd(os.path.dirname(input_filename))
+					dvd_directory = os.path.dirname(input_filename)
+					manifest = checkpoint.Manifest(work_directory)
+					split_dvd(dvd_directory, on_title, manifest=manifest)
 					# After splitting the DVD, delete all original DVD files. Instead we'll process the split versions.
-					dirty_files += list(glob.glob("VTS_*_*.VOB"))
-					dirty_files += list(glob.glob("VTS_*_*.BUP"))
-					dirty_files += list(glob.glob("VTS_*_*.IFO"))
-					dirty_files += ["VIDEO_TS.IFO", "VIDEO_TS.BUP", "VIDEO_TS.VOB"]
+					dirty_files += list(glob.glob(os.path.join(glob.escape(dvd_directory), "VTS_*_*.VOB")))
+					dirty_files += list(glob.glob(os.path.join(glob.escape(dvd_directory), "VTS_*_*.BUP")))
+					dirty_files += list(glob.glob(os.path.join(glob.escape(dvd_directory), "VTS_*_*.IFO")))
+					dirty_files += [os.path.join(dvd_directory, file_name) for file_name in ["VIDEO_TS.IFO", "VIDEO_TS.BUP", "VIDEO_TS.VOB"]]
+					dirty_files += workspace.directories()
 			else:
 				raise Exception("Unknown file extension for DVD: {extension}".format(extension=extension))
 		elif preset == "strip_subs":
@@ -203,9 +233,9 @@ def process(input_filename, output_filename, preset):
 				frames = extract_video_frames(input_filename)
 				dirty_files = [input_filename]
 				output_directory = os.path.dirname(output_filename)
+				encode_jpgs(frames)
 				for frame in frames:
-					encode_jpg(frame)
-					frame_output = os.path.join(output_directory, frame.file_name[:-4])
+					frame_output = os.path.join(output_directory, os.path.basename(frame.file_name)[:-4])
 					shutil.move(frame.file_name, frame_output)
 			else:
 				raise Exception("Unknown file extension for JPG: {extension}".format(extension=extension))
@@ -219,9 +249,8 @@ def process(input_filename, output_filename, preset):
 			elif extension in [".mp3", ".aax", ".aa", ".acm", ".bfstm", ".brstm", ".caf", ".genh", ".mp2", ".mp4", ".msf", ".midi", ".ogg", ".ac3", ".dts", ".pcm", ".rm", ".rl2", ".ta", ".wma", ".aac", ".alac", ".mp1", ".opus", ".vmd", ".tta", ".m4a", ".wv"]:
 				trk = track.Track()
 				trk.file_name = input_filename
-				encode_flac(trk)
-				dirty_files = [input_filename, trk.file_name]
-				encode_opus(trk)
+				dirty_files = [input_filename]
+				encode_opus_streaming(trk)
 				shutil.move(trk.file_name, os.path.splitext(output_filename)[0] + ".opus")
 			else:
 				raise Exception("Unknown file extension for Opus: {extension}".format(extension=extension))
@@ -247,20 +276,169 @@ def process(input_filename, output_filename, preset):
 			raise Exception("Unknown preset: {preset}".format(preset=preset))
 	finally:
 		clean(dirty_files) #Clean up after any mistakes.
+		workspace.close()
+
+def demux(manifest, workspace, size, extract):
+	"""
+	Demuxes an input file, unless an earlier attempt already did so.
+
+	The space for the demuxed files is only claimed while demuxing. Afterwards
+	the files are on disk, so they count towards the used space themselves.
+	:param manifest: The manifest of the job.
+	:param workspace: The scratch directories of the job.
+	:param size: A function that estimates how many bytes the demuxed files
+	take together.
+	:param extract: A function that demuxes the input file to a path prefix,
+	returning a list of tracks and a list of attachments.
+	:return: The tracks and attachments of the input file.
+	"""
+	stage = manifest.stage("demux", check_files=False)
+	if stage is not None:
+		tracks = [checkpoint.load_track(data) for data in stage["tracks"]]
+		attachments = [checkpoint.load_attachment(data) for data in stage["attachments"]]
+		#Tracks that were already encoded don't need their demuxed file any more.
+		tracks_complete = all(manifest.stage("track" + str(trk.track_nr)) is not None or manifest.is_valid(trk.file_name) or os.path.exists(trk.source_file) for trk in tracks)
+		attachments_complete = all(manifest.is_valid(attachment_metadata.file_name) for attachment_metadata in attachments)
+		if tracks_complete and attachments_complete:
+			print("---- Resuming after demuxing.")
+			return tracks, attachments
+
+	prefix = workspace.prefix(size())
+	try:
+		tracks, attachments = extract(prefix)
+	finally:
+		workspace.release(prefix)
+	files = [trk.file_name for trk in tracks] + [attachment_metadata.file_name for attachment_metadata in attachments]
+	manifest.complete("demux", [file_name for file_name in files if os.path.exists(file_name)], {
+		"tracks": [checkpoint.save_track(trk) for trk in tracks],
+		"attachments": [checkpoint.save_attachment(attachment_metadata) for attachment_metadata in attachments]
+	})
+	return tracks, attachments
+
+def encode_tracks(tracks, preset, manifest, report, workspace=None, audio_workers=2):
+	"""
+	Encodes all tracks of a title, except the ones that an earlier attempt
+	already encoded.
+
+	The video tracks are encoded one by one, since the video encoder uses most
+	of the cores anyway. Meanwhile, the other tracks are encoded on a small
+	pool of side threads. This returns once all tracks are encoded.
+	:param tracks: The tracks to encode. The metadata of these tracks is updated
+	to refer to the encoded files.
+	:param preset: The preset to encode with.
+	:param manifest: The manifest of the job.
+	:param report: A function to call when a track is encoded.
+	:param workspace: Where to place the intermediate files, or None to place
+	them next to the demuxed tracks.
+	:param audio_workers: How many tracks to encode at the same time next to
+	the video.
+	"""
+	def encode_one(index):
+		track_metadata = tracks[index]
+		stage_name = "track" + str(track_metadata.track_nr)
+		stage = manifest.stage(stage_name)
+		if stage is not None:
+			print("---- Resuming after encoding track", track_metadata.track_nr)
+			tracks[index] = checkpoint.load_track(stage)
+			return
+		encode_track(track_metadata, preset, manifest, workspace)
+		manifest.complete(stage_name, [track_metadata.file_name], checkpoint.save_track(track_metadata))
+		report("encoded", track_metadata.track_nr)
+
+	#If the video fails, the side tasks still finish. They're checkpointed, so a retry doesn't need to redo them.
+	with concurrent.futures.ThreadPoolExecutor(max_workers=audio_workers) as side_pool:
+		side_tasks = [side_pool.submit(encode_one, index) for index, track_metadata in enumerate(tracks) if track_metadata.type != "video"]
+		for index, track_metadata in enumerate(tracks):
+			if track_metadata.type == "video":
+				encode_one(index)
+		for task in side_tasks:
+			task.result() #Raises the exception if the task failed.
+
+def encode_track(track_metadata, preset, manifest=None, workspace=None):
+	"""
+	Encodes one demuxed track with the encoder appropriate for its codec.
+	:param track_metadata: The track to encode.
+	:param preset: The preset to encode with.
+	:param manifest: The manifest of the job, to be able to resume halfway
+	through a video encode.
+	:param workspace: Where to place the intermediate files, or None to place
+	them next to the demuxed track.
+	"""
+	if track_metadata.codec == "flac" and not track_metadata.source_file:
+		encode_opus(track_metadata, workspace)
+	elif track_metadata.codec in ["flac", "aac", "truehd", "ac3", "dts", "pcm_bluray"]:
+		encode_opus_streaming(track_metadata, workspace)
+	elif track_metadata.codec in ["h264", "h265", "mpg", "vc1"]:
+		encode_h265(track_metadata, preset, parallel_chunks=parallel_chunks, manifest=manifest, workspace=workspace)
+	elif track_metadata.codec in ["ass", "srt", "pgs", "sub"]:
+		pass #Leave subtitles as-is for now.
+	else:
+		print("Unknown codec:", track_metadata.codec)
+
+def mux(manifest, tracks, attachments, workspace, input_filename):
+	"""
+	Muxes the encoded tracks into an MKV file, unless an earlier attempt already
+	did so.
+	:param manifest: The manifest of the job.
+	:param tracks: The encoded tracks.
+	:param attachments: The attachments to include.
+	:param workspace: Where to place the muxed file.
+	:param input_filename: The original input file, to get the title from.
+	:return: The muxed file.
+	"""
+	stage = manifest.stage("mux")
+	if stage is not None:
+		print("---- Resuming after muxing.")
+		return stage["file_name"]
+	size = sum(file_size(trk.file_name) for trk in tracks) + sum(file_size(attachment_metadata.file_name) for attachment_metadata in attachments)
+	new_file_name = workspace.file(workspace.guid + "-out.mkv", size)
+	mux_mkv(tracks, attachments, new_file_name, input_filename)
+	manifest.complete("mux", [new_file_name], {"file_name": new_file_name})
+	return new_file_name
 
 def clean(files):
 	"""Cleans up the changes we made after everything is done."""
 	for file in files:
 		if os.path.isdir(file):
 			shutil.rmtree(file)
+			continue
 		try:
 			os.remove(file)
 		except Exception as e:
 			print(e)
 
-def split_dvd(in_directory):
-	if os.path.exists(os.path.join(in_directory, "title1.VOB")) or os.path.exists(os.path.join(in_directory, "title1-1.VOB")):
-		raise Exception("Already extracted a DVD here. Will not override.")
+def file_size(file_name, default=0):
+	"""
+	Gets the size of a file, to estimate how much space its intermediates take.
+	:param file_name: The file to measure. This may be a concat: URL, in which
+	case the concatenated files are added up.
+	:param default: The size to assume if the file doesn't exist.
+	:return: The size of the file in bytes.
+	"""
+	if file_name.startswith("concat:"):
+		return sum(file_size(part, default) for part in file_name[len("concat:"):].split("|"))
+	try:
+		return os.path.getsize(file_name)
+	except OSError:
+		return default
+
+def split_dvd(in_directory, on_title=None, workers=2, manifest=None):
+	"""
+	Extracts every title and angle of a DVD to a separate VOB file.
+
+	A few titles are extracted at the same time. Each title is written to a
+	.part file first, and renamed once it's complete and not a repeat of
+	another title. Titles that play the same cells as other titles are not
+	extracted, and neither are titles that play all of the other titles in a
+	row.
+	:param in_directory: The VIDEO_TS directory of the DVD.
+	:param on_title: A function that is called with the file name of each title
+	once it's extracted, so that it can be encoded while the other titles are
+	still being extracted.
+	:param workers: How many titles to extract at the same time.
+	:param manifest: The manifest of the job, to record which titles are
+	done. A retry then only extracts the other titles.
+	"""
 	list_command = ["lsdvd", "-x", in_directory]
 	print(list_command)
 	process = subprocess.Popen(list_command, stdout=subprocess.PIPE)
@@ -271,6 +449,7 @@ def split_dvd(in_directory):
 
 	cout = cout.decode("Latin-1")
 	lines = cout.split("\n")
+	extractions = []
 	for line_nr, line in enumerate(lines):
 		if line.startswith("Title: "):
 			title_pos = len("Title: ")
@@ -279,22 +458,53 @@ def split_dvd(in_directory):
 			title_nr = str(int(line[title_pos:title_pos + 2]))
 			num_cells = str(int(line[cells_pos:cells_pos + 2]))
 			num_angles = int(lines[line_nr + 3][angles_pos:])
+			duration = fingerprint.parse_duration(re.search(r"Length: ([\d:.]+)", line).group(1))
+
+			#The cells of the title identify its content. They're listed until the next title.
+			vts = ""
+			segments = []
+			for detail in lines[line_nr + 1:]:
+				if detail.startswith("Title: "):
+					break
+				match = re.search(r"VTS: (\d+)", detail)
+				if match:
+					vts = match.group(1)
+				match = re.search(r"Cell: *\d+, Length: [\d:.]+.*First sector: *(\w+), *Last sector: *(\w+)", detail, re.IGNORECASE)
+				if match: #Only if this version of lsdvd lists where the cells are.
+					segments.append((vts, match.group(1), match.group(2)))
 
 			for this_angle in range(num_angles):
 				anglepart = ""
 				if num_angles > 1:
 					anglepart = "-" + str(this_angle + 1)
-				extract_command = ["mplayer", "dvd://" + title_nr, "-dvd-device", in_directory, "-chapter", "0-" + num_cells, "-dvdangle", str(this_angle + 1), "-dumpstream", "-dumpfile", os.path.join(in_directory, "title" + title_nr + anglepart + ".VOB")]
-				print(extract_command)
-				process = subprocess.Popen(extract_command, stdout=subprocess.PIPE)
-				(cout, cerr) = process.communicate()
-				exit_code = process.wait()
-				if exit_code != 0:
-					raise Exception("Calling mplayer resulted in exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cout.decode("utf-8")))
-
-def split_bluray(in_directory):
-	if os.path.exists(os.path.join(in_directory, "title1.m2ts")):
-		raise Exception("Already extracted a blu-ray here. Will not override.")
+				title = fingerprint.Title()
+				title.title_nr = int(title_nr)
+				title.angle = this_angle + 1
+				title.duration = duration
+				title.segments = segments
+				title.file_name = os.path.join(in_directory, "title" + title_nr + anglepart + ".VOB")
+				extract_command = ["mplayer", "dvd://" + title_nr, "-dvd-device", in_directory, "-chapter", "0-" + num_cells, "-dvdangle", str(this_angle + 1), "-dumpstream", "-dumpfile", title.file_name + ".part"]
+				extractions.append((extract_command, title))
+	extract_titles(extractions, on_title, workers, manifest)
+
+def split_bluray(in_directory, on_title=None, workers=2, manifest=None):
+	"""
+	Extracts every title and angle of a Blu-ray to a separate M2TS file.
+
+	A few titles are extracted at the same time. Each title is written to a
+	.part file first, and renamed once it's complete and not a repeat of
+	another title. Titles that play the same clips as other titles are not
+	extracted, and neither are titles that play all of the other titles in a
+	row.
+	:param in_directory: The root directory of the Blu-ray, containing the
+	BDMV directory.
+	:param on_title: A function that is called with the file name of each title
+	once it's extracted, so that it can be encoded while the other titles are
+	still being extracted.
+	:param workers: How many titles to extract at the same time.
+	:param manifest: The manifest of the job, to record which titles are
+	done. A retry then only extracts the other titles.
+	"""
 	list_command = ["bd_list_titles", in_directory]
 	print(list_command)
 	process = subprocess.Popen(list_command, stdout=subprocess.PIPE)
@@ -305,71 +515,211 @@ def split_bluray(in_directory):
 
 	cout = cout.decode("Latin-1")
 	lines = cout.split("\n")
+	extractions = []
 	for line in lines:
 		if line.startswith("index:"):
 			title_pos = len("index:")
 			angles_pos = len("index: XXX duration: XX:XX:XX chapters: XXX angles:")
 			title_nr = str(int(line[title_pos:title_pos + 4].strip()))
 			num_angles = int(line[angles_pos:angles_pos + 3].strip())
+			duration = fingerprint.parse_duration(re.search(r"duration: ([\d:]+)", line).group(1))
+			#The clips that the playlist plays identify its content.
+			match = re.search(r"playlist: (\d+)", line)
+			segments = fingerprint.mpls_segments(fingerprint.bluray_playlist(in_directory, int(match.group(1)))) if match else []
 
 			for this_angle in range(num_angles):
 				anglepart = ""
 				if num_angles > 1:
 					anglepart = "-" + str(this_angle + 1)
-				extract_command = ["bd_splice", "-t", title_nr, "-a", str(this_angle + 1), in_directory, os.path.join(in_directory, "title" + title_nr + anglepart + ".m2ts")]
-				print(extract_command)
-				process = subprocess.Popen(extract_command, stdout=subprocess.PIPE)
-				(cout, cerr) = process.communicate()
-				exit_code = process.wait()
-				if exit_code != 0:
-					raise Exception("Calling bd_splice resulted in exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cout.decode("utf-8")))
+				title = fingerprint.Title()
+				title.title_nr = int(title_nr)
+				title.angle = this_angle + 1
+				title.duration = duration
+				title.segments = segments
+				title.file_name = os.path.join(in_directory, "title" + title_nr + anglepart + ".m2ts")
+				extract_command = ["bd_splice", "-t", title_nr, "-a", str(this_angle + 1), in_directory, title.file_name + ".part"]
+				extractions.append((extract_command, title))
+	extract_titles(extractions, on_title, workers, manifest)
+
+def extract_titles(extractions, on_title, workers, manifest=None):
+	"""
+	Runs the extraction commands of the titles of a disc, except for titles
+	that repeat other titles.
+
+	Titles that are about equally long may have the same content. Once such a
+	title is extracted, frames sampled from it are compared with the titles of
+	its group that were kept so far. If it has the same content as one of
+	those, it's deleted. Otherwise it's kept right away, so that it can be
+	encoded while the rest of its group is still being extracted. Until then,
+	each title keeps its .part name, so that nothing picks it up yet.
+
+	Titles that an earlier attempt already finished are not extracted again.
+	Their files may already be encoded and gone, so the sampled frames of the
+	kept ones are taken from the manifest. The .part files of titles that
+	weren't finished are removed, both before starting and when the extraction
+	fails.
+	:param extractions: A list of tuples with the command that extracts each
+	title to its .part file, and the fingerprint.Title it extracts.
+	:param on_title: A function that is called with the file name of each title
+	once it's extracted, or None.
+	:param workers: How many titles to extract at the same time.
+	:param manifest: The manifest of the job, to record which titles are
+	finished, or None.
+	"""
+	skip = fingerprint.find_duplicates([title for extract_command, title in extractions])
+	for title, reason in skip.items():
+		print("Skipping {title} because it {reason}.".format(title=repr(title), reason=reason))
+	extractions = [(extract_command, title) for extract_command, title in extractions if title not in skip]
+	groups = fingerprint.candidate_groups([title for extract_command, title in extractions])
+	group_of = {title: group_nr for group_nr, group in enumerate(groups) for title in group}
+	kept = [[] for group in groups] #For each group, the titles that were kept so far, with their sampled frames.
+	lock = threading.Lock()
+
+	def stage_name(title):
+		return "title " + os.path.basename(title.file_name)
+
+	if manifest is not None:
+		remaining = []
+		for extract_command, title in extractions:
+			stage = manifest.stage(stage_name(title), check_files=False)
+			if stage is None:
+				remaining.append((extract_command, title))
+				continue
+			print("Skipping {title} because an earlier attempt already extracted it.".format(title=repr(title)))
+			if title in group_of and not stage["duplicate"]:
+				kept[group_of[title]].append((title, [bytes.fromhex(thumbnail) for thumbnail in stage.get("hashes", [])]))
+		extractions = remaining
+	for extract_command, title in extractions: #Left over from an earlier attempt that was interrupted.
+		if os.path.exists(title.file_name + ".part"):
+			os.remove(title.file_name + ".part")
+
+	def extract(extract_command, title):
+		print(extract_command)
+		process = subprocess.Popen(extract_command, stdout=subprocess.PIPE)
+		(cout, cerr) = process.communicate()
+		exit_code = process.wait()
+		if exit_code != 0:
+			raise Exception("Calling {program} resulted in exit code {exit_code}. CERR: {cerr}".format(program=extract_command[0], exit_code=exit_code, cerr=cout.decode("utf-8")))
+
+		hashes = []
+		if title in group_of:
+			hashes = fingerprint.frame_hashes(title.file_name + ".part", title.duration)
+			with lock: #Titles that finish at the same time are compared with each other too.
+				group = kept[group_of[title]]
+				original = next((other for other, other_hashes in group if fingerprint.same_content(hashes, other_hashes)), None)
+				if original is None:
+					group.append((title, hashes))
+			if original is not None:
+				print("Removing {title} because it has the same frames as {original}.".format(title=repr(title), original=repr(original)))
+				os.remove(title.file_name + ".part")
+				if manifest is not None:
+					manifest.complete(stage_name(title), data={"duplicate": True})
+				return
+		os.replace(title.file_name + ".part", title.file_name) #Only now it's complete.
+		if manifest is not None:
+			manifest.complete(stage_name(title), data={"duplicate": False, "hashes": [thumbnail.hex() for thumbnail in hashes]})
+		if on_title is not None:
+			on_title(title.file_name)
 
-def extract_mkv(in_mkv, guid):
-	"""Extracts an MKV file into its components."""
+	try:
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+			futures = [executor.submit(extract, extract_command, title) for extract_command, title in extractions]
+			try:
+				for future in futures:
+					future.result()
+			except Exception:
+				for future in futures: #Don't start on any more titles if one of them failed.
+					future.cancel()
+				raise
+	except Exception:
+		#The titles that were still being extracted have finished by now. A retry starts the unfinished ones over.
+		for extract_command, title in extractions:
+			if os.path.exists(title.file_name + ".part"):
+				os.remove(title.file_name + ".part")
+		raise
+
+def extracted_size(in_mkv, info=None, streaming=False):
+	"""
+	Estimates how much space extracting an MKV file takes.
+	:param in_mkv: The MKV file to extract.
+	:param info: MKVMerge's identification of the file, if it was already
+	probed.
+	:param streaming: Whether the tracks that get re-encoded are read from the
+	MKV file instead of being extracted, as with extract_mkv.
+	:return: The number of bytes that the extracted tracks and attachments take
+	together.
+	"""
+	if info is None:
+		info = probe.mkvmerge(in_mkv)
+	duration = info.get("container", {}).get("properties", {}).get("duration", 0) / 1000000000.0 #In nanoseconds.
+	size = 0
+	for track_info in info.get("tracks", []):
+		new_track = track.Track()
+		new_track.from_mkvmerge(track_info, duration)
+		if streaming and new_track.codec in _streamed_codecs:
+			continue
+		properties = track_info.get("properties", {})
+		if properties.get("tag_number_of_bytes"): #Statistics tags written by MKVMerge.
+			size += int(properties["tag_number_of_bytes"])
+		elif properties.get("tag_bps") and duration:
+			size += int(int(properties["tag_bps"]) * duration / 8)
+		else: #Without statistics, the track could be as big as the whole file.
+			return file_size(in_mkv)
+	for attachment_info in info.get("attachments", []):
+		size += attachment_info.get("size", 0)
+	return size
+
+def extract_mkv(in_mkv, guid, info=None, streaming=False):
+	"""
+	Extracts an MKV file into its components.
+	:param in_mkv: The MKV file to extract.
+	:param guid: The prefix for the extracted files.
+	:param info: MKVMerge's identification of the file, if it was already
+	probed.
+	:param streaming: If set, audio and video tracks that get re-encoded are not
+	extracted. Instead their source_file and source_index refer to the track in
+	the MKV file, so that the encoders read them from there directly.
+	"""
 	#Find all tracks and attachments in the MKV file.
-	mkvinfo_command = ["mkvinfo", in_mkv]
-	print(mkvinfo_command)
-	process = subprocess.Popen(mkvinfo_command, stdout=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	exit_code = process.wait()
-	if exit_code != 0: #0 is success.
-		raise Exception("Calling MKVInfo failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cerr.decode("utf-8")))
-	mkvinfo = cout.decode("utf-8")
+	if info is None:
+		info = probe.mkvmerge(in_mkv)
+	duration = info.get("container", {}).get("properties", {}).get("duration", 0) / 1000000000.0 #In nanoseconds.
 	tracks = []
 	attachments = []
-	for segment in mkvinfo.split("+ Segment: size")[1:]:
-		for segment_item in segment.split("|+ ")[1:]:
-			if segment_item.startswith("Tracks"):
-				for track_metadata in segment_item.split("| + Track")[1:]:
-					new_track = track.Track()
-					new_track.from_mkv(track_metadata)
-					new_track.file_name = guid + "-T" + str(new_track.track_nr)
-					tracks.append(new_track)
-			if segment_item.startswith("Attachments"):
-				for attachment_metadata in segment_item.split("| + Attached")[1:]:
-					new_attachment = attachment.Attachment()
-					new_attachment.from_mkv(attachment_metadata)
-					attachments.append(new_attachment)
-					new_attachment.aid = len(attachments)
-					new_attachment.file_name = guid + "-A" + str(new_attachment.aid)
+	for track_info in info.get("tracks", []):
+		new_track = track.Track()
+		new_track.from_mkvmerge(track_info, duration)
+		new_track.file_name = guid + "-T" + str(new_track.track_nr)
+		if streaming and new_track.codec in _streamed_codecs: #Only tracks that get re-encoded. Others are muxed as extracted.
+			new_track.source_file = in_mkv
+			new_track.source_index = new_track.track_nr #MKVMerge's track IDs follow the same order as FFmpeg's and FFMS2's stream indices.
+		tracks.append(new_track)
+	for attachment_info in info.get("attachments", []):
+		new_attachment = attachment.Attachment()
+		new_attachment.from_mkvmerge(attachment_info)
+		new_attachment.aid = attachment_info["id"]
+		new_attachment.file_name = guid + "-A" + str(new_attachment.aid)
+		attachments.append(new_attachment)
 
 	#Generate the parameters to pass to mkvextract.
 	track_params = []
 	for track_metadata in tracks:
-		track_params.append(str(track_metadata.track_nr) + ":" + track_metadata.file_name)
+		if not track_metadata.source_file: #Streamed tracks don't need to be extracted.
+			track_params.append(str(track_metadata.track_nr) + ":" + track_metadata.file_name)
 	attachment_params = []
 	for attachment_metadata in attachments:
 		attachment_params.append(str(attachment_metadata.aid) + ":" + attachment_metadata.file_name)
 
 	#Extract all tracks and attachments.
-	print("---- Extacting tracks...")
-	extract_params = ["mkvextract", in_mkv, "tracks"] + track_params
-	print(extract_params)
-	process = subprocess.Popen(extract_params, stdout=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	exit_code = process.wait()
-	if exit_code != 0 and exit_code != 1: #0 is success. 1 is warnings.
-		raise Exception("Calling MKVExtract on tracks failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cout.decode("utf-8")))
+	if track_params:
+		print("---- Extacting tracks...")
+		extract_params = ["mkvextract", in_mkv, "tracks"] + track_params
+		print(extract_params)
+		process = subprocess.Popen(extract_params, stdout=subprocess.PIPE)
+		(cout, cerr) = process.communicate()
+		exit_code = process.wait()
+		if exit_code != 0 and exit_code != 1: #0 is success. 1 is warnings.
+			raise Exception("Calling MKVExtract on tracks failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cout.decode("utf-8")))
 	if attachment_params: #Only extract attachments if there are attachments.
 		print("Extracting attachments...")
 		extract_params = ["mkvextract", in_mkv, "attachments"] + attachment_params
@@ -382,46 +732,22 @@ def extract_mkv(in_mkv, guid):
 
 	return tracks, attachments
 
-def extract_vob(in_vob, guid):
-	"""Extracts a VOB file into audio and video components."""
-	if in_vob.startswith("concat:"):
-		probe_vob = in_vob.split("|")[-1] #Can only take mediainfo from one file at a time. Pick the last one.
-	else:
-		probe_vob = in_vob
-
-	#Detect interlacing.
-	mediainfo_command = "mediainfo --Inform='Video;%Width%,%Height%,%ScanType%,%ScanOrder%,%PixelAspectRatio%,%Standard%' \"" + probe_vob + "\""
-	print(mediainfo_command)
-	process = subprocess.Popen(mediainfo_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	exit_code = process.wait()
-	if exit_code != 0:
-		raise Exception("Calling Mediainfo on {probe_vob} failed with exit code {exit_code}.".format(probe_vob=probe_vob, exit_code=exit_code))
-	mediainfo_parts = cout.decode("utf-8").split(",")
-	is_interlaced = mediainfo_parts[2] == "Interlaced"
-	field_order = mediainfo_parts[3].lower().strip()
-	print("Interlace detection:", is_interlaced, field_order, "(", mediainfo_parts, ")")
-	pixel_aspect_ratio = float(mediainfo_parts[4])
-	stream_width = int(float(mediainfo_parts[0]) * pixel_aspect_ratio)
-	stream_height = int(mediainfo_parts[1])
-	print("Pixel aspect ratio:", pixel_aspect_ratio)
-
-	ffmpeg_command = ["ffmpeg", "-probesize", "10M", "-analyzeduration", "50000000", "-i", in_vob]
-	print(ffmpeg_command)
-	process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	process.wait() #Ignore the exit code. It always fails.
-	vobinfo = cerr.decode("utf-8")
-	vobinfo = re.sub(r"\(.*?\)", "", vobinfo)  # Remove parts between brackets. It messes up parsing.
+def extract_vob(in_vob, guid, info=None):
+	"""
+	Extracts a VOB file into audio and video components.
+	:param in_vob: The VOB file to extract. This may be a concat: URL for VOB
+	chains.
+	:param guid: The prefix for the extracted files.
+	:param info: FFprobe's output for the file, if it was already probed.
+	"""
+	if info is None:
+		info = probe.ffprobe(in_vob)
 	tracks = []
-	for match in re.finditer(r"  Stream #0:(\d+)\[0x[0-9a-f]+\]: (\w+): ([^\n]+)", vobinfo):
-		track_nr = match.group(1)
-		track_type = match.group(2)
-		track_codec = match.group(3)
+	for stream in info.get("streams", []):
 		new_track = track.Track()
-		new_track.from_ffmpeg(track_nr, track_type, track_codec, is_interlaced, field_order, pixel_aspect_ratio)
+		new_track.from_ffprobe(stream)
 		new_track.file_name = guid + "-T" + str(new_track.track_nr) + "." + new_track.codec
-		if new_track.type != "unknown":
+		if new_track.type in ["video", "audio"]: #Subtitles can't be extracted from VOBs with FFmpeg.
 			tracks.append(new_track)
 
 	#Generate the parameters to pass to ffmpeg.
@@ -439,45 +765,32 @@ def extract_vob(in_vob, guid):
 
 	return tracks
 
-def extract_m2ts(in_m2ts, guid):
-	"""Extracts an M2TS file into audio and video components."""
-	#Detect interlacing.
-	mediainfo_command = "mediainfo --Inform='Video;%Width%,%Height%,%ScanType%,%ScanOrder%,%PixelAspectRatio%,%Standard%' \"" + in_m2ts + "\""
-	print(mediainfo_command)
-	process = subprocess.Popen(mediainfo_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	exit_code = process.wait()
-	if exit_code != 0:
-		raise Exception("Calling Mediainfo on {in_m2ts} failed with exit code {exit_code}.".format(in_m2ts=in_m2ts, exit_code=exit_code))
-	mediainfo_parts = cout.decode("utf-8").split(",")
-	is_interlaced = mediainfo_parts[2] == "Interlaced"
-	field_order = mediainfo_parts[3].lower().strip()
-	print("Interlace detection:", is_interlaced, field_order, "(", mediainfo_parts, ")")
-	pixel_aspect_ratio = float(mediainfo_parts[4])
-	stream_width = int(float(mediainfo_parts[0]) * pixel_aspect_ratio)
-	stream_height = int(mediainfo_parts[1])
-	print("Pixel aspect ratio:", pixel_aspect_ratio)
-
-	ffmpeg_command = ["ffmpeg", "-probesize", "10M", "-analyzeduration", "50000000", "-i", in_m2ts]
-	print(ffmpeg_command)
-	process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	process.wait() #Ignore the exit code. It always fails.
-	m2tsinfo = cerr.decode("utf-8")
-	m2tsinfo = re.sub(r"\(.*?\)", "", m2tsinfo)  # Remove parts between brackets. It messes up parsing.
-	m2tsinfo = m2tsinfo[:m2tsinfo.find("No Program")]  # Remove everything after "No Program" because it's not part of the main stream.
+def extract_m2ts(in_m2ts, guid, info=None):
+	"""
+	Extracts an M2TS file into audio and video components.
+	:param in_m2ts: The M2TS file to extract.
+	:param guid: The prefix for the extracted files.
+	:param info: FFprobe's output for the file, if it was already probed.
+	"""
+	if info is None:
+		info = probe.ffprobe(in_m2ts)
+	#Streams that are not part of the main program are not part of the main stream.
+	programs = info.get("programs", [])
+	if programs:
+		program_streams = {stream["index"] for stream in programs[0].get("streams", [])}
+	else:
+		program_streams = {stream["index"] for stream in info.get("streams", [])}
 	tracks = []
-	for match in re.finditer(r"  Stream #0:(\d+)\[0x[0-9a-f]+\]: (\w+): ([^\n]+)", m2tsinfo):
-		track_nr = match.group(1)
-		track_type = match.group(2)
-		track_codec = match.group(3)
+	for stream in info.get("streams", []):
+		if stream["index"] not in program_streams:
+			continue
 		new_track = track.Track()
-		new_track.from_ffmpeg(track_nr, track_type, track_codec, is_interlaced, field_order, pixel_aspect_ratio)
+		new_track.from_ffprobe(stream)
 		if new_track.type == "audio" and new_track.frequency == 0:
-			print(f"Skipping audio track {track_nr} because frequency is 0.")
+			print(f"Skipping audio track {new_track.track_nr} because frequency is 0.")
 			continue  # Audio contains no audio data.
 		new_track.file_name = guid + "-T" + str(new_track.track_nr) + "." + new_track.codec
-		if new_track.type != "unknown":
+		if new_track.type in ["video", "audio"]: #Image-based subtitles are left out for now.
 			tracks.append(new_track)
 
 	#Generate the parameters to pass to ffmpeg.
@@ -500,43 +813,57 @@ def extract_m2ts(in_m2ts, guid):
 
 	return tracks
 
-def extract_video_frames(in_vid):
+def extract_video_frames(in_vid, info=None, workers=None):
 	"""
 	Extract a video file into individual frames.
 
-	Any video type supported by both MediaInfo and FFMPEG is supported by this function.
-	However multi-part VOB files could be problematic.
+	Any video type supported by FFMPEG is supported by this function.
 
-	Audio is discarded.
+	Audio is discarded. The frames are cropped and converted to JPG on a pool of
+	workers. If NumPy and Pillow are installed, the frames are streamed from
+	FFmpeg and only the JPGs are written. Otherwise every frame is written to a
+	PNG first, and cropped with ImageMagick.
+	:param in_vid: The video file to extract.
+	:param info: FFprobe's output for the file, if it was already probed.
+	:param workers: How many frames to convert at the same time. By default as
+	many as there are cores.
 	:return: A list of tracks, one for each frame, to encode further.
 	"""
 	if in_vid.startswith("concat:"):
-		probe_vid = in_vid.split("|")[-1] #Can only take mediainfo from one file at a time. Pick the last one.
+		probe_vid = in_vid.split("|")[-1] #Name the frames after the last file.
 	else:
 		probe_vid = in_vid
 
 	#Detect aspect ratio.
-	mediainfo_command = "mediainfo --Inform='Video;%Width%,%Height%,%PixelAspectRatio%,%Standard%' \"" + probe_vid + "\""
-	print(mediainfo_command)
-	process = subprocess.Popen(mediainfo_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	exit_code = process.wait()
-	if exit_code != 0:
-		raise Exception("Calling Mediainfo on {probe_vid} failed with exit code {exit_code}.".format(probe_vid=probe_vid, exit_code=exit_code))
-	mediainfo_parts = cout.decode("utf-8").split(",")
-	width = int(mediainfo_parts[0])
-	height = int(mediainfo_parts[1])
-	pixel_aspect_ratio = float(mediainfo_parts[2])
-	standard = mediainfo_parts[3]
-	print("Standard:", standard)
-	if standard.strip() == "PAL":
+	if info is None:
+		info = probe.ffprobe(in_vid)
+	video_streams = [stream for stream in info.get("streams", []) if stream.get("codec_type") == "video"]
+	if not video_streams:
+		raise Exception("No video stream found in {in_vid}.".format(in_vid=in_vid))
+	video_track = track.Track()
+	video_track.from_ffprobe(video_streams[0])
+	width = video_track.pixel_width
+	height = video_track.pixel_height
+	numerator, denominator = [int(part) for part in video_track.pixel_aspect_ratio.split(":")]
+	pixel_aspect_ratio = numerator / denominator
+	if height == 576 and round(video_track.fps / (2 if video_track.interlaced else 1)) == 25: #PAL.
 		pixel_aspect_ratio = 1.42222  # Sometimes the PAR is wrong for some reason. Standard is more reliable.
 	print("Pixel aspect ratio:", pixel_aspect_ratio)
 
 	new_file_name = probe_vid + "-%05d.png"
-	scale_filter = "scale={width}x{height}".format(width=str(int(width*pixel_aspect_ratio)), height=str(height))
+	scaled_width = int(width*pixel_aspect_ratio)
+	scale_filter = "scale={width}x{height}".format(width=str(scaled_width), height=str(height))
 	decimate_filter = "mpdecimate"  # Remove duplicate frames, if any.
 	video_filters = ",".join([decimate_filter, scale_filter])
+
+	try:
+		import numpy
+		import PIL.Image
+	except ImportError:
+		print("NumPy or Pillow is not installed. Dumping frames to PNG first.")
+	else:
+		return stream_video_frames(in_vid, probe_vid + "-{frame_nr:05d}.jpg", video_filters, scaled_width, height, workers or os.cpu_count())
+
 	ffmpeg_command = ["ffmpeg", "-i", in_vid, "-vsync", "0", "-vf", video_filters, new_file_name]
 	print(ffmpeg_command)
 	process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -545,30 +872,114 @@ def extract_video_frames(in_vid):
 	if exit_code != 0:
 		raise Exception("Calling FFMPEG to split into frames failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cout.decode("utf-8")))
 
-	images = glob.glob(probe_vid + "-*.png")
+	images = sorted(glob.glob(glob.escape(probe_vid) + "-*.png"))
 	tracks = []
-	for image in images:
-		#Crop each image.
-		output_file = image[:-4] + ".jpg"
-		imagemagick_command = ["convert", image, "-bordercolor", "black", "-border", "1x1", "-fuzz", "10%", "-trim", "-quality", "89", output_file]
-		print(imagemagick_command)
-		process = subprocess.Popen(imagemagick_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-		(cout, cerr) = process.communicate()
-		exit_code = process.wait()
-		if exit_code != 0:
-			raise Exception("Calling ImageMagick on JPG failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cout.decode("utf-8")))
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor: #Each conversion is its own process, so threads are enough to spread them over the cores.
+		for output_file in executor.map(crop_frame, images):
+			#Create a track.
+			new_track = track.Track()
+			new_track.codec = "jpg"
+			new_track.file_name = output_file
+			tracks.append(new_track)
 
-		#Create a track.
-		new_track = track.Track()
-		new_track.codec = "jpg"
-		new_track.file_name = image
-		tracks.append(new_track)
+	return tracks
 
-		#Remove the temporary file.
-		os.remove(image)
+def stream_video_frames(in_vid, output_pattern, video_filters, width, height, workers):
+	"""
+	Extracts a video file into individual JPG frames, without storing anything
+	else on disk.
+
+	FFmpeg pipes the raw frames into memory, where they are cropped and
+	compressed to JPG on a pool of workers. The crop is found once for every
+	shot, so that dark frames are cropped the same as the rest of their shot.
+	Requires NumPy and Pillow.
+	:param in_vid: The video file to extract.
+	:param output_pattern: The file name of each frame, with a placeholder for
+	the frame number.
+	:param video_filters: The FFmpeg filters to apply to the frames.
+	:param width: The width of the frames after filtering.
+	:param height: The height of the frames after filtering.
+	:param workers: How many frames to compress at the same time.
+	:return: A list of tracks, one for each frame, to encode further.
+	"""
+	ffmpeg_command = ["ffmpeg", "-loglevel", "error", "-i", in_vid, "-vsync", "0", "-vf", video_filters, "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+	print(ffmpeg_command)
+	import numpy
 
+	frame_size = width * height * 3
+	pending = threading.BoundedSemaphore(workers * 4) #Don't decode much further ahead than the workers can compress, or the frames pile up in memory.
+	cropper = cropdetect.ShotCropper()
+	tracks = []
+	futures = []
+	decoder = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE)
+	try:
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor: #Pillow releases the GIL while compressing.
+			def save(ready):
+				for frame, output_file, box in ready:
+					pending.acquire()
+					future = executor.submit(save_frame, frame, box, output_file)
+					future.add_done_callback(lambda future: pending.release())
+					futures.append(future)
+
+			frame_nr = 1
+			while True:
+				data = decoder.stdout.read(frame_size)
+				if len(data) < frame_size: #End of the video.
+					break
+				output_file = output_pattern.format(frame_nr=frame_nr)
+				save(cropper.add(numpy.frombuffer(data, dtype=numpy.uint8).reshape(height, width, 3), output_file))
+
+				#Create a track.
+				new_track = track.Track()
+				new_track.codec = "jpg"
+				new_track.file_name = output_file
+				tracks.append(new_track)
+				frame_nr += 1
+			save(cropper.flush())
+			for future in futures:
+				future.result() #Raises the exception if a frame failed.
+	finally:
+		decoder.stdout.close()
+	exit_code = decoder.wait()
+	if exit_code != 0:
+		raise Exception("Calling FFMPEG to split into frames failed with exit code {exit_code}.".format(exit_code=exit_code))
 	return tracks
 
+def save_frame(frame, box, output_file):
+	"""
+	Crops a raw frame and saves it as JPG.
+	:param frame: The frame, as a NumPy array of height by width by channels in
+	8-bit RGB.
+	:param box: The top, bottom, left and right bounds to crop to, with the
+	bottom and right bounds exclusive.
+	:param output_file: Where to save the JPG.
+	"""
+	import PIL.Image
+
+	top, bottom, left, right = box
+	PIL.Image.fromarray(frame[top:bottom, left:right]).save(output_file, quality=89)
+
+def crop_frame(image):
+	"""
+	Crops the black borders off a frame and converts it to JPG.
+
+	The original frame is removed afterwards.
+	:param image: The frame to crop.
+	:return: The file name of the cropped JPG.
+	"""
+	output_file = image[:-4] + ".jpg"
+	imagemagick_command = ["convert", image, "-bordercolor", "black", "-border", "1x1", "-fuzz", "10%", "-trim", "-quality", "89", output_file]
+	print(imagemagick_command)
+	process = subprocess.Popen(imagemagick_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	(cout, cerr) = process.communicate()
+	exit_code = process.wait()
+	if exit_code != 0:
+		raise Exception("Calling ImageMagick on JPG failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cout.decode("utf-8")))
+
+	#Remove the temporary file.
+	os.remove(image)
+	return output_file
+
 def encode_flac(track_metadata):
 	"""
 	Encodes an audio track to the FLAC codec.
@@ -611,9 +1022,36 @@ def encode_jpg(track_metadata):
 	losslessly (save for metadata) to optimise compression.
 	"""
 	print("---- Encoding", track_metadata.file_name, "to JPG...")
-	new_file_name = track_metadata.file_name + ".jpg"
-	shutil.copy(track_metadata.file_name, new_file_name)  #Work only on a copy.
-	ect_command = ["/home/ruben/Projects/Clones/Efficient-Compression-Tool/build/ect", "-9", "-strip", "--mt-deflate", new_file_name]
+	encode_jpg_batch([track_metadata])
+
+def encode_jpgs(tracks, batch_size=64, workers=None):
+	"""
+	Optimises many JPG images.
+
+	The images are divided into batches, so that every call to ECT handles many
+	images. A few batches are optimised at the same time.
+	:param tracks: The images to optimise.
+	:param batch_size: How many images to give to each call to ECT.
+	:param workers: How many batches to optimise at the same time. By default
+	as many as there are cores.
+	"""
+	print("---- Encoding", len(tracks), "images to JPG...")
+	batches = [tracks[start:start + batch_size] for start in range(0, len(tracks), batch_size)]
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor: #ECT runs as its own process, so threads are enough to spread the batches over the cores.
+		for result in executor.map(encode_jpg_batch, batches):
+			pass #Raises the exception if a batch failed.
+
+def encode_jpg_batch(tracks):
+	"""
+	Optimises a batch of JPG images with a single call to ECT.
+	:param tracks: The images to optimise.
+	"""
+	new_file_names = []
+	for track_metadata in tracks:
+		new_file_name = track_metadata.file_name + ".jpg"
+		shutil.copy(track_metadata.file_name, new_file_name)  #Work only on a copy.
+		new_file_names.append(new_file_name)
+	ect_command = ["/home/ruben/Projects/Clones/Efficient-Compression-Tool/build/ect", "-9", "-strip", "--mt-deflate"] + new_file_names
 	print(ect_command)
 	process = subprocess.Popen(ect_command, stdout=subprocess.PIPE)
 	(cout, cerr) = process.communicate()
@@ -621,23 +1059,28 @@ def encode_jpg(track_metadata):
 	if(exit_code != 0): #0 is success.
 		raise Exception("ECT failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=exit_code, cerr=cerr))
 
-	#Delete old file.
-	if os.path.exists(track_metadata.file_name):
-		os.remove(track_metadata.file_name)
+	for track_metadata, new_file_name in zip(tracks, new_file_names):
+		#Delete old file.
+		if os.path.exists(track_metadata.file_name):
+			os.remove(track_metadata.file_name)
 
-	track_metadata.file_name = new_file_name
-	track_metadata.codec = "jpg"
+		track_metadata.file_name = new_file_name
+		track_metadata.codec = "jpg"
 
-def encode_opus(track_metadata):
+def encode_opus(track_metadata, workspace=None):
 	"""Encodes an audio file to the Opus codec.
 	Accepted input codecs:
 	- Wave
 	- AIFF
 	- FLAC
 	- Ogg/FLAC
-	- PCM"""
+	- PCM
+
+	If a workspace is given, the result is placed in there."""
 	print("---- Encoding", track_metadata.file_name, "to Opus...")
 	new_file_name = track_metadata.file_name + ".opus"
+	if workspace is not None:
+		new_file_name = workspace.file(new_file_name, file_size(track_metadata.file_name), small=True) #Opus is never bigger than the lossless source.
 	opusenc_command = ["opusenc", "--bitrate", "64", "--vbr", "--comp", "10", "--framesize", "60", track_metadata.file_name, new_file_name]
 	print(opusenc_command)
 	process = subprocess.Popen(opusenc_command, stdout=subprocess.PIPE)
@@ -653,6 +1096,47 @@ def encode_opus(track_metadata):
 	track_metadata.file_name = new_file_name
 	track_metadata.codec = "opus"
 
+def encode_opus_streaming(track_metadata, workspace=None):
+	"""
+	Encodes any audio file that FFmpeg can decode to the Opus codec.
+
+	Unlike first encoding to FLAC with encode_flac, this doesn't store an
+	intermediate file. FFmpeg decodes the audio and pipes it straight into
+	OpusEnc. It's piped as FLAC at the fastest compression level, since FLAC
+	keeps the channel layout and bit depth, and it only needs to survive the
+	pipe.
+
+	If a workspace is given, the result is placed in there.
+	"""
+	print("---- Encoding", track_metadata.source_file or track_metadata.file_name, "to Opus via a pipe...")
+	new_file_name = track_metadata.file_name + ".opus"
+	if workspace is not None:
+		new_file_name = workspace.file(new_file_name, file_size(track_metadata.file_name, 64000 // 8 * 6 * 3600), small=True) #If it's not extracted, assume 6 hours at 64kbps.
+	if track_metadata.source_file: #Read the track straight from its container.
+		source = ["-i", track_metadata.source_file, "-map", "0:" + str(track_metadata.source_index)]
+	else:
+		source = ["-i", track_metadata.file_name, "-map", "0:a:0"]
+	ffmpeg_command = ["ffmpeg", "-loglevel", "error"] + source + ["-c:a", "flac", "-compression_level", "0", "-f", "flac", "-"]
+	opusenc_command = ["opusenc", "--bitrate", "64", "--vbr", "--comp", "10", "--framesize", "60", "-", new_file_name]
+	print(" ".join(ffmpeg_command), "|", " ".join(opusenc_command))
+	decoder = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE)
+	encoder = subprocess.Popen(opusenc_command, stdin=decoder.stdout, stdout=subprocess.PIPE)
+	decoder.stdout.close() #So that FFmpeg stops if OpusEnc fails.
+	(cout, cerr) = encoder.communicate()
+	encoder_exit_code = encoder.wait()
+	decoder_exit_code = decoder.wait()
+	if decoder_exit_code != 0: #0 is success.
+		raise Exception("Decoding {file_name} for OpusEnc failed with exit code {exit_code}.".format(file_name=track_metadata.file_name, exit_code=decoder_exit_code))
+	if encoder_exit_code != 0: #0 is success.
+		raise Exception("OpusEnc failed with exit code {exit_code}. CERR: {cerr}".format(exit_code=encoder_exit_code, cerr=cerr))
+
+	#Delete old file.
+	if os.path.exists(track_metadata.file_name):
+		os.remove(track_metadata.file_name)
+
+	track_metadata.file_name = new_file_name
+	track_metadata.codec = "opus"
+
 def encode_png(track_metadata):
 	"""
 	Encodes a picture in PNG.
@@ -690,29 +1174,52 @@ def encode_png(track_metadata):
 	track_metadata.file_name = new_file_name
 	track_metadata.codec = "png"
 
-def encode_h265(track_metadata, preset):
+def encode_h265(track_metadata, preset, filter_once=True, parallel_chunks=1, manifest=None, workspace=None):
 	"""Encodes a video file to the H265 codec.
-	Accepts any codec that FFmpeg supports (which is a lot)."""
-	print("---- Encoding", track_metadata.file_name, "to H265...")
+	Accepts any codec that FFmpeg supports (which is a lot).
+
+	If filter_once is set, the VapourSynth filter chain only runs during the
+	first pass. Its output is then also spooled to a lossless FFV1
+	intermediate, from which the second pass is fed. This costs disk space
+	but saves running the (expensive) filters twice. If the intermediate
+	doesn't fit in any scratch tier nor the work directory, the filters run
+	during both passes after all.
+
+	If parallel_chunks is more than 1, the video is split at scene cuts into
+	chunks, and that many chunks are encoded at the same time. The first pass
+	of all chunks runs before any second pass, so that the bitrate can be
+	divided over the chunks by how complex they turned out to be. The resulting
+	bitstreams are concatenated afterwards. The chunk encoders are spread over
+	the NUMA nodes of the machine.
+
+	If a manifest is given, completed passes are recorded in it. If the encode
+	fails, the source and the results of completed passes are kept, so that a
+	retry can skip those passes.
+
+	If the track has a source_file, the video is decoded straight from that
+	container instead of from an extracted file.
+
+	If the preset is one of crop_presets, the black borders of the video are
+	detected once, and the crop is written into the VapourSynth script.
+
+	If a workspace is given, the intermediate files are placed in there, each
+	on the fastest tier that has space for it."""
+	print("---- Encoding", track_metadata.source_file or track_metadata.file_name, "to H265...")
 	new_file_name = track_metadata.file_name + ".265"
+	source_file = track_metadata.source_file or track_metadata.file_name
+	source_track = track_metadata.source_index if track_metadata.source_file else -1 #-1 lets FFMS2 pick the first video track.
 	stats_file = track_metadata.file_name + ".stats"
 	vapoursynth_script = track_metadata.file_name + ".vpy"
-
-	#Get the number of frames, to display progress.
-	frame_count_command = "ffprobe -show_streams -count_frames -i \"" + track_metadata.file_name + "\""
-	print(frame_count_command)
-	process = subprocess.Popen(frame_count_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	(cout, cerr) = process.communicate()
-	exit_code = process.wait()
-	if exit_code != 0:
-		print("Calling FFProbe on {file_name} failed with exit code {exit_code}.".format(file_name=track_metadata.file_name, exit_code=exit_code))
-		num_frames = 0
-	else:
-		cout = cout.decode("utf-8")
-		for line in cout.split("\n"):
-			if line.startswith("nb_read_frames="):
-				num_frames = int(line[len("nb_read_frames="):])
-				break
+	intermediate_file = track_metadata.file_name + ".ffv1.mkv"
+	def place(file_name, size, small=False):
+		if workspace is None:
+			return file_name
+		return workspace.file(file_name, size, small)
+	index_file = index_source(source_file)
+	cached_index = index_file is not None
+	if not cached_index: #Let FFMS2 index it in the work directory then.
+		index_file = place(track_metadata.file_name + ".ffindex", file_size(source_file) // 100, small=True)
+	vapoursynth_script = place(vapoursynth_script, 65536, small=True)
 
 	x265_presets = {
 		"hdanime": {
@@ -750,21 +1257,20 @@ def encode_h265(track_metadata, preset):
 	#The encoding process produces some side effects that may need cleaning up.
 	#Some are normally cleaned up but if the encoding is interrupted, be sure to delete them anyway.
 	sideeffect_files = [
-		track_metadata.file_name + ".stats.cutree.temp",
-		track_metadata.file_name + ".stats.temp",
-		track_metadata.file_name + ".ffindex",
-		track_metadata.file_name + ".stats.cutree",
-		track_metadata.file_name + ".stats"
-	]
+		intermediate_file
+	] + stats_files(stats_file)
+	if not cached_index:
+		sideeffect_files.append(index_file)
 
 	#Generate VapourSynth script.
+	frame_multiplier = 1 #Deinterlacing to double rate produces more frames than there are in the source.
 	if preset == "dvd" or preset == "dvd-lo":
 		if track_metadata.interlaced:
 			if track_metadata.interlace_field_order == "tff":
 				vsscript = "dvd_tff"
 			else:
 				vsscript = "dvd_bff"
-			num_frames *= 2
+			frame_multiplier = 2
 		else:
 			vsscript = "dvd_noninterlaced"
 	elif preset == "dedup":
@@ -773,7 +1279,7 @@ def encode_h265(track_metadata, preset):
 				vsscript = "dedup_tff"
 			else:
 				vsscript = "dedup_bff"
-			num_frames *= 2
+			frame_multiplier = 2
 		else:
 			vsscript = "dedup_noninterlaced"
 	elif preset == "hd":
@@ -790,11 +1296,19 @@ def encode_h265(track_metadata, preset):
 	try:
 		with open(os.path.join(os.path.split(__file__)[0], script_source)) as f:
 			script = f.read()
-		script = script.format(input_file=track_metadata.file_name)
+		if preset in crop_presets:
+			crop = detect_crop(source_file, source_track, index_file)
+		else:
+			crop = {"left": 0, "right": 0, "top": 0, "bottom": 0}
+		script_parameters = {"input_file": source_file, "track": source_track, "index_file": index_file, "crop": repr(crop), "repository": os.path.dirname(os.path.abspath(__file__))}
+		with open(os.path.join(os.path.split(__file__)[0], "havsfunc.py"), "rb") as f:
+			#Vectors found in a different track, with a different crop or by a different version of the filters are not reused.
+			vector_context = hashlib.sha1(script.format(vector_context="", vector_cache="None", **script_parameters).encode("utf-8") + f.read()).hexdigest()
+		script = script.format(vector_context=vector_context, vector_cache=repr(vector_cache_file), **script_parameters)
 		with open(vapoursynth_script, "w") as f:
 			f.write(script)
+		num_frames = count_frames(track_metadata, vapoursynth_script, frame_multiplier)
 
-		vspipe_command = ["vspipe", "-c", "y4m", vapoursynth_script, "-"]
 		x265_command = [
 			"x265",
 			"-",
@@ -806,43 +1320,464 @@ def encode_h265(track_metadata, preset):
 			"--deblock", x265_presets[preset]["deblock"],
 			"-b", "12",
 			"--psy-rd", "0.4",
-			"--aq-strength", "0.5",
-			"--stats", stats_file
+			"--aq-strength", "0.5"
 		]
 		if not track_metadata.interlaced:
 			x265_command.insert(3, "--fps")
 			x265_command.insert(4, str(track_metadata.fps))
-		if num_frames != 0:
-			x265_command.append("--frames")
-			x265_command.append(str(num_frames))
-		x265_pass1 = ["--pass", "1", "-o", "/dev/null"]
-		x265_pass2 = ["--pass", "2", "-o", new_file_name]
-		pass1_command = " ".join(vspipe_command) + " | " + " ".join(x265_command + x265_pass1)
-		print(pass1_command)
-		process = subprocess.Popen(pass1_command, shell=True)
-		(cout, cerr) = process.communicate()
-		exit_code = process.wait()
-		if exit_code != 0: #0 is success.
-			raise Exception("First x265 pass failed with exit code {exit_code}.".format(exit_code=exit_code))
-		pass2_command = " ".join(vspipe_command) + " | " + " ".join(x265_command + x265_pass2)
-		print(pass2_command)
-		process = subprocess.Popen(pass2_command, shell=True)
-		(cout, cerr) = process.communicate()
-		exit_code = process.wait()
-		if exit_code != 0: #0 is success.
-			raise Exception("Second x265 pass failed with exit code {exit_code}.".format(exit_code=exit_code))
-	finally:
-		#Delete old files and temporaries.
-		for file_name in [track_metadata.file_name, stats_file, vapoursynth_script] + sideeffect_files:
-			if os.path.exists(file_name):
+
+		#Estimate how much space the intermediates will take, to choose where to place them. An estimated frame count is good enough for that.
+		expected_frames = num_frames or track_metadata.estimated_frames * frame_multiplier
+		frame_pixels = track_metadata.pixel_width * track_metadata.pixel_height or 1920 * 1080
+		stats_size = expected_frames * (frame_pixels // 256 * 2 + 512) #The CU-tree statistics store an offset for every 16x16 block.
+		intermediate_size = expected_frames * frame_pixels * 2 if filter_once else 0 #16-bit samples, with 4:2:0 chroma, compressed about 1.5 times.
+		if filter_once:
+			if workspace is not None:
+				fits = workspace.has_space(intermediate_file, intermediate_size)
+			else:
+				fits = os.path.exists(intermediate_file) or scratch.free_space(os.path.dirname(os.path.abspath(intermediate_file))) - intermediate_size >= scratch.reserve
+			if not fits: #Writing it anyway would only fail once the disk is full.
+				print("No space for a lossless intermediate of", intermediate_size // (1024 * 1024 * 1024), "GiB. Running the filters during both passes instead.")
+				filter_once = False
+				intermediate_size = 0
+		bitstream_size = int(expected_frames / (track_metadata.fps or 25) * int(x265_presets[preset]["bitrate"]) * 1000 / 8 * 2) #Twice the average bitrate, for some margin.
+		new_file_name = place(new_file_name, bitstream_size)
+
+		if parallel_chunks > 1 and num_frames != 0: #Chunk boundaries need the exact frame count, or the last chunk would read past the end.
+			chunks = split_chunks(source_file, num_frames, parallel_chunks, track=source_track, index_file=index_file)
+		else:
+			chunks = []
+		if len(chunks) <= 1:
+			stats_file = place(stats_file, stats_size, small=True)
+			intermediate_file = place(intermediate_file, intermediate_size)
+			sideeffect_files += [intermediate_file] + stats_files(stats_file)
+			encode_h265_passes(vapoursynth_script, x265_command, stats_file, new_file_name, intermediate_file, num_frames, filter_once, manifest=manifest, threads=os.cpu_count())
+		else:
+			#Each x265 process gets its share of the cores of one NUMA node, instead of all of them fighting over all of the cores.
+			#Every worker thread keeps to its own node, so that the chunks running at any time are spread evenly over the nodes.
+			nodes = numa_nodes()
+			workers_per_node = -(-parallel_chunks // nodes)
+			chunk_threads = max(1, os.cpu_count() // nodes // workers_per_node)
+			worker_numbers = itertools.count()
+			worker = threading.local()
+			def assign_node():
+				worker.node = next(worker_numbers) % nodes
+			def encode_chunk(command, passes, *args):
+				pools = ",".join(str(chunk_threads) if node == worker.node else "-" for node in range(nodes))
+				encode_h265_passes(vapoursynth_script, command + ["--pools", pools], *args, passes=passes)
+			chunk_files = []
+			chunk_args = []
+			for chunk_nr, (start, end) in enumerate(chunks):
+				chunk_prefix = track_metadata.file_name + "." + str(chunk_nr)
+				share = (end - start + 1) / num_frames
+				chunk_file = place(chunk_prefix + ".265", int(bitstream_size * share))
+				chunk_stats = place(chunk_prefix + ".stats", int(stats_size * share), small=True)
+				chunk_intermediate = place(chunk_prefix + ".ffv1.mkv", int(intermediate_size * share))
+				chunk_files.append(chunk_file)
+				sideeffect_files += [chunk_file, chunk_intermediate] + stats_files(chunk_stats)
+				chunk_args.append((chunk_stats, chunk_file, chunk_intermediate, end - start + 1, filter_once, start, end, manifest, chunk_threads))
+			with concurrent.futures.ThreadPoolExecutor(max_workers=parallel_chunks, initializer=assign_node) as executor:
+				def run_chunks(commands, passes):
+					futures = [executor.submit(encode_chunk, command, passes, *args) for command, args in zip(commands, chunk_args)]
+					try:
+						for future in futures:
+							future.result()
+					except Exception:
+						for future in futures: #Don't start on any more chunks if one of them failed.
+							future.cancel()
+						raise
+
+				run_chunks([x265_command] * len(chunks), [1])
+				#Complex chunks get a higher bitrate than simple ones, like the frames within a chunk do, so that the quality stays about even.
+				bitrates = chunk_bitrates([args[0] for args in chunk_args], [end - start + 1 for start, end in chunks], int(x265_presets[preset]["bitrate"]))
+				bitrate_position = x265_command.index("--bitrate") + 1
+				commands = [x265_command[:bitrate_position] + [str(bitrate)] + x265_command[bitrate_position + 1:] for bitrate in bitrates]
+				run_chunks(commands, [2])
+
+			#Each chunk starts with its own headers and a keyframe, so the raw bitstreams can be concatenated, as long as those headers are the same.
+			headers = [parameter_sets(chunk_file) for chunk_file in chunk_files]
+			if any(chunk_headers != headers[0] for chunk_headers in headers):
+				raise Exception("The chunks of {file_name} were encoded with different parameter sets, so they can't be joined.".format(file_name=new_file_name))
+			print("---- Joining", len(chunk_files), "chunks...")
+			with open(new_file_name, "wb") as joined:
+				for chunk_file in chunk_files:
+					with open(chunk_file, "rb") as f:
+						shutil.copyfileobj(f, joined)
+	except Exception:
+		#Keep the source and the results of completed passes, so that a retry can continue from there.
+		for file_name in sideeffect_files:
+			if file_name.endswith(".temp") and os.path.exists(file_name):
 				os.remove(file_name)
+		raise
+
+	#Delete old files and temporaries. The motion vectors aren't needed any more either, since this track won't be encoded again.
+	#An index in the work directory is one of the side effects. A cached index may still be used by other tracks and jobs of the same source, so that one is left for the cache to remove once it gets old.
+	mvcache.forget(source_file, vector_cache_file)
+	for file_name in [track_metadata.file_name, stats_file, vapoursynth_script] + sideeffect_files:
+		if os.path.exists(file_name):
+			os.remove(file_name)
 
 	track_metadata.file_name = new_file_name
 	track_metadata.codec = "h265"
 
-def mux_mkv(tracks, attachments, guid, input_filename):
-	new_file_name = guid + "-out.mkv"
+def index_source(source_file):
+	"""
+	Indexes a video file with FFMS2, unless it was already indexed.
+
+	The index is stored in the index cache, named after the identity of the
+	source. This way every pass and every retry of an encode can use the same
+	index, and a changed source gets a new index. If another thread is already
+	indexing the same source, this waits for that index.
+	:param source_file: The video file to index.
+	:return: The index file, or None if the file could not be indexed, in which
+	case FFMS2 needs to index it by itself.
+	"""
+	file_identity = probe.identity(source_file)
+	if index_cache_directory is None or file_identity is None:
+		return None
+	index_file = os.path.join(index_cache_directory, hashlib.sha1(file_identity.encode("utf-8")).hexdigest() + ".ffindex")
+	with _index_locks_lock:
+		lock = _index_locks.setdefault(index_file, threading.Lock())
+	with lock:
+		if os.path.exists(index_file):
+			os.utime(index_file) #Mark as recently used.
+			return index_file
+
+		os.makedirs(index_cache_directory, exist_ok=True)
+		for old_index in glob.glob(os.path.join(glob.escape(index_cache_directory), "*.ffindex")):
+			try:
+				if time.time() - os.path.getmtime(old_index) > index_cache_age:
+					os.remove(old_index)
+			except OSError: #Removed by someone else in the meantime.
+				pass
+
+		print("---- Indexing", source_file, "...")
+		ffmsindex_command = ["ffmsindex", "-f", source_file, index_file + ".temp"]
+		print(ffmsindex_command)
+		process = subprocess.Popen(ffmsindex_command, stdout=subprocess.PIPE)
+		(cout, cerr) = process.communicate()
+		exit_code = process.wait()
+		if exit_code != 0: #0 is success.
+			print("Indexing {source_file} failed with exit code {exit_code}.".format(source_file=source_file, exit_code=exit_code))
+			if os.path.exists(index_file + ".temp"):
+				os.remove(index_file + ".temp")
+			return None
+		os.replace(index_file + ".temp", index_file) #Only complete indexes may be found in the cache.
+	return index_file
+
+def detect_crop(source_file, source_track, index_file, samples=128):
+	"""
+	Finds how much black border to crop off a video, once for its whole encode.
+
+	The crop is written into the VapourSynth script, so that running the script
+	for every pass and every chunk doesn't need to detect it again.
+	:param source_file: The video file to look at.
+	:param source_track: The track of the video in the file, as FFMS2 counts
+	them.
+	:param index_file: The FFMS2 index of the file.
+	:param samples: How many frames to look at. The border must be black in all
+	of them to be cropped.
+	:return: A dictionary with the left, right, top and bottom crop, as accepted
+	by std.Crop. If VapourSynth is not installed, nothing is cropped.
+	"""
+	try:
+		import vapoursynth
+	except ImportError:
+		print("VapourSynth can't be imported here. Not cropping.")
+		return {"left": 0, "right": 0, "top": 0, "bottom": 0}
+	video = vapoursynth.core.ffms2.Source(source=source_file, track=source_track, cachefile=index_file)
+	return cropdetect.find_crop(video, samples=samples)
+
+def preindex(input_filename, preset):
+	"""
+	Indexes the video of an input file ahead of its encode, if the encode will
+	read the video straight from the input file.
+
+	This can run while other jobs are still encoding, so that the encode of
+	this file doesn't need to wait for the index.
+	:param input_filename: The file that will be encoded.
+	:param preset: The preset it will be encoded with.
+	"""
+	if preset in ["uhd", "hdanime"] and os.path.splitext(input_filename)[1].lower() == ".mkv":
+		index_source(input_filename)
 
+def count_frames(track_metadata, vapoursynth_script, frame_multiplier=1):
+	"""
+	Finds the number of frames that the encoder will receive for a video track.
+
+	This tries the cheapest sources first: the metadata we got when demuxing,
+	then the container headers, then the length of the VapourSynth clip. Only
+	if none of those are available, the whole video is decoded to count them.
+	Only exact counts are used. A count estimated from the duration could make
+	x265 expect frames that never come, or cut off the end of the video.
+	:param track_metadata: The video track to count the frames of.
+	:param vapoursynth_script: The script that will provide the frames to the
+	encoder.
+	:param frame_multiplier: How many frames the script produces for every
+	frame in the source, e.g. due to deinterlacing.
+	:return: The number of frames, or 0 if they could not be counted.
+	"""
+	if track_metadata.num_frames > 0: #Exact. Estimates are kept apart in estimated_frames.
+		print("Frame count from probing:", track_metadata.num_frames * frame_multiplier)
+		return track_metadata.num_frames * frame_multiplier
+	if track_metadata.source_file: #Not extracted. Look at the track in its original container.
+		source_file = track_metadata.source_file
+		stream = str(track_metadata.source_index)
+	else:
+		source_file = track_metadata.file_name
+		stream = "v:0"
+
+	#Many containers store the frame count in their headers (or tags, for MKV files made by MKVMerge).
+	ffprobe_command = ["ffprobe", "-v", "error", "-select_streams", stream, "-show_entries", "stream=nb_frames:stream_tags", "-of", "default=noprint_wrappers=1", source_file]
+	num_frames = 0
+	for line in run_output(ffprobe_command).split("\n"):
+		if line.startswith("nb_frames=") or line.startswith("TAG:NUMBER_OF_FRAMES"):
+			try:
+				num_frames = max(num_frames, int(line[line.find("=") + 1:]))
+			except ValueError: #N/A.
+				pass
+	if num_frames > 0:
+		print("Frame count from container:", num_frames * frame_multiplier)
+		return num_frames * frame_multiplier
+
+	#VapourSynth only needs to index the source to know the length of the clip. It already accounts for deinterlacing.
+	vspipe_command = ["vspipe", "--info", vapoursynth_script, "-"]
+	for line in run_output(vspipe_command).split("\n"):
+		if line.startswith("Frames: "):
+			try:
+				num_frames = int(line[len("Frames: "):])
+			except ValueError: #Unknown.
+				pass
+	if num_frames > 0:
+		print("Frame count from VapourSynth:", num_frames)
+		return num_frames
+
+	#Last resort: Decode the entire video.
+	ffprobe_command = ["ffprobe", "-v", "error", "-select_streams", stream, "-count_frames", "-show_entries", "stream=nb_read_frames", "-of", "default=noprint_wrappers=1", source_file]
+	for line in run_output(ffprobe_command).split("\n"):
+		if line.startswith("nb_read_frames="):
+			try:
+				num_frames = int(line[len("nb_read_frames="):])
+			except ValueError: #N/A.
+				pass
+	if num_frames > 0:
+		print("Frame count from decoding:", num_frames * frame_multiplier)
+	elif track_metadata.estimated_frames > 0:
+		print("Frame count unknown. About", track_metadata.estimated_frames * frame_multiplier, "frames, judging by the duration.")
+	return num_frames * frame_multiplier
+
+def numa_nodes():
+	"""
+	Counts the NUMA nodes of this machine.
+	:return: The number of NUMA nodes, or 1 if it's not known.
+	"""
+	return len(glob.glob("/sys/devices/system/node/node[0-9]*")) or 1
+
+def run_output(command):
+	"""
+	Calls a process and returns its output.
+	:param command: The command to call.
+	:return: The standard output of the process, or an empty string if the
+	process failed.
+	"""
+	print(command)
+	process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	(cout, cerr) = process.communicate()
+	exit_code = process.wait()
+	if exit_code != 0: #0 is success.
+		print("Calling {program} failed with exit code {exit_code}.".format(program=command[0], exit_code=exit_code))
+		return ""
+	return cout.decode("utf-8")
+
+def stats_files(stats_file):
+	"""
+	Lists all of the files that x265 creates for a multi-pass statistics file.
+	:param stats_file: The file name given to x265 with --stats.
+	:return: The statistics file and all of its side effect files.
+	"""
+	return [stats_file, stats_file + ".temp", stats_file + ".cutree", stats_file + ".cutree.temp"]
+
+def split_chunks(video_file, num_frames, parallel_chunks, min_chunk_length=500, track=-1, index_file=None):
+	"""
+	Splits a video into chunks at its scene cuts, to encode them in parallel.
+	:param video_file: The video file to find the scene cuts in.
+	:param num_frames: The number of frames that the encoder will receive. This
+	may differ from the number of frames in the video file due to deinterlacing.
+	:param parallel_chunks: How many chunks are going to be encoded at the same
+	time.
+	:param min_chunk_length: Chunks are never shorter than this number of
+	frames, since rate control gets poor on very short chunks.
+	:param track: The stream index of the video track in the video file, or -1
+	for the first video track.
+	:param index_file: The FFMS2 index of the video file, to not index it again.
+	:return: A list of (start, end) frame ranges, with end inclusive. If the
+	scene cuts could not be found, this list is empty.
+	"""
+	scenecut_command = [sys.executable, os.path.join(os.path.split(__file__)[0], "scenecut.py"), video_file, "--track", str(track)]
+	if index_file is not None:
+		scenecut_command += ["--index", index_file]
+	print(scenecut_command)
+	process = subprocess.Popen(scenecut_command, stdout=subprocess.PIPE)
+	(cout, cerr) = process.communicate()
+	exit_code = process.wait()
+	if exit_code != 0:
+		print("Finding scene cuts in {video_file} failed with exit code {exit_code}. Not splitting into chunks.".format(video_file=video_file, exit_code=exit_code))
+		return []
+	lines = cout.decode("utf-8").split()
+	source_frames = int(lines[0])
+	cuts = [round(int(line) * num_frames / source_frames) for line in lines[1:]] #Convert to the frame numbers after filtering.
+
+	#Make a few chunks for every parallel encode, so that they all finish at about the same time.
+	target_length = max(min_chunk_length, num_frames // (parallel_chunks * 4))
+	chunks = []
+	start = 0
+	for cut in cuts:
+		if cut - start >= target_length and num_frames - cut >= min_chunk_length:
+			chunks.append((start, cut - 1))
+			start = cut
+	chunks.append((start, num_frames - 1))
+	print("Split into", len(chunks), "chunks.")
+	return chunks
+
+def chunk_bitrates(chunk_stats, chunk_frames, bitrate, qcomp=0.6):
+	"""
+	Divides the bitrate of a video over its chunks, by how complex each chunk
+	is according to its first pass.
+
+	Like x265 does within a chunk, the bits of each frame are weighed by the
+	quantiser they were encoded with, and more complex frames get more bits,
+	but less than proportionally so.
+	:param chunk_stats: The statistics file of the first pass of each chunk.
+	:param chunk_frames: The number of frames in each chunk.
+	:param bitrate: The average bitrate of the whole video, in kbps.
+	:param qcomp: How much the bitrate follows the complexity, from 0 (not at
+	all) to 1 (proportionally). This is the same as x265's qcomp.
+	:return: The bitrate of each chunk, in kbps. If the statistics can't be
+	read, every chunk gets the same bitrate.
+	"""
+	weights = []
+	for stats_file in chunk_stats:
+		weight = 0
+		try:
+			with open(stats_file) as f:
+				for line in f:
+					if line.startswith("#"): #The options of the encode.
+						continue
+					fields = dict(field.split(":", 1) for field in line.replace(";", "").split() if ":" in field)
+					bits = int(fields["tex"]) + int(fields["mv"]) + int(fields["misc"])
+					qscale = 0.85 * 2 ** ((float(fields["q"]) - 12) / 6)
+					weight += (bits * qscale) ** qcomp
+		except (OSError, KeyError, ValueError) as e:
+			print("Could not read the statistics of", stats_file, ":", e, ". Giving every chunk the same bitrate.")
+			return [bitrate] * len(chunk_stats)
+		weights.append(weight)
+	if sum(weights) == 0:
+		return [bitrate] * len(chunk_stats)
+	total_frames = sum(chunk_frames)
+	return [max(1, round(bitrate * weight / sum(weights) * total_frames / frames)) for weight, frames in zip(weights, chunk_frames)]
+
+def parameter_sets(bitstream_file, search_size=1024 * 1024):
+	"""
+	Reads the video, sequence and picture parameter sets at the start of a raw
+	H265 bitstream.
+	:param bitstream_file: The bitstream, in Annex B format.
+	:param search_size: How many bytes at the start of the file to look in.
+	:return: The parameter set NAL units before the first picture, as bytes.
+	"""
+	with open(bitstream_file, "rb") as f:
+		data = f.read(search_size)
+	result = []
+	for nal_unit in data.split(b"\x00\x00\x01")[1:]:
+		nal_type = (nal_unit[0] >> 1) & 0x3f if nal_unit else 63
+		if nal_type < 32: #The first picture. Headers come before it.
+			break
+		if nal_type in (32, 33, 34): #VPS, SPS and PPS.
+			result.append(nal_unit.rstrip(b"\x00")) #Trailing zeroes belong to the next start code.
+	return result
+
+def encode_h265_passes(vapoursynth_script, x265_command, stats_file, new_file_name, intermediate_file, num_frames, filter_once, start=None, end=None, manifest=None, threads=None, passes=(1, 2)):
+	"""
+	Runs the x265 passes on the output of a VapourSynth script.
+	:param vapoursynth_script: The script providing the frames to encode.
+	:param x265_command: The x265 command line, without the parameters for the
+	passes, the statistics or the output file.
+	:param stats_file: Where to store the statistics of the first pass.
+	:param new_file_name: Where to store the resulting bitstream.
+	:param intermediate_file: Where to store the lossless intermediate, if
+	filter_once is set.
+	:param num_frames: The number of frames that will be encoded, or 0 if
+	unknown.
+	:param filter_once: Whether to spool the filtered frames to a lossless
+	intermediate during the first pass, and feed the second pass from that.
+	:param start: The first frame of the script to encode, or None to start at
+	the beginning.
+	:param end: The last frame of the script to encode (inclusive), or None to
+	encode up to the end.
+	:param manifest: If given, the passes that were completed are recorded in
+	this manifest, and passes that an earlier attempt completed are skipped.
+	:param threads: How many cores this encode may use. By default all of them.
+	:param passes: Which of the two passes to run. The second pass needs the
+	statistics of the first, from this call or an earlier one.
+	"""
+	if manifest is not None and manifest.stage("pass2:" + new_file_name) is not None:
+		print("---- Resuming after encoding", new_file_name)
+		return
+
+	vspipe_command = ["vspipe", "-c", "y4m"]
+	if start is not None:
+		vspipe_command += ["-s", str(start)]
+	if end is not None:
+		vspipe_command += ["-e", str(end)]
+	vspipe_command += [vapoursynth_script, "-"]
+	x265_command = x265_command + ["--stats", stats_file]
+	if num_frames != 0:
+		x265_command.append("--frames")
+		x265_command.append(str(num_frames))
+	x265_pass1 = ["--pass", "1", "-o", "/dev/null"]
+	x265_pass2 = ["--pass", "2", "-o", new_file_name]
+	intermediate_command = ["ffmpeg", "-loglevel", "error", "-i", intermediate_file, "-f", "yuv4mpegpipe", "-strict", "-1", "-"]
+	if 1 in passes:
+		if manifest is not None and manifest.stage("pass1:" + stats_file) is not None:
+			print("---- Resuming after first pass of", new_file_name)
+		else:
+			if filter_once:
+				#Tee the filtered frames into both the first pass and a lossless intermediate.
+				#FFV1 is much faster than x265, so a third of the cores keeps up with the first pass. It only accepts slice counts that divide the frame in a grid.
+				spool_threads = max(1, (threads or os.cpu_count()) // 3)
+				slices = max(count for count in [4, 6, 9, 12, 16, 24] if count <= max(4, spool_threads))
+				spool_command = ["ffmpeg", "-f", "yuv4mpegpipe", "-i", "-", "-c:v", "ffv1", "-level", "3", "-slices", str(slices), "-threads", str(spool_threads), "-y", intermediate_file]
+				print(" ".join(vspipe_command), "|", " ".join(x265_command + x265_pass1), "&", " ".join(spool_command))
+				exit_code = tee(vspipe_command, [x265_command + x265_pass1, spool_command])
+			else:
+				pass1_command = " ".join(vspipe_command) + " | " + " ".join(x265_command + x265_pass1)
+				print(pass1_command)
+				process = subprocess.Popen(pass1_command, shell=True)
+				(cout, cerr) = process.communicate()
+				exit_code = process.wait()
+			if exit_code != 0: #0 is success.
+				raise Exception("First x265 pass failed with exit code {exit_code}.".format(exit_code=exit_code))
+			if manifest is not None:
+				pass1_files = [stats_file, stats_file + ".cutree"] + ([intermediate_file] if filter_once else [])
+				manifest.complete("pass1:" + stats_file, [file_name for file_name in pass1_files if os.path.exists(file_name)])
+	if 2 not in passes:
+		return
+
+	source_command = intermediate_command if filter_once and os.path.exists(intermediate_file) else vspipe_command #The first pass may have run without an intermediate, for lack of space.
+	pass2_command = " ".join(source_command) + " | " + " ".join(x265_command + x265_pass2)
+	print(pass2_command)
+	process = subprocess.Popen(pass2_command, shell=True)
+	(cout, cerr) = process.communicate()
+	exit_code = process.wait()
+	if exit_code != 0: #0 is success.
+		raise Exception("Second x265 pass failed with exit code {exit_code}.".format(exit_code=exit_code))
+	if manifest is not None:
+		manifest.complete("pass2:" + new_file_name, [new_file_name])
+
+	#The lossless intermediate is huge. Don't keep it around any longer than necessary.
+	if os.path.exists(intermediate_file):
+		os.remove(intermediate_file)
+
+def mux_mkv(tracks, attachments, new_file_name, input_filename):
 	mux_command = ["mkvmerge", "-o", new_file_name]
 	title = os.path.splitext(os.path.split(input_filename)[1])[0]
 	mux_command.append("--title")
@@ -892,6 +1827,42 @@ def mux_mkv(tracks, attachments, guid, input_filename):
 	if exit_code == 1:
 		print("MKVMerge warning:", cout.decode("utf-8"))
 
+def tee(producer_command, consumer_commands):
+	"""
+	Pipes the output of one process into the input of several others.
+	:param producer_command: The command whose standard output to copy.
+	:param consumer_commands: A list of commands that each get a copy of that
+	output on their standard input.
+	:return: The first non-zero exit code of any of the processes, or 0 if they
+	all succeeded.
+	"""
+	producer = subprocess.Popen(producer_command, stdout=subprocess.PIPE)
+	consumers = [subprocess.Popen(command, stdin=subprocess.PIPE) for command in consumer_commands]
+	try:
+		while True:
+			chunk = producer.stdout.read(1 << 20)
+			if not chunk:
+				break
+			for consumer in consumers:
+				consumer.stdin.write(chunk)
+	except BrokenPipeError: #One of the consumers crashed. Stop all of them.
+		producer.kill()
+		for consumer in consumers:
+			consumer.kill()
+	finally:
+		producer.stdout.close()
+		for consumer in consumers:
+			try:
+				consumer.stdin.close()
+			except BrokenPipeError:
+				pass
+
+	exit_codes = [producer.wait()] + [consumer.wait() for consumer in consumers]
+	for exit_code in exit_codes:
+		if exit_code != 0:
+			return exit_code
+	return 0
+
 def ffmpeg(*options):
 	"""
 	Call upon FFMPEG to transcode something.
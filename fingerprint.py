@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import os #To find the playlists of a Blu-ray.
+import struct #To parse Blu-ray playlists.
+import subprocess #To sample frames of titles.
+
+class Title:
+	"""
+	Represents one title (and angle) of a disc, with what's needed to recognise
+	titles that have the same content.
+	"""
+
+	def __init__(self):
+		self.title_nr = -1
+		self.angle = 1
+		self.duration = 0.0 #In seconds.
+		self.segments = [] #The cells or clips that the title plays, in order. Empty if unknown.
+		self.file_name = "" #Where the title is extracted to.
+
+	def __repr__(self):
+		return "title " + str(self.title_nr) + " angle " + str(self.angle)
+
+def parse_duration(text):
+	"""
+	Parses a duration like 01:23:45.678.
+	:param text: The duration as hours, minutes and seconds.
+	:return: The duration in seconds.
+	"""
+	seconds = 0.0
+	for part in text.strip().split(":"):
+		seconds = seconds * 60 + float(part)
+	return seconds
+
+def mpls_segments(mpls_file):
+	"""
+	Reads which clips a Blu-ray playlist plays.
+	:param mpls_file: The playlist file, in BDMV/PLAYLIST.
+	:return: A list of (clip name, in time, out time) for every play item, or
+	an empty list if the playlist can't be read.
+	"""
+	try:
+		with open(mpls_file, "rb") as f:
+			data = f.read()
+		if data[0:4] != b"MPLS":
+			return []
+		playlist_start = struct.unpack_from(">I", data, 8)[0]
+		num_items = struct.unpack_from(">H", data, playlist_start + 6)[0]
+		segments = []
+		offset = playlist_start + 10
+		for _ in range(num_items):
+			length = struct.unpack_from(">H", data, offset)[0]
+			clip_name = data[offset + 2:offset + 7].decode("ascii")
+			in_time, out_time = struct.unpack_from(">II", data, offset + 14) #In 45kHz ticks.
+			segments.append((clip_name, in_time, out_time))
+			offset += length + 2
+		return segments
+	except (OSError, struct.error, UnicodeDecodeError):
+		return []
+
+def bluray_playlist(in_directory, playlist_nr):
+	"""
+	Finds the playlist file of a Blu-ray title.
+	:param in_directory: The root directory of the Blu-ray.
+	:param playlist_nr: The number of the playlist.
+	:return: The path to the playlist file.
+	"""
+	return os.path.join(in_directory, "BDMV", "PLAYLIST", "{playlist_nr:05d}.mpls".format(playlist_nr=playlist_nr))
+
+def find_duplicates(titles, tolerance=0.02):
+	"""
+	Finds the titles that only repeat content of other titles, by comparing
+	which cells or clips they play.
+
+	A title that plays the same segments as a title before it is a duplicate.
+	A title that plays the segments of at least two other titles and is about
+	as long as those together is a "play all" title. Angles of the same title
+	play the same segments but may show different content, so they are never
+	considered duplicates of each other here.
+	:param titles: The titles of a disc.
+	:param tolerance: How much the duration of a "play all" title may differ
+	from the titles it plays, as a fraction.
+	:return: A dictionary from the titles to skip to the reason why.
+	"""
+	skip = {}
+	known = {}
+	for title in titles:
+		if not title.segments:
+			continue
+		key = tuple(title.segments)
+		if key in known and known[key].title_nr != title.title_nr:
+			skip[title] = "plays the same segments as " + repr(known[key])
+		else:
+			known.setdefault(key, title)
+
+	for title in titles:
+		if title in skip or not title.segments:
+			continue
+		segments = set(title.segments)
+		covered = [other for other in titles if other is not title and other not in skip and other.angle == 1 and other.segments and set(other.segments) < segments]
+		if len(covered) >= 2 and abs(sum(other.duration for other in covered) - title.duration) <= title.duration * tolerance:
+			skip[title] = "plays " + ", ".join(repr(other) for other in covered)
+	return skip
+
+def candidate_groups(titles, tolerance=1.0):
+	"""
+	Groups titles that are about equally long, since those may have the same
+	content even if they play different segments.
+	:param titles: The titles that will be extracted.
+	:param tolerance: How much the durations may differ, in seconds.
+	:return: A list of groups of at least two titles.
+	"""
+	groups = []
+	for title in sorted(titles, key=lambda title: title.duration):
+		if groups and title.duration - groups[-1][-1].duration <= tolerance:
+			groups[-1].append(title)
+		else:
+			groups.append([title])
+	return [group for group in groups if len(group) > 1]
+
+def frame_hashes(file_name, duration, samples=8):
+	"""
+	Takes small greyscale thumbnails of frames spread over a video, to compare
+	it with other videos.
+	:param file_name: The video to sample.
+	:param duration: The length of the video, in seconds.
+	:param samples: How many frames to sample.
+	:return: A list of thumbnails as bytes. Frames that could not be decoded
+	are left out.
+	"""
+	hashes = []
+	for sample in range(samples):
+		position = duration * (sample + 0.5) / samples
+		ffmpeg_command = ["ffmpeg", "-loglevel", "error", "-ss", str(position), "-i", file_name, "-frames:v", "1", "-vf", "scale=16:16,format=gray", "-f", "rawvideo", "-"]
+		process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		(cout, cerr) = process.communicate()
+		if process.wait() == 0 and len(cout) == 16 * 16:
+			hashes.append(cout)
+	return hashes
+
+def same_content(hashes, other_hashes, threshold=6):
+	"""
+	Compares the sampled frames of two videos.
+	:param hashes: The thumbnails of one video.
+	:param other_hashes: The thumbnails of the other video.
+	:param threshold: How much the pixels of the thumbnails may differ on
+	average, from 0 to 255, to still count as the same frame.
+	:return: Whether all sampled frames are the same.
+	"""
+	if not hashes or len(hashes) != len(other_hashes):
+		return False
+	for thumbnail, other_thumbnail in zip(hashes, other_hashes):
+		difference = sum(abs(a - b) for a, b in zip(thumbnail, other_thumbnail)) / len(thumbnail)
+		if difference > threshold:
+			return False
+	return True
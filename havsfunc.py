@@ -326,6 +326,26 @@ def FixChromaBleedingMod(input: vs.VideoNode, cx: int = 4, cy: int = 4, thr: flo
     return join([input, fu, fv])
 
 
+_Deblock_QED_blocks = {}
+
+
+def _Deblock_QED_block(clp: vs.VideoNode, peak: Union[int, float]) -> vs.VideoNode:
+    '''
+    Single frame mask for Deblock_QED that is peak on the border pixels of each 8x8 block and 0 inside.
+    Built with one Expr on the pixel coordinates, and cached per environment, frame size and format so that it's only built once.
+    '''
+    key = (getattr(vs.get_current_environment(), 'env_id', 0), clp.width, clp.height, clp.format.id)
+    block = _Deblock_QED_blocks.get(key)
+    if block is None:
+        block = clp.std.BlankClip(format=clp.format.replace(color_family=vs.GRAY, subsampling_w=0, subsampling_h=0), length=1, color=0)
+        block = block.std.Expr(expr=f'X 8 % 1 + 8 % 2 < Y 8 % 1 + 8 % 2 < or {peak} 0 ?')
+        if clp.format.color_family != vs.GRAY:
+            blockc = block.std.CropAbs(width=clp.width >> clp.format.subsampling_w, height=clp.height >> clp.format.subsampling_h)
+            block = core.std.ShufflePlanes([block, blockc], planes=[0, 0, 0], colorfamily=clp.format.color_family)
+        _Deblock_QED_blocks[key] = block
+    return block
+
+
 def Deblock_QED(
     clp: vs.VideoNode, quant1: int = 24, quant2: int = 26, aOff1: int = 1, bOff1: int = 2, aOff2: int = 1, bOff2: int = 2, uv: int = 3
 ) -> vs.VideoNode:
@@ -376,14 +396,7 @@ def Deblock_QED(
         clp = clp.resize.Point(w + padX, h + padY, src_width=w + padX, src_height=h + padY)
 
     # block
-    block = clp.std.BlankClip(width=6, height=6, format=clp.format.replace(color_family=vs.GRAY, subsampling_w=0, subsampling_h=0), length=1, color=0)
-    block = block.std.AddBorders(1, 1, 1, 1, color=peak)
-    block = core.std.StackHorizontal([block for _ in range(clp.width // 8)])
-    block = core.std.StackVertical([block for _ in range(clp.height // 8)])
-    if not is_gray:
-        blockc = block.std.CropAbs(width=clp.width >> clp.format.subsampling_w, height=clp.height >> clp.format.subsampling_h)
-        block = core.std.ShufflePlanes([block, blockc], planes=[0, 0, 0], colorfamily=clp.format.color_family)
-    block = block.std.Loop(times=clp.num_frames)
+    block = _Deblock_QED_block(clp, peak).std.Loop(times=clp.num_frames)
 
     # create normal deblocking (for block borders) and strong deblocking (for block interiour)
     normal = clp.deblock.Deblock(quant=quant1, aoffset=aOff1, boffset=bOff1, planes=[0, 1, 2] if uv != 2 and not is_gray else 0)
@@ -1188,6 +1201,7 @@ def QTGMC(
     eedi3_args: Mapping[str, Any] = {},
     opencl: bool = False,
     device: Optional[int] = None,
+    mvCache: Optional[Any] = None,
 ) -> vs.VideoNode:
     '''
     QTGMC 3.33
@@ -1407,8 +1421,10 @@ def QTGMC(
                 Forward motion vectors                  fVec1, fVec2, fVec3
                 Filtered clip used for motion analysis  srchClip
                 MVTools "super" clip for filtered clip  srchSuper
+                Parameters of that "super" clip         superArgs (a dict of pel, hpad and vpad)
             Not all these clips are necessarily created - it depends on your QTGMC settings. To ensure motion vector creation to radius X, set ForceTR=X
             Clips can be accessed from other scripts with havsfunc.QTGMC_globals['Prefix_Name']
+            MCTemporalDenoise can reuse these motion vectors instead of searching again, with its GlobalNames parameter.
 
         PrevGlobals: What to do with global variables from earlier QTGMC call that match above name. Either "Replace", or "Reuse" (for a speed-up).
             Set PrevGlobals="Reuse" to reuse existing similar named globals for this run & not recalculate motion vectors etc. This will improve performance.
@@ -1439,6 +1455,9 @@ def QTGMC(
         opencl: Whether to use the OpenCL version of NNEDI3 and EEDI3.
 
         device: Sets target OpenCL device.
+
+        mvCache: A motion vector cache, such as mvcache.VectorCache, to read the motion vectors from if an earlier run of the same script already searched
+            them. The vectors that aren't in there yet are stored in it.
     '''
     if not isinstance(Input, vs.VideoNode):
         raise vs.Error('QTGMC: this is not a clip')
@@ -1799,36 +1818,42 @@ def QTGMC(
         dct=DCT,
     )
 
+    # Everything that changes the motion search clip, to tell the cached motion vectors apart
+    mv_settings = dict(
+        filter='QTGMC', Preset=Preset, Tuning=Tuning, InputType=InputType, TFF=TFF, Border=Border, TR0=TR0, Rep0=Rep0, RepChroma=RepChroma,
+        SrchClipPP=SrchClipPP, SubPelInterp=SubPelInterp, ChromaMotion=ChromaMotion, Str=Str, Amp=Amp, FastMA=FastMA
+    )
+
     # Calculate forward and backward motion vectors from motion search clip
     if maxTR > 0:
         if not isinstance(srchSuper, vs.VideoNode):
             srchSuper = srchClip.mv.Super(sharp=SubPelInterp, chroma=ChromaMotion, **super_args)
         if not isinstance(bVec1, vs.VideoNode):
-            bVec1 = srchSuper.mv.Analyse(isb=True, delta=1, **analyse_args)
+            bVec1 = _mv_analyse(mvCache, mv_settings, srchSuper, isb=True, delta=1, **analyse_args)
             if RefineMotion:
-                bVec1 = core.mv.Recalculate(srchSuper, bVec1, **recalculate_args)
+                bVec1 = _mv_recalculate(mvCache, mv_settings, srchSuper, bVec1, **recalculate_args)
         if not isinstance(fVec1, vs.VideoNode):
-            fVec1 = srchSuper.mv.Analyse(isb=False, delta=1, **analyse_args)
+            fVec1 = _mv_analyse(mvCache, mv_settings, srchSuper, isb=False, delta=1, **analyse_args)
             if RefineMotion:
-                fVec1 = core.mv.Recalculate(srchSuper, fVec1, **recalculate_args)
+                fVec1 = _mv_recalculate(mvCache, mv_settings, srchSuper, fVec1, **recalculate_args)
     if maxTR > 1:
         if not isinstance(bVec2, vs.VideoNode):
-            bVec2 = srchSuper.mv.Analyse(isb=True, delta=2, **analyse_args)
+            bVec2 = _mv_analyse(mvCache, mv_settings, srchSuper, isb=True, delta=2, **analyse_args)
             if RefineMotion:
-                bVec2 = core.mv.Recalculate(srchSuper, bVec2, **recalculate_args)
+                bVec2 = _mv_recalculate(mvCache, mv_settings, srchSuper, bVec2, **recalculate_args)
         if not isinstance(fVec2, vs.VideoNode):
-            fVec2 = srchSuper.mv.Analyse(isb=False, delta=2, **analyse_args)
+            fVec2 = _mv_analyse(mvCache, mv_settings, srchSuper, isb=False, delta=2, **analyse_args)
             if RefineMotion:
-                fVec2 = core.mv.Recalculate(srchSuper, fVec2, **recalculate_args)
+                fVec2 = _mv_recalculate(mvCache, mv_settings, srchSuper, fVec2, **recalculate_args)
     if maxTR > 2:
         if not isinstance(bVec3, vs.VideoNode):
-            bVec3 = srchSuper.mv.Analyse(isb=True, delta=3, **analyse_args)
+            bVec3 = _mv_analyse(mvCache, mv_settings, srchSuper, isb=True, delta=3, **analyse_args)
             if RefineMotion:
-                bVec3 = core.mv.Recalculate(srchSuper, bVec3, **recalculate_args)
+                bVec3 = _mv_recalculate(mvCache, mv_settings, srchSuper, bVec3, **recalculate_args)
         if not isinstance(fVec3, vs.VideoNode):
-            fVec3 = srchSuper.mv.Analyse(isb=False, delta=3, **analyse_args)
+            fVec3 = _mv_analyse(mvCache, mv_settings, srchSuper, isb=False, delta=3, **analyse_args)
             if RefineMotion:
-                fVec3 = core.mv.Recalculate(srchSuper, fVec3, **recalculate_args)
+                fVec3 = _mv_recalculate(mvCache, mv_settings, srchSuper, fVec3, **recalculate_args)
 
     # Expose search clip, motion search super clip and motion vectors to calling script through globals
     if ReplaceGlobals:
@@ -1840,6 +1865,7 @@ def QTGMC(
         QTGMC_SetUserGlobal(GlobalNames, 'fVec2', fVec2)
         QTGMC_SetUserGlobal(GlobalNames, 'bVec3', bVec3)
         QTGMC_SetUserGlobal(GlobalNames, 'fVec3', fVec3)
+        QTGMC_SetUserGlobal(GlobalNames, 'superArgs', super_args)
 
     # ---------------------------------------
     # Noise Processing
@@ -2184,8 +2210,8 @@ def QTGMC(
             dct=DCT,
             chroma=ChromaMotion,
         )
-        sbBVec1 = core.mv.Recalculate(srchSuper, bVec1, **recalculate_args)
-        sbFVec1 = core.mv.Recalculate(srchSuper, fVec1, **recalculate_args)
+        sbBVec1 = _mv_recalculate(mvCache, mv_settings, srchSuper, bVec1, **recalculate_args)
+        sbFVec1 = _mv_recalculate(mvCache, mv_settings, srchSuper, fVec1, **recalculate_args)
     elif ShutterBlur > 0:
         sbBVec1 = bVec1
         sbFVec1 = fVec1
@@ -2591,13 +2617,13 @@ def QTGMC_ApplySourceMatch(
     return core.std.MergeDiff(match1Shp, match3)
 
 
-def QTGMC_SetUserGlobal(Prefix: str, Name: str, Value: Union[vs.VideoNode, None]) -> None:
+def QTGMC_SetUserGlobal(Prefix: str, Name: str, Value: Union[vs.VideoNode, dict, None]) -> None:
     '''Set global variable called "Prefix_Name" to "Value".'''
     global QTGMC_globals
     QTGMC_globals[f'{Prefix}_{Name}'] = Value
 
 
-def QTGMC_GetUserGlobal(Prefix: str, Name: str) -> Union[vs.VideoNode, None]:
+def QTGMC_GetUserGlobal(Prefix: str, Name: str) -> Union[vs.VideoNode, dict, None]:
     '''Return value of global variable called "Prefix_Name". Returns None if it doesn't exist'''
     global QTGMC_globals
     return QTGMC_globals.get(f'{Prefix}_{Name}')
@@ -3747,6 +3773,16 @@ def GSMC(input, p=None, Lmask=None, nrmode=None, radius=1, adapt=-1, rep=13, pla
 ### |             - "medium"                                       |
 ### |             - "high"                                         |
 ### |             - "very high"                                    |
+### | GlobalNames : Reuse the motion vectors of an earlier QTGMC   |
+### |               call with these GlobalNames instead of         |
+### |               searching again. The input must have the size  |
+### |               and frame rate of QTGMC's output, so with      |
+### |               FPSDivisor=1 and Border=False. QTGMC needs a   |
+### |               ForceTR of at least radius, which is up to 3.  |
+### | mvCache  : A motion vector cache, such as                    |
+### |            mvcache.VectorCache, to read the motion vectors   |
+### |            from if an earlier run of the same script already |
+### |            searched them.                                    |
 ### +--------------------------------------------------------------+
 ###
 ###
@@ -3809,12 +3845,13 @@ def GSMC(input, p=None, Lmask=None, nrmode=None, radius=1, adapt=-1, rep=13, pla
 def MCTemporalDenoise(i, radius=None, pfMode=3, sigma=None, twopass=None, useTTmpSm=False, limit=None, limit2=None, post=0, chroma=None, refine=False, deblock=False, useQED=None, quant1=None,
                       quant2=None, edgeclean=False, ECrad=None, ECthr=None, stabilize=None, maxr=None, TTstr=None, bwbh=None, owoh=None, blksize=None, overlap=None, bt=None, ncpu=1, thSAD=None,
                       thSADC=None, thSAD2=None, thSADC2=None, thSCD1=None, thSCD2=None, truemotion=False, MVglobal=True, pel=None, pelsearch=None, search=4, searchparam=2, MVsharp=None, DCT=0, p=None,
-                      settings='low'):
+                      settings='low', GlobalNames=None, mvCache=None):
     if not isinstance(i, vs.VideoNode):
         raise vs.Error('MCTemporalDenoise: this is not a clip')
 
     if p is not None and (not isinstance(p, vs.VideoNode) or p.format.id != i.format.id):
         raise vs.Error("MCTemporalDenoise: 'p' must be the same format as input")
+    externalPrefilter = p is not None
 
     isGray = (i.format.color_family == vs.GRAY)
 
@@ -3893,15 +3930,24 @@ def MCTemporalDenoise(i, radius=None, pfMode=3, sigma=None, twopass=None, useTTm
     ECthr = scale(ECthr, peak)
     planes = [0, 1, 2] if chroma and not isGray else [0]
 
+    if GlobalNames is not None:
+        sharedSuperArgs = QTGMC_GetUserGlobal(GlobalNames, 'superArgs')
+        sharedVectors = [(QTGMC_GetUserGlobal(GlobalNames, f'bVec{delta}'), QTGMC_GetUserGlobal(GlobalNames, f'fVec{delta}')) for delta in range(1, radius + 1)]
+        if sharedSuperArgs is None or not all(isinstance(vector, vs.VideoNode) for pair in sharedVectors for vector in pair):
+            raise vs.Error(f"MCTemporalDenoise: no motion vectors up to radius {radius} were exposed by QTGMC with GlobalNames='{GlobalNames}'")
+
     ### INPUT
     mod = bwbh if bwbh >= blksize else blksize
     xi = i.width
-    xf = math.ceil(xi / mod) * mod - xi + mod
-    xf = xf + xf%4
-    xn = int(xi + xf)
     yi = i.height
-    yf = math.ceil(yi / mod) * mod - yi + mod
-    yf = yf + yf%4
+    if GlobalNames is None:
+        xf = math.ceil(xi / mod) * mod - xi + mod
+        xf = xf + xf%4
+        yf = math.ceil(yi / mod) * mod - yi + mod
+        yf = yf + yf%4
+    else:  # The shared motion vectors were searched on frames without padding.
+        xf = yf = 0
+    xn = int(xi + xf)
     yn = int(yi + yf)
 
     pointresize_args = dict(width=xn, height=yn, src_left=-xf / 2, src_top=-yf / 2, src_width=xn, src_height=yn)
@@ -3937,48 +3983,57 @@ def MCTemporalDenoise(i, radius=None, pfMode=3, sigma=None, twopass=None, useTTm
         d = i.std.Crop(**crop_args).deblock.Deblock(quant=(quant1 + quant2) // 2, planes=planes).resize.Point(**pointresize_args)
 
     ### PREPARING
-    super_args = dict(hpad=0, vpad=0, pel=pel, chroma=chroma, sharp=MVsharp)
-    pMVS = p.mv.Super(rfilter=4 if refine else 2, **super_args)
-    if refine:
-        rMVS = p.mv.Super(levels=1, **super_args)
-
-    analyse_args = dict(blksize=blksize, search=search, searchparam=searchparam, pelsearch=pelsearch, chroma=chroma, truemotion=truemotion, global_=MVglobal, overlap=overlap, dct=DCT)
-    recalculate_args = dict(thsad=thSAD // 2, blksize=max(blksize // 2, 4), search=search, chroma=chroma, truemotion=truemotion, overlap=max(overlap // 2, 2), dct=DCT)
-    f1v = pMVS.mv.Analyse(isb=False, delta=1, **analyse_args)
-    b1v = pMVS.mv.Analyse(isb=True, delta=1, **analyse_args)
-    if refine:
-        f1v = core.mv.Recalculate(rMVS, f1v, **recalculate_args)
-        b1v = core.mv.Recalculate(rMVS, b1v, **recalculate_args)
-    if radius > 1:
-        f2v = pMVS.mv.Analyse(isb=False, delta=2, **analyse_args)
-        b2v = pMVS.mv.Analyse(isb=True, delta=2, **analyse_args)
-        if refine:
-            f2v = core.mv.Recalculate(rMVS, f2v, **recalculate_args)
-            b2v = core.mv.Recalculate(rMVS, b2v, **recalculate_args)
-    if radius > 2:
-        f3v = pMVS.mv.Analyse(isb=False, delta=3, **analyse_args)
-        b3v = pMVS.mv.Analyse(isb=True, delta=3, **analyse_args)
+    if GlobalNames is None:
+        super_args = dict(hpad=0, vpad=0, pel=pel, chroma=chroma, sharp=MVsharp)
+        pMVS = p.mv.Super(rfilter=4 if refine else 2, **super_args)
         if refine:
-            f3v = core.mv.Recalculate(rMVS, f3v, **recalculate_args)
-            b3v = core.mv.Recalculate(rMVS, b3v, **recalculate_args)
-    if radius > 3:
-        f4v = pMVS.mv.Analyse(isb=False, delta=4, **analyse_args)
-        b4v = pMVS.mv.Analyse(isb=True, delta=4, **analyse_args)
-        if refine:
-            f4v = core.mv.Recalculate(rMVS, f4v, **recalculate_args)
-            b4v = core.mv.Recalculate(rMVS, b4v, **recalculate_args)
-    if radius > 4:
-        f5v = pMVS.mv.Analyse(isb=False, delta=5, **analyse_args)
-        b5v = pMVS.mv.Analyse(isb=True, delta=5, **analyse_args)
-        if refine:
-            f5v = core.mv.Recalculate(rMVS, f5v, **recalculate_args)
-            b5v = core.mv.Recalculate(rMVS, b5v, **recalculate_args)
-    if radius > 5:
-        f6v = pMVS.mv.Analyse(isb=False, delta=6, **analyse_args)
-        b6v = pMVS.mv.Analyse(isb=True, delta=6, **analyse_args)
+            rMVS = p.mv.Super(levels=1, **super_args)
+
+        analyse_args = dict(blksize=blksize, search=search, searchparam=searchparam, pelsearch=pelsearch, chroma=chroma, truemotion=truemotion, global_=MVglobal, overlap=overlap, dct=DCT)
+        mv_settings = dict(filter='MCTemporalDenoise', pfMode=pfMode, sigma=sigma, p=externalPrefilter, chroma=chroma, bwbh=bwbh, owoh=owoh, bt=bt, pel=pel, MVsharp=MVsharp, refine=refine)
+        recalculate_args = dict(thsad=thSAD // 2, blksize=max(blksize // 2, 4), search=search, chroma=chroma, truemotion=truemotion, overlap=max(overlap // 2, 2), dct=DCT)
+        f1v = _mv_analyse(mvCache, mv_settings, pMVS, isb=False, delta=1, **analyse_args)
+        b1v = _mv_analyse(mvCache, mv_settings, pMVS, isb=True, delta=1, **analyse_args)
         if refine:
-            f6v = core.mv.Recalculate(rMVS, f6v, **recalculate_args)
-            b6v = core.mv.Recalculate(rMVS, b6v, **recalculate_args)
+            f1v = _mv_recalculate(mvCache, mv_settings, rMVS, f1v, **recalculate_args)
+            b1v = _mv_recalculate(mvCache, mv_settings, rMVS, b1v, **recalculate_args)
+        if radius > 1:
+            f2v = _mv_analyse(mvCache, mv_settings, pMVS, isb=False, delta=2, **analyse_args)
+            b2v = _mv_analyse(mvCache, mv_settings, pMVS, isb=True, delta=2, **analyse_args)
+            if refine:
+                f2v = _mv_recalculate(mvCache, mv_settings, rMVS, f2v, **recalculate_args)
+                b2v = _mv_recalculate(mvCache, mv_settings, rMVS, b2v, **recalculate_args)
+        if radius > 2:
+            f3v = _mv_analyse(mvCache, mv_settings, pMVS, isb=False, delta=3, **analyse_args)
+            b3v = _mv_analyse(mvCache, mv_settings, pMVS, isb=True, delta=3, **analyse_args)
+            if refine:
+                f3v = _mv_recalculate(mvCache, mv_settings, rMVS, f3v, **recalculate_args)
+                b3v = _mv_recalculate(mvCache, mv_settings, rMVS, b3v, **recalculate_args)
+        if radius > 3:
+            f4v = _mv_analyse(mvCache, mv_settings, pMVS, isb=False, delta=4, **analyse_args)
+            b4v = _mv_analyse(mvCache, mv_settings, pMVS, isb=True, delta=4, **analyse_args)
+            if refine:
+                f4v = _mv_recalculate(mvCache, mv_settings, rMVS, f4v, **recalculate_args)
+                b4v = _mv_recalculate(mvCache, mv_settings, rMVS, b4v, **recalculate_args)
+        if radius > 4:
+            f5v = _mv_analyse(mvCache, mv_settings, pMVS, isb=False, delta=5, **analyse_args)
+            b5v = _mv_analyse(mvCache, mv_settings, pMVS, isb=True, delta=5, **analyse_args)
+            if refine:
+                f5v = _mv_recalculate(mvCache, mv_settings, rMVS, f5v, **recalculate_args)
+                b5v = _mv_recalculate(mvCache, mv_settings, rMVS, b5v, **recalculate_args)
+        if radius > 5:
+            f6v = _mv_analyse(mvCache, mv_settings, pMVS, isb=False, delta=6, **analyse_args)
+            b6v = _mv_analyse(mvCache, mv_settings, pMVS, isb=True, delta=6, **analyse_args)
+            if refine:
+                f6v = _mv_recalculate(mvCache, mv_settings, rMVS, f6v, **recalculate_args)
+                b6v = _mv_recalculate(mvCache, mv_settings, rMVS, b6v, **recalculate_args)
+    else:
+        super_args = dict(chroma=chroma, sharp=MVsharp, **sharedSuperArgs)
+        b1v, f1v = sharedVectors[0]
+        if radius > 1:
+            b2v, f2v = sharedVectors[1]
+        if radius > 2:
+            b3v, f3v = sharedVectors[2]
 
     # if useTTmpSm or stabilize:
         # mask_args = dict(ml=thSAD, gamma=0.999, kind=1, ysc=255)
@@ -4147,7 +4202,7 @@ def MCTemporalDenoise(i, radius=None, pfMode=3, sigma=None, twopass=None, useTTm
 bv6 = bv4 = bv3 = bv2 = bv1 = fv1 = fv2 = fv3 = fv4 = fv6 = None
 
 def SMDegrain(input, tr=2, thSAD=300, thSADC=None, RefineMotion=False, contrasharp=None, CClip=None, interlaced=False, tff=None, plane=4, Globals=0, pel=None, subpixel=2, prefilter=-1, mfilter=None,
-              blksize=None, overlap=None, search=4, truemotion=None, MVglobal=None, dct=0, limit=255, limitc=None, thSCD1=400, thSCD2=130, chroma=True, hpad=None, vpad=None, Str=1.0, Amp=0.0625, opencl=False, device=None):
+              blksize=None, overlap=None, search=4, truemotion=None, MVglobal=None, dct=0, limit=255, limitc=None, thSCD1=400, thSCD2=130, chroma=True, hpad=None, vpad=None, Str=1.0, Amp=0.0625, opencl=False, device=None, mvCache=None):
     if not isinstance(input, vs.VideoNode):
         raise vs.Error('SMDegrain: this is not a clip')
 
@@ -4281,6 +4336,7 @@ def SMDegrain(input, tr=2, thSAD=300, thSADC=None, RefineMotion=False, contrasha
     analyse_args = dict(blksize=blksize, search=search, chroma=chroma, truemotion=truemotion, global_=MVglobal, overlap=overlap, dct=dct)
     if RefineMotion:
         recalculate_args = dict(thsad=halfthSAD, blksize=halfblksize, search=search, chroma=chroma, truemotion=truemotion, overlap=halfoverlap, dct=dct)
+    mv_settings = dict(filter='SMDegrain', interlaced=interlaced, tff=tff, prefilter='clip' if preclip else prefilter, chroma=chroma, pel=pel, subpixel=subpixel, Str=Str, Amp=Amp)
 
     if pelclip:
         super_search = pref.mv.Super(chroma=chroma, rfilter=4, pelclip=pclip, **super_args)
@@ -4299,35 +4355,35 @@ def SMDegrain(input, tr=2, thSAD=300, thSADC=None, RefineMotion=False, contrasha
 
         if interlaced:
             if tr > 2:
-                bv6 = super_search.mv.Analyse(isb=True, delta=6, **analyse_args)
-                fv6 = super_search.mv.Analyse(isb=False, delta=6, **analyse_args)
+                bv6 = _mv_analyse(mvCache, mv_settings, super_search, isb=True, delta=6, **analyse_args)
+                fv6 = _mv_analyse(mvCache, mv_settings, super_search, isb=False, delta=6, **analyse_args)
                 if RefineMotion:
-                    bv6 = core.mv.Recalculate(Recalculate, bv6, **recalculate_args)
-                    fv6 = core.mv.Recalculate(Recalculate, fv6, **recalculate_args)
+                    bv6 = _mv_recalculate(mvCache, mv_settings, Recalculate, bv6, **recalculate_args)
+                    fv6 = _mv_recalculate(mvCache, mv_settings, Recalculate, fv6, **recalculate_args)
             if tr > 1:
-                bv4 = super_search.mv.Analyse(isb=True, delta=4, **analyse_args)
-                fv4 = super_search.mv.Analyse(isb=False, delta=4, **analyse_args)
+                bv4 = _mv_analyse(mvCache, mv_settings, super_search, isb=True, delta=4, **analyse_args)
+                fv4 = _mv_analyse(mvCache, mv_settings, super_search, isb=False, delta=4, **analyse_args)
                 if RefineMotion:
-                    bv4 = core.mv.Recalculate(Recalculate, bv4, **recalculate_args)
-                    fv4 = core.mv.Recalculate(Recalculate, fv4, **recalculate_args)
+                    bv4 = _mv_recalculate(mvCache, mv_settings, Recalculate, bv4, **recalculate_args)
+                    fv4 = _mv_recalculate(mvCache, mv_settings, Recalculate, fv4, **recalculate_args)
         else:
             if tr > 2:
-                bv3 = super_search.mv.Analyse(isb=True, delta=3, **analyse_args)
-                fv3 = super_search.mv.Analyse(isb=False, delta=3, **analyse_args)
+                bv3 = _mv_analyse(mvCache, mv_settings, super_search, isb=True, delta=3, **analyse_args)
+                fv3 = _mv_analyse(mvCache, mv_settings, super_search, isb=False, delta=3, **analyse_args)
                 if RefineMotion:
-                    bv3 = core.mv.Recalculate(Recalculate, bv3, **recalculate_args)
-                    fv3 = core.mv.Recalculate(Recalculate, fv3, **recalculate_args)
-            bv1 = super_search.mv.Analyse(isb=True, delta=1, **analyse_args)
-            fv1 = super_search.mv.Analyse(isb=False, delta=1, **analyse_args)
+                    bv3 = _mv_recalculate(mvCache, mv_settings, Recalculate, bv3, **recalculate_args)
+                    fv3 = _mv_recalculate(mvCache, mv_settings, Recalculate, fv3, **recalculate_args)
+            bv1 = _mv_analyse(mvCache, mv_settings, super_search, isb=True, delta=1, **analyse_args)
+            fv1 = _mv_analyse(mvCache, mv_settings, super_search, isb=False, delta=1, **analyse_args)
             if RefineMotion:
-                bv1 = core.mv.Recalculate(Recalculate, bv1, **recalculate_args)
-                fv1 = core.mv.Recalculate(Recalculate, fv1, **recalculate_args)
+                bv1 = _mv_recalculate(mvCache, mv_settings, Recalculate, bv1, **recalculate_args)
+                fv1 = _mv_recalculate(mvCache, mv_settings, Recalculate, fv1, **recalculate_args)
         if interlaced or tr > 1:
-            bv2 = super_search.mv.Analyse(isb=True, delta=2, **analyse_args)
-            fv2 = super_search.mv.Analyse(isb=False, delta=2, **analyse_args)
+            bv2 = _mv_analyse(mvCache, mv_settings, super_search, isb=True, delta=2, **analyse_args)
+            fv2 = _mv_analyse(mvCache, mv_settings, super_search, isb=False, delta=2, **analyse_args)
             if RefineMotion:
-                bv2 = core.mv.Recalculate(Recalculate, bv2, **recalculate_args)
-                fv2 = core.mv.Recalculate(Recalculate, fv2, **recalculate_args)
+                bv2 = _mv_recalculate(mvCache, mv_settings, Recalculate, bv2, **recalculate_args)
+                fv2 = _mv_recalculate(mvCache, mv_settings, Recalculate, fv2, **recalculate_args)
     else:
         super_render = super_search
 
@@ -6462,6 +6518,20 @@ def mt_deflate_multi(src: vs.VideoNode, planes: Optional[Union[int, Sequence[int
     return src
 
 
+def _mv_analyse(mvCache: Optional[Any], settings: Mapping[str, Any], super: vs.VideoNode, **analyse_args: Any) -> vs.VideoNode:
+    '''mv.Analyse, through the motion vector cache if there is one.'''
+    if mvCache is None:
+        return super.mv.Analyse(**analyse_args)
+    return mvCache.analyse(super, settings, **analyse_args)
+
+
+def _mv_recalculate(mvCache: Optional[Any], settings: Mapping[str, Any], super: vs.VideoNode, vectors: vs.VideoNode, **recalculate_args: Any) -> vs.VideoNode:
+    '''mv.Recalculate, through the motion vector cache if there is one.'''
+    if mvCache is None:
+        return core.mv.Recalculate(super, vectors, **recalculate_args)
+    return mvCache.recalculate(super, vectors, settings, **recalculate_args)
+
+
 def cround(x: float) -> int:
     return math.floor(x + 0.5) if x > 0 else math.ceil(x - 0.5)
 
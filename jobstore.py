@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import os  # To create the directory of the database.
+import sqlite3  # To store the jobs persistently.
+import threading  # To allow updating jobs from multiple worker threads.
+import time  # To record when jobs were updated.
+import uuid  # To give new jobs a file name prefix.
+
+import probe  # To notice when an input file is replaced.
+
+# The states that a job goes through, in order. A job can become "failed" from any state.
+states = ["discovered", "probing", "demuxed", "encoded", "muxed", "done"]
+# How long to wait before retrying a failed job, in seconds. This doubles with every attempt that fails.
+retry_delay = 600
+# After this many failed attempts, a job is only retried once its input file is replaced.
+max_attempts = 5
+
+class JobStore:
+    """
+    Keeps track of the progress of each input file in an SQLite database.
+
+    This survives restarts, so that interrupted jobs can be resumed with the
+    same intermediate files, instead of being rediscovered and started over.
+    """
+
+    def __init__(self, database):
+        """
+        Opens the job database, creating it if it doesn't exist yet.
+        :param database: The file to store the database in.
+        """
+        directory = os.path.dirname(database)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (input TEXT PRIMARY KEY, output TEXT, preset TEXT, guid TEXT, state TEXT, error TEXT, updated REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS tracks (input TEXT, track_nr INTEGER, state TEXT, PRIMARY KEY (input, track_nr))")
+            columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+            if "identity" not in columns:  # Made by an older version.
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN identity TEXT")
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def discover(self, input_filename, output_filename, preset):
+        """
+        Registers an input file as a job.
+
+        If the file was already registered, the existing job is returned so it
+        can be resumed. If that job is done, or failed too recently or too
+        often, it's not run again unless the file was replaced since. A
+        replaced file starts over as a new job.
+        :param input_filename: The file to process.
+        :param output_filename: Where the result is stored.
+        :param preset: The preset to process the file with.
+        :return: The job, as a dictionary of its fields, or None if it shouldn't
+        run now.
+        """
+        identity = probe.identity(input_filename)
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT * FROM jobs WHERE input = ?", (input_filename,)).fetchone()
+            if row is not None and row["identity"] is None:  # Recorded by an older version. Assume that it's the same file.
+                self.connection.execute("UPDATE jobs SET identity = ? WHERE input = ?", (identity, input_filename))
+            elif row is not None and row["identity"] != identity:
+                row = None
+            if row is not None:
+                if row["state"] == "done":
+                    return None
+                if row["state"] == "failed" and (row["attempts"] >= max_attempts or time.time() - row["updated"] < retry_delay * 2 ** (row["attempts"] - 1)):
+                    return None
+                return dict(row)
+            self.connection.execute("DELETE FROM tracks WHERE input = ?", (input_filename,))
+            self.connection.execute("INSERT OR REPLACE INTO jobs (input, output, preset, guid, state, error, updated, identity, attempts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (input_filename, output_filename, preset, uuid.uuid4().hex, "discovered", None, time.time(), identity, 0))
+            return dict(self.connection.execute("SELECT * FROM jobs WHERE input = ?", (input_filename,)).fetchone())
+
+    def set_state(self, input_filename, state, track_nr=None, error=None):
+        """
+        Records the progress of a job.
+        :param input_filename: The input file of the job.
+        :param state: The stage that the job has completed, or "failed".
+        :param track_nr: If given, the state applies to just this track of the
+        input file. These are only a record of the progress. Resuming halfway
+        through the tracks is up to the manifest in the work directory.
+        :param error: If the job failed, the reason why.
+        """
+        with self.lock, self.connection:
+            if track_nr is not None:
+                self.connection.execute("INSERT OR REPLACE INTO tracks (input, track_nr, state) VALUES (?, ?, ?)", (input_filename, track_nr, state))
+            elif state == "failed":
+                self.connection.execute("UPDATE jobs SET state = ?, error = ?, updated = ?, attempts = attempts + 1 WHERE input = ?", (state, error, time.time(), input_filename))
+            else:
+                self.connection.execute("UPDATE jobs SET state = ?, error = ?, updated = ? WHERE input = ?", (state, error, time.time(), input_filename))
+
+    def unfinished(self):
+        """
+        Lists the jobs that were started but are not yet done, to resume them
+        right away after a restart.
+
+        Failed jobs are not included. Their input files are still found by the
+        next scans of the directory, and once the job is due for a retry,
+        discover() returns it with its guid, so the retry resumes after the
+        stages it completed.
+        :return: A list of jobs as dictionaries, the furthest progressed first.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM jobs WHERE state NOT IN ('discovered', 'done', 'failed')").fetchall()
+        return sorted((dict(row) for row in rows), key=lambda job: -states.index(job["state"]))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+#Keeps the motion vectors that MVTools finds, so that later runs of the same VapourSynth script don't need to search them again.
+#Every pass and every retry of an encode runs the script again, and the motion search is the slowest part of most filters.
+#Only versions of MVTools that store the vectors in frame properties can be cached. With older versions, the vectors are just searched every time.
+
+import hashlib #To make short keys of the search parameters.
+import json #To serialise the search parameters and the frame properties.
+import atexit #To write the last vectors when the script ends.
+import os #To create the directory of the cache.
+import sqlite3 #To store the vectors.
+import struct #To pack the frame properties.
+import sys #To report without mixing it into the video that VSPipe writes to stdout.
+import threading #Frames are requested from multiple threads.
+import time #To remove old vectors.
+import zlib #To make the vectors smaller.
+
+import probe #To identify the sources.
+
+#Vectors that weren't used for this many seconds are removed from the cache.
+cache_age = 30 * 24 * 3600
+#How many frames of vectors to collect before writing them to the cache together. Every write waits for the disk.
+batch_size = 64
+#How long to collect vectors at most before writing them, in seconds.
+batch_time = 10
+
+_opened = {} #For each cache file, whether it could be opened.
+_pending = {} #For each cache file, the vectors that are not written yet, and since when they're collected.
+_local = threading.local() #The connections of each thread, so that reading frames doesn't wait for other threads.
+_lock = threading.Lock()
+
+class VectorCache:
+	"""
+	Stores the motion vectors that the filters of a VapourSynth script find in
+	one source.
+
+	Each motion search is identified by the source, the context of the script,
+	the settings of the filter and the parameters of the search. If any of
+	those change, the search gets a different key and its vectors are searched
+	again. The vectors are stored per frame, so that chunks of the script that
+	are encoded separately each fill in their own part.
+	"""
+
+	def __init__(self, source, context="", cache_file=None):
+		"""
+		Opens the cache for a source.
+		:param source: The video file that the script reads.
+		:param context: Anything else that changes the frames before they are
+		searched, such as the filters of the script.
+		:param cache_file: Where to store the vectors. If None, nothing is
+		stored and the vectors are searched every time.
+		"""
+		self.source = probe.identity(source)
+		self.context = context
+		self.cache_file = None
+		self.keys = [] #The key of each clip of vectors that was given out, to identify vectors that get recalculated.
+		if cache_file is not None and self.source is not None and _connect(cache_file) is not None:
+			self.cache_file = cache_file
+
+	def analyse(self, super_clip, settings, **analyse_args):
+		"""
+		Searches motion vectors with MVTools, or reads them from the cache.
+		:param super_clip: The super clip to search in.
+		:param settings: The settings of the filter that change the super clip,
+		as a dictionary that can be serialised to JSON.
+		:param analyse_args: The parameters of mv.Analyse.
+		:return: The motion vectors.
+		"""
+		vectors = super_clip.mv.Analyse(**analyse_args)
+		return self._cached(vectors, ["Analyse", settings, _describe(super_clip), analyse_args])
+
+	def recalculate(self, super_clip, vectors, settings, **recalculate_args):
+		"""
+		Refines motion vectors with MVTools, or reads the refined vectors from
+		the cache.
+		:param super_clip: The super clip to refine the vectors in.
+		:param vectors: The vectors to refine. These are only cached if they
+		came from this cache too.
+		:param settings: The settings of the filter that change the super clip,
+		as a dictionary that can be serialised to JSON.
+		:param recalculate_args: The parameters of mv.Recalculate.
+		:return: The refined motion vectors.
+		"""
+		recalculated = super_clip.mv.Recalculate(vectors, **recalculate_args)
+		vectors_key = next((key for clip, key in self.keys if clip is vectors), None)
+		if vectors_key is None:
+			return recalculated
+		return self._cached(recalculated, ["Recalculate", vectors_key, settings, _describe(super_clip), recalculate_args])
+
+	def _cached(self, vectors, parameters):
+		"""
+		Makes a clip of motion vectors read the frames that are in the cache
+		from there, and store the other frames in the cache in batches as they
+		are searched.
+		:param vectors: The motion vectors, as found by MVTools.
+		:param parameters: Everything that identifies the search within the
+		script.
+		:return: The motion vectors, partially from the cache.
+		"""
+		if self.cache_file is None:
+			return vectors
+		key = hashlib.sha1(json.dumps([self.source, self.context, parameters], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+		connection = _connect(self.cache_file)
+		with connection:
+			connection.execute("INSERT OR REPLACE INTO searches (key, source, used) VALUES (?, ?, ?)", (key, self.source, time.time()))
+		stored = {row[0] for row in connection.execute("SELECT frame FROM vectors WHERE key = ?", (key,))}
+		if stored:
+			print("Using", len(stored), "cached frames of motion vectors.", file=sys.stderr)
+
+		def load(n, f):
+			row = _connect(self.cache_file).execute("SELECT data FROM vectors WHERE key = ? AND frame = ?", (key, n)).fetchone()
+			result = f.copy()
+			for name, value in _unpack(row[0]).items():
+				result.props[name] = value
+			return result
+
+		def store(n, f):
+			properties = {name: value for name, value in f.props.items() if name.startswith("MVTools_")}
+			if properties: #Otherwise this version of MVTools stores the vectors in the frame itself.
+				_write(self.cache_file, (key, n, _pack(properties)))
+			return f
+
+		blank = vectors.std.BlankClip(keep=True)
+		from_cache = blank.std.ModifyFrame(blank, load)
+		from_search = vectors.std.ModifyFrame(vectors, store)
+		result = blank.std.FrameEval(lambda n: from_cache if n in stored else from_search)
+		self.keys.append((result, key))
+		return result
+
+def forget(source, cache_file):
+	"""
+	Removes all motion vectors of a source from the cache, for when it won't be
+	encoded again.
+	:param source: The video file that the vectors were searched in.
+	:param cache_file: The cache to remove them from.
+	"""
+	source = probe.identity(source)
+	if cache_file is None or source is None or not os.path.exists(cache_file):
+		return
+	connection = _connect(cache_file)
+	if connection is None:
+		return
+	with connection:
+		connection.execute("DELETE FROM vectors WHERE key IN (SELECT key FROM searches WHERE source = ?)", (source,))
+		connection.execute("DELETE FROM searches WHERE source = ?", (source,))
+
+def flush():
+	"""
+	Writes all vectors that were collected but not written to the cache yet.
+	"""
+	with _lock:
+		batches = [(cache_file, rows) for cache_file, (rows, since) in _pending.items() if rows]
+		_pending.clear()
+	for cache_file, rows in batches:
+		_write_rows(cache_file, rows)
+
+atexit.register(flush)
+
+def _write(cache_file, row):
+	"""
+	Stores the vectors of a frame in a cache, together with other frames once
+	enough of them were collected.
+	:param cache_file: The cache to store them in.
+	:param row: The key of the search, the frame number and the packed vectors.
+	"""
+	with _lock:
+		rows, since = _pending.setdefault(cache_file, ([], time.time()))
+		rows.append(row)
+		if len(rows) < batch_size and time.time() - since < batch_time:
+			return
+		del _pending[cache_file]
+	_write_rows(cache_file, rows)
+
+def _write_rows(cache_file, rows):
+	"""
+	Writes the vectors of multiple frames to a cache in one transaction.
+	:param cache_file: The cache to write them to.
+	:param rows: For each frame, the key of the search, the frame number and
+	the packed vectors.
+	"""
+	connection = _connect(cache_file)
+	if connection is None:
+		return
+	try:
+		with connection:
+			connection.executemany("INSERT OR REPLACE INTO vectors (key, frame, data) VALUES (?, ?, ?)", rows)
+	except sqlite3.Error as e: #They'll just be searched again next time.
+		print("Could not store motion vectors in", cache_file, ":", e, file=sys.stderr)
+
+def _describe(clip):
+	"""
+	Describes the shape of a clip, for the key of a search.
+	:param clip: A VapourSynth clip.
+	:return: A list of its format, size, length and frame rate.
+	"""
+	return [clip.format.name, clip.width, clip.height, clip.num_frames, clip.fps_num, clip.fps_den]
+
+def _pack(properties):
+	"""
+	Serialises frame properties.
+	:param properties: A dictionary of frame properties. Binary data is stored
+	as is, the rest as JSON.
+	:return: The compressed properties, as bytes.
+	"""
+	header = []
+	data = []
+	for name, value in properties.items():
+		if isinstance(value, bytes):
+			header.append([name, "data", len(value)])
+			data.append(value)
+		else:
+			header.append([name, "value", value])
+	header = json.dumps(header).encode("utf-8")
+	return zlib.compress(struct.pack("<I", len(header)) + header + b"".join(data))
+
+def _unpack(packed):
+	"""
+	Deserialises frame properties that were serialised with _pack.
+	:param packed: The compressed properties.
+	:return: A dictionary of frame properties.
+	"""
+	packed = zlib.decompress(packed)
+	header_length = struct.unpack_from("<I", packed)[0]
+	offset = 4 + header_length
+	properties = {}
+	for name, kind, value in json.loads(packed[4:offset].decode("utf-8")):
+		if kind == "data":
+			properties[name] = packed[offset:offset + value]
+			offset += value
+		else:
+			properties[name] = value
+	return properties
+
+def _connect(cache_file):
+	"""
+	Opens a cache file for the current thread, if it's not opened yet.
+
+	Each thread gets a connection of its own, so that they can read frames at
+	the same time. Writes still take turns, which SQLite arranges by itself.
+	The first time a cache file is opened, old vectors are removed from it.
+	:param cache_file: The cache file to open.
+	:return: A connection to the cache database, or None if it can't be
+	opened.
+	"""
+	connections = _local.__dict__.setdefault("connections", {})
+	if cache_file in connections:
+		return connections[cache_file]
+	with _lock: #Only prepare the file once, while the other threads wait.
+		if _opened.get(cache_file) is False:
+			return None
+		try:
+			os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+			connection = sqlite3.connect(cache_file, timeout=60) #Chunks that are encoded in parallel share the cache.
+			connection.execute("PRAGMA journal_mode=WAL") #Readers don't wait for writers.
+			if cache_file not in _opened:
+				with connection:
+					connection.execute("CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, source TEXT, used REAL)")
+					connection.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT, frame INTEGER, data BLOB, PRIMARY KEY (key, frame))")
+					connection.execute("DELETE FROM vectors WHERE key IN (SELECT key FROM searches WHERE used < ?)", (time.time() - cache_age,))
+					connection.execute("DELETE FROM searches WHERE used < ?", (time.time() - cache_age,))
+		except (OSError, sqlite3.Error) as e:
+			print("Could not open the motion vector cache", cache_file, ":", e, file=sys.stderr)
+			_opened[cache_file] = False
+			return None
+		_opened[cache_file] = True
+	connections[cache_file] = connection
+	return connection
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import collections #To forget the least recently used probe results first.
+import json #To parse the output of the probes.
+import os #To identify files for the cache.
+import sqlite3 #To store the cache.
+import subprocess #To call the probes.
+import threading #To allow probing from multiple threads.
+import time #To remove old probe results.
+
+#Where to store the probe results between runs. Set to None to only cache in memory.
+cache_file = os.path.join(os.path.expanduser("~"), ".cache", "autoencode", "probes.sqlite")
+
+#Probe results that weren't used for this many seconds are removed from the cache file.
+cache_age = 30 * 24 * 3600
+#How many probe results to keep in memory.
+memory_size = 256
+
+_cache = collections.OrderedDict() #Recent probe results of this run, by identity, least recently used first.
+_cache_connection = None
+_cache_pruned = 0 #When old probe results were last removed from the cache file.
+_cache_lock = threading.Lock()
+
+def ffprobe(in_file):
+	"""
+	Gets the streams, programs and container information of a media file.
+	:param in_file: The file to probe. This may be anything FFmpeg accepts as
+	input, such as a concat: URL.
+	:return: The parsed JSON output of FFprobe, with "streams", "programs" and
+	"format" keys.
+	"""
+	ffprobe_command = ["ffprobe", "-v", "error", "-probesize", "10M", "-analyzeduration", "50000000", "-print_format", "json", "-show_streams", "-show_programs", "-show_format", in_file]
+	return _cached(in_file, ffprobe_command, "FFprobe")
+
+def mkvmerge(in_mkv):
+	"""
+	Gets the tracks, attachments and container information of a Matroska file.
+
+	The track IDs in this information are the same as the ones MKVExtract uses.
+	:param in_mkv: The file to probe.
+	:return: The parsed JSON output of MKVMerge's identification, with "tracks",
+	"attachments" and "container" keys.
+	"""
+	mkvmerge_command = ["mkvmerge", "-J", in_mkv]
+	return _cached(in_mkv, mkvmerge_command, "MKVMerge")
+
+def _call_json(command, name):
+	print(command)
+	process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	(cout, cerr) = process.communicate()
+	exit_code = process.wait()
+	if exit_code != 0 and not (name == "MKVMerge" and exit_code == 1): #0 is success. 1 is warnings for MKVMerge.
+		raise Exception("Calling {name} on {in_file} failed with exit code {exit_code}. CERR: {cerr}".format(name=name, in_file=command[-1], exit_code=exit_code, cerr=cerr.decode("utf-8")))
+	return json.loads(cout.decode("utf-8"))
+
+def identity(in_file):
+	"""
+	Identifies the contents of a file without reading it.
+
+	If a file is changed or replaced, its identity changes too.
+	:param in_file: The file to identify. This may be a concat: URL, in which
+	case all of the concatenated files are identified.
+	:return: A string that identifies the file, or None if the file can't be
+	found.
+	"""
+	if in_file.startswith("concat:"):
+		paths = in_file[len("concat:"):].split("|")
+	else:
+		paths = [in_file]
+	parts = []
+	for path in paths:
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		parts.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino])
+	return json.dumps(parts)
+
+def _cached(in_file, command, name):
+	"""
+	Calls a probe, unless the same file was already probed with the same
+	command.
+	:param in_file: The file that the command probes.
+	:param command: The command to call.
+	:param name: The name of the program, for error messages.
+	:return: The parsed JSON output of the probe.
+	"""
+	file_identity = identity(in_file)
+	if file_identity is None: #Can't cache this. Let the probe report the error.
+		return _call_json(command, name)
+	key = json.dumps([command[0], command[1:-1], file_identity]) #Everything except the file name itself, which is in the identity already.
+
+	with _cache_lock:
+		if key in _cache:
+			_cache.move_to_end(key)
+			return _cache[key]
+		connection = _connect()
+		if connection is not None:
+			row = connection.execute("SELECT result FROM probes WHERE key = ?", (key,)).fetchone()
+			if row is not None:
+				print("Using cached", name, "probe of", in_file)
+				with connection:
+					connection.execute("UPDATE probes SET used = ? WHERE key = ?", (time.time(), key))
+				_remember(key, json.loads(row[0]))
+				return _cache[key]
+
+	result = _call_json(command, name)
+	with _cache_lock:
+		_remember(key, result)
+		connection = _connect()
+		if connection is not None:
+			with connection:
+				connection.execute("INSERT OR REPLACE INTO probes (key, result, used) VALUES (?, ?, ?)", (key, json.dumps(result), time.time()))
+	return result
+
+def _remember(key, result):
+	"""
+	Keeps a probe result in memory, forgetting the least recently used ones if
+	there are too many.
+
+	Must be called while holding the cache lock.
+	:param key: The identity of the probe.
+	:param result: The parsed output of the probe.
+	"""
+	_cache[key] = result
+	_cache.move_to_end(key)
+	while len(_cache) > memory_size:
+		_cache.popitem(last=False)
+
+def _connect():
+	"""
+	Opens the persistent cache, if it's not opened yet, and removes old probe
+	results from it once a day.
+
+	Must be called while holding the cache lock.
+	:return: A connection to the cache database, or None if there is no
+	persistent cache.
+	"""
+	global _cache_connection, _cache_pruned
+	if _cache_connection is None and cache_file is not None:
+		try:
+			os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+			_cache_connection = sqlite3.connect(cache_file, check_same_thread=False)
+			with _cache_connection:
+				_cache_connection.execute("CREATE TABLE IF NOT EXISTS probes (key TEXT PRIMARY KEY, result TEXT, used REAL)")
+				if "used" not in [row[1] for row in _cache_connection.execute("PRAGMA table_info(probes)")]: #Made by an older version.
+					_cache_connection.execute("ALTER TABLE probes ADD COLUMN used REAL")
+					_cache_connection.execute("UPDATE probes SET used = ?", (time.time(),))
+		except (OSError, sqlite3.Error) as e:
+			print("Could not open the probe cache", cache_file, ":", e)
+			_cache_connection = None
+	if _cache_connection is not None and time.time() - _cache_pruned > 24 * 3600:
+		with _cache_connection:
+			_cache_connection.execute("DELETE FROM probes WHERE used < ?", (time.time() - cache_age,))
+		_cache_pruned = time.time()
+	return _cache_connection
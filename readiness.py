@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import glob  # To find the other files of a multi-file input.
+import os  # To check the size and modification time of files.
+import re  # To recognise VOB chains.
+import threading  # To allow observing files from multiple threads.
+import time  # To know how long files have been unchanged.
+
+def file_set(path):
+    """
+    Finds all of the files that need to be complete before a file can be processed.
+
+    Most inputs are a single file, but a VOB chain needs all of its parts, and
+    DVD and Blu-ray folders need all of their files.
+    :param path: The file that will be given to the encoder.
+    :return: A list of all files that the encoder will read for that input.
+    """
+    directory, filename = os.path.split(path)
+    match = re.match(r"(VTS_\d+_)\d+\.VOB$", filename, re.IGNORECASE)
+    if match:  # All parts of the VOB chain.
+        return glob.glob(os.path.join(glob.escape(directory), glob.escape(match.group(1)) + "*" + os.path.splitext(filename)[1]))
+    if filename == "VIDEO_TS.IFO":  # The whole DVD.
+        return [os.path.join(directory, f) for f in os.listdir(directory)]
+    if filename == "index.bdmv" and os.path.basename(directory) == "BDMV":  # The whole Blu-ray.
+        files = []
+        for root, dirs, filenames in os.walk(directory):
+            files += [os.path.join(root, f) for f in filenames]
+        return files
+    return [path]
+
+class ReadinessTracker:
+    """
+    Holds back files until they are completely written.
+
+    A file is ready once its size and modification time were the same in two
+    consecutive observations, and it hasn't been modified for at least
+    settle_time seconds. For inputs that consist of multiple files, all of
+    those files need to be ready.
+    """
+
+    def __init__(self, settle_time=60):
+        self.settle_time = settle_time
+        self.pending = set()  # Files that were observed but are not yet ready.
+        self.last_stats = {}  # For each file in a pending set, its size and modification time when last observed.
+        self.lock = threading.Lock()
+
+    def observe(self, path):
+        """
+        Marks a file as new or changed, so that it is released once it's ready.
+        :param path: The file that was written.
+        """
+        with self.lock:
+            self.pending.add(path)
+
+    def ready(self):
+        """
+        Checks which pending files are ready to be processed now.
+        :return: The files that are ready. These are no longer pending.
+        """
+        now = time.time()
+        result = []
+        with self.lock:
+            for path in list(self.pending):
+                try:
+                    members = file_set(path)
+                except OSError:  # Directory disappeared.
+                    members = []
+                if path not in members:  # The file itself is gone, so there is nothing to process any more.
+                    self.pending.discard(path)
+                    continue
+
+                stable = True
+                for member in members:
+                    try:
+                        stat = os.stat(member)
+                    except OSError:  # Disappeared in the meantime. Check again next time.
+                        stable = False
+                        continue
+                    current = (stat.st_size, stat.st_mtime)
+                    if self.last_stats.get(member) != current or now - stat.st_mtime < self.settle_time:
+                        stable = False
+                    self.last_stats[member] = current
+                if stable:
+                    self.pending.discard(path)
+                    result.append(path)
+                    for member in members:
+                        self.last_stats.pop(member, None)
+        return result
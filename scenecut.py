@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+#Finds the scene cuts in a video, so that it can be split into chunks that are encoded independently.
+#This is run as a separate process by encode.py, since that module doesn't load VapourSynth itself.
+
+import argparse #To parse command line arguments.
+
+import vapoursynth #To decode the video.
+import havsfunc #To detect the scene changes.
+
+def find_scene_cuts(source, threshold=0.15, track=-1, index_file=None):
+	"""
+	Finds the frames in a video that start a new scene.
+	:param source: The video file to analyse.
+	:param threshold: How different two consecutive frames need to be to count
+	as a scene change, from 0 to 1.
+	:param track: The stream index of the video track to analyse, or -1 for the
+	first video track.
+	:param index_file: Where the FFMS2 index of the video is stored, or None to
+	store it next to the video.
+	:return: A tuple of the total number of frames in the video and a list of
+	frame numbers that start a new scene (excluding frame 0).
+	"""
+	video = vapoursynth.core.ffms2.Source(source=source, track=track, cachefile=index_file)
+	#Scene changes are still obvious at a fraction of the resolution, and this is much faster to analyse.
+	width = 320
+	height = max(2, video.height * width // video.width // 2 * 2)
+	video = video.resize.Bilinear(width=width, height=height, format=vapoursynth.GRAY8)
+	video = havsfunc.SCDetect(video, threshold=threshold)
+
+	cuts = []
+	for frame_nr, frame in enumerate(video.frames()):
+		if frame_nr > 0 and frame.props["_SceneChangePrev"]:
+			cuts.append(frame_nr)
+	return video.num_frames, cuts
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Find the scene cuts in a video.")
+	parser.add_argument("source", metavar="source", type=str, help="The video file to analyse.")
+	parser.add_argument("--threshold", type=float, default=0.15, help="How different frames need to be to count as a scene change, from 0 to 1.")
+	parser.add_argument("--track", type=int, default=-1, help="The stream index of the video track to analyse. By default the first video track.")
+	parser.add_argument("--index", type=str, default=None, help="Where the FFMS2 index of the video is stored. By default next to the video.")
+	args = parser.parse_args()
+
+	num_frames, cuts = find_scene_cuts(args.source, args.threshold, args.track, args.index)
+	#First line is the total number of frames, then one scene cut per line.
+	print(num_frames)
+	for cut in cuts:
+		print(cut)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import heapq  # To keep the queued jobs sorted by priority.
+import itertools  # To number the jobs in order of arrival.
+import threading  # To run the jobs in parallel.
+import time  # To find out how long jobs have been waiting.
+
+class Scheduler:
+    """
+    Runs jobs on a pool of worker threads, limited by a number of resource slots.
+
+    Every job has a weight: the number of slots it occupies while it runs. A
+    job that takes the whole machine has a weight equal to the number of slots.
+    Jobs are started in order of priority, but a job that doesn't fit in the
+    currently free slots is passed over in favour of one that does. That way
+    small jobs fill up the cores that a big encode leaves idle.
+
+    To prevent big jobs from waiting forever while small jobs keep coming in,
+    a job that has waited longer than max_wait seconds reserves the slots as
+    they become free, until it fits.
+    """
+
+    def __init__(self, slots, max_wait=3600):
+        self.slots = slots
+        self.free_slots = slots
+        self.max_wait = max_wait
+        self.queue = []  # Heap of (priority, sequence number, key, weight, job, submit time).
+        self.known = set()  # Keys of all jobs that are queued or running.
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+        for _ in range(slots):  # Every job takes at least one slot, so this many workers is enough to fill all slots.
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def submit(self, key, job, weight=1, priority=0):
+        """
+        Adds a job to the queue.
+        :param key: A unique identifier for the job. If a job with the same key
+        is already queued or running, the new job is ignored.
+        :param job: A function without parameters that performs the job.
+        :param weight: How many slots the job occupies while it runs. This is
+        clamped to the total number of slots.
+        :param priority: Jobs with a lower priority value are started first.
+        :return: Whether the job was added to the queue.
+        """
+        weight = min(max(1, weight), self.slots)
+        with self.condition:
+            if key in self.known:
+                return False
+            self.known.add(key)
+            heapq.heappush(self.queue, (priority, next(self.sequence), key, weight, job, time.time()))
+            self.condition.notify_all()
+        return True
+
+    def take(self):
+        """
+        Takes the job that should be started next from the queue.
+
+        If any job has waited longer than max_wait, the one that waited longest
+        goes first, and nothing else is started until it fits.
+        Must be called while holding the condition's lock.
+        :return: The queue entry of that job, or None if no queued job may start
+        in the free slots right now.
+        """
+        now = time.time()
+        overdue = [entry for entry in self.queue if now - entry[5] > self.max_wait]
+        if overdue:
+            entry = min(overdue, key=lambda entry: entry[5])  # The one that has waited longest.
+            if entry[3] > self.free_slots:
+                return None  # Start nothing else, so that the slots drain for this job.
+            self.start(entry)
+            return entry
+        for entry in sorted(self.queue):
+            if entry[3] <= self.free_slots:
+                self.start(entry)
+                return entry
+        return None
+
+    def start(self, entry):
+        """
+        Removes a job from the queue and occupies its slots.
+
+        Must be called while holding the condition's lock.
+        :param entry: The queue entry of the job.
+        """
+        self.queue.remove(entry)
+        heapq.heapify(self.queue)
+        self.free_slots -= entry[3]
+
+    def worker(self):
+        while True:  # Wait indefinitely for jobs to arrive.
+            with self.condition:
+                entry = self.take()
+                while entry is None:
+                    self.condition.wait(timeout=60)  # Also re-evaluate now and then, for jobs that started waiting too long.
+                    entry = self.take()
+            priority, sequence, key, weight, job, submit_time = entry
+            try:
+                job()
+            except Exception as e:
+                print(e)
+            finally:
+                with self.condition:
+                    self.free_slots += weight
+                    self.known.discard(key)
+                    self.condition.notify_all()
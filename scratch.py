@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import glob #To find the files written to a prefix.
+import os #To find and create the scratch directories.
+import shutil #To check how much space is free.
+import threading #To allow placing files from multiple threads.
+
+#Directories for small intermediates, such as statistics, scripts and audio. Fastest first, e.g. a tmpfs.
+small_tiers = []
+#Directories for big intermediates, such as demuxed and lossless video. Fastest first, e.g. an NVMe drive.
+large_tiers = []
+#The directory to make the work directories of jobs in. These hold the manifests, and the files that don't fit on any tier. By default the current directory.
+work_root = None
+#How much space to leave free on each tier, in bytes, on top of what the files are expected to take.
+reserve = 1024 * 1024 * 1024
+
+_claims = {} #For each file that was placed but may not be completely written yet: its tier, expected size and whether it was seen on disk.
+_claims_lock = threading.Lock()
+
+def free_space(directory):
+	"""
+	Finds how much space is available in a directory, not counting the space
+	that files which were placed there still need to grow into.
+	:param directory: The directory to check. It doesn't need to exist yet.
+	:return: The number of bytes available.
+	"""
+	existing = os.path.abspath(directory)
+	while not os.path.exists(existing): #Check the file system it would be created on.
+		existing = os.path.dirname(existing)
+	try:
+		free = shutil.disk_usage(existing).free
+	except OSError:
+		return 0
+
+	with _claims_lock:
+		for file_name, claim in list(_claims.items()):
+			if claim["tier"] != directory:
+				continue
+			written = glob.glob(glob.escape(file_name) + "*") if claim["prefix"] else [file_name]
+			written = [path for path in written if os.path.isfile(path)]
+			if written:
+				claim["seen"] = True
+				try:
+					free -= max(0, claim["size"] - sum(os.path.getsize(path) for path in written))
+				except OSError: #Deleted in the meantime.
+					pass
+			elif claim["seen"]: #Written and deleted again.
+				del _claims[file_name]
+			else: #Not written yet.
+				free -= claim["size"]
+	return free
+
+class Workspace:
+	"""
+	The scratch directories of one job.
+
+	The job gets a directory of its own on each tier that it places files on.
+	Files are placed on the fastest tier with enough free space. The main work
+	directory holds the manifest, and is the fallback if no tier has enough
+	space.
+	"""
+
+	def __init__(self, guid, main_directory=None):
+		"""
+		Creates the workspace of a job.
+		:param guid: The name of the job's directory on each tier.
+		:param main_directory: The work directory of the job, where files are
+		placed if no tier has space for them. By default a directory named after
+		the guid in the work_root.
+		"""
+		self.guid = guid
+		self.directory = os.path.abspath(main_directory or os.path.join(work_root or os.curdir, guid))
+		self.root = os.path.dirname(self.directory) #Where the space of files in the work directory is accounted.
+		self.placed = [] #All files that were placed, to release their claims afterwards.
+
+	def directories(self):
+		"""
+		Lists the directories of this job on all tiers, including the main work
+		directory.
+		:return: The directories that exist.
+		"""
+		result = [self.directory] if os.path.isdir(self.directory) else []
+		for tier in small_tiers + large_tiers:
+			directory = os.path.join(tier, self.guid)
+			if os.path.isdir(directory) and directory not in result:
+				result.append(directory)
+		return result
+
+	def file(self, file_name, size, small=False, prefix=False):
+		"""
+		Chooses where to store an intermediate file.
+
+		If an earlier attempt of this job already stored a file with the same
+		name on any tier, that one is used again, so that it can be resumed.
+		:param file_name: The name of the file. Only the base name is used.
+		:param size: How many bytes the file is expected to take.
+		:param small: Whether to prefer the tiers for small files. If those are
+		full, the tiers for big files are tried next.
+		:param prefix: Whether the name is a prefix for multiple files rather
+		than a single file.
+		:return: The path to store the file at.
+		"""
+		base_name = os.path.basename(file_name)
+		tiers = (small_tiers + large_tiers) if small else large_tiers
+		for directory in self.directories():
+			if os.path.exists(os.path.join(directory, base_name)):
+				return os.path.join(directory, base_name)
+
+		for tier in tiers:
+			if free_space(tier) - size >= reserve:
+				break
+			print("Scratch directory", tier, "is too full for", base_name + ". Trying the next one.")
+		else:
+			tier = None
+		if tier is None:
+			directory = self.directory
+		else:
+			directory = os.path.join(tier, self.guid)
+		os.makedirs(directory, exist_ok=True)
+		result = os.path.join(directory, base_name)
+
+		with _claims_lock:
+			_claims[result] = {"tier": tier or self.root, "size": size, "seen": False, "prefix": prefix} #Files in the work directory count against its file system too.
+		self.placed.append(result)
+		return result
+
+	def has_space(self, file_name, size, small=False):
+		"""
+		Checks whether an intermediate file fits anywhere, before deciding to
+		write it at all.
+		:param file_name: The name of the file. Only the base name is used.
+		:param size: How many bytes the file is expected to take.
+		:param small: Whether the tiers for small files may be used.
+		:return: Whether an earlier attempt of this job already stored the file,
+		or a tier or the main work directory has enough free space for it.
+		"""
+		base_name = os.path.basename(file_name)
+		for directory in self.directories():
+			if os.path.exists(os.path.join(directory, base_name)):
+				return True
+		tiers = (small_tiers + large_tiers) if small else large_tiers
+		return any(free_space(directory) - size >= reserve for directory in tiers + [self.root])
+
+	def prefix(self, size, small=False):
+		"""
+		Chooses where to store a group of intermediate files that all start with
+		the guid of the job.
+		:param size: How many bytes the files are expected to take together.
+		:param small: Whether to prefer the tiers for small files.
+		:return: The path prefix for the files.
+		"""
+		return self.file(self.guid, size, small, prefix=True)
+
+	def release(self, file_name):
+		"""
+		Releases the space that one file was expected to take, once it's
+		completely written.
+		:param file_name: The path that was chosen for the file or prefix.
+		"""
+		with _claims_lock:
+			_claims.pop(file_name, None)
+		if file_name in self.placed:
+			self.placed.remove(file_name)
+
+	def close(self):
+		"""
+		Releases the space that this job's files were expected to take.
+		"""
+		with _claims_lock:
+			for file_name in self.placed:
+				_claims.pop(file_name, None)
+		self.placed = []
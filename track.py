@@ -1,7 +1,5 @@
 #!/usr/bin/env python
 
-import re
-
 class Track:
 	"""
 	Represents one track in a media container.
@@ -16,6 +14,8 @@ class Track:
 		self.language = ""
 		self.name = ""
 		self.file_name = "" #Where the track is extracted to.
+		self.source_file = "" #If set, the track was not extracted, but is read from this container directly.
+		self.source_index = -1 #The stream index of the track in source_file.
 
 		#Video properties.
 		self.pixel_width = 0
@@ -25,168 +25,111 @@ class Track:
 		self.interlaced = False
 		self.interlace_field_order = "tff"
 		self.pixel_aspect_ratio = "1:1"
+		self.num_frames = 0 #Exact. 0 if unknown.
+		self.estimated_frames = 0 #From the duration of the container, which may include audio or subtitles that run longer. Only for estimates.
 
 		#Audio properties.
 		self.frequency = 0
 		self.channels = 0
 		self.bit_depth = 0
 
-	def from_mkv(self, mkv_track):
+	def from_mkvmerge(self, mkv_track, duration=0):
+		"""
+		Fills in the metadata from a track in MKVMerge's JSON identification.
+		:param mkv_track: One of the elements of "tracks" in the identification.
+		:param duration: The duration of the container in seconds, to estimate
+		the number of frames if the track doesn't say. That estimate is not
+		used as the frame count, since other tracks may run longer.
+		"""
 		print("---- Parsing track:")
-		for line in mkv_track.split("\n"):
-			if line.startswith("|"):
-				line = line[1:]
-			line = line.strip()
-			if line.startswith("+"):
-				line = line[1:]
-			line = line.strip()
-
-			if line.startswith("Track number: ") and "mkvextract:" in line:
-				line = line[line.find("mkvextract: ") + len("mkvextract: "):]
-				if ")" in line:
-					line = line[:line.find(")")]
-					try:
-						self.track_nr = int(line)
-						print("  Track Nr:", self.track_nr)
-					except ValueError: #Not properly formatted for int().
-						pass
-			elif line.startswith("Track UID: "):
-				line = line[len("Track UID: "):]
-				try:
-					self.uid = int(line)
-					print("  UID:", self.uid)
-				except ValueError: #Not an integer.
-					pass
-			elif line.startswith("Track type: "):
-				line = line[len("Track type: "):]
-				type_translation = {
-					"video": "video",
-					"audio": "audio",
-					"subtitles": "subtitle"
-				}
-				if line in type_translation:
-					self.type = type_translation[line]
-					print("  Type:", self.type)
-			elif line.startswith("Codec ID: "):
-				line = line[len("Codec ID: "):]
-				codec_translation = {
-					"A_AAC": "aac",
-					"A_FLAC": "flac",
-					"A_TRUEHD": "truehd",
-					"S_TEXT/ASS": "ass",
-					"S_TEXT/UTF8": "srt",
-					"V_MPEG4/ISO/AVC": "h264",
-					"V_MPEGH/ISO/HEVC": "h265"
-				}
-				if line in codec_translation:
-					self.codec = codec_translation[line]
-					print("  Codec:", self.codec)
-			elif line.startswith("Default duration: "):
-				line = line[len("Default duration: "):]
-				line = line[:line.find(" ")]
-				try:
-					hours, minutes, seconds = line.split(":")
-					hours = int(hours)
-					minutes = int(minutes)
-					seconds = float(seconds)
-					frame_duration = hours * 3600 + minutes * 60 + seconds
-					self.fps = 1.0 / frame_duration
-					print("  FPS:", self.fps)
-				except ValueError: #Too many or not enough values to unpack, or not ints/floats.
-					pass
-			elif line.startswith("Language: "):
-				line = line[len("Language: "):]
-				language_translation = {
-					"und": "",
-					"chi": "zh_CN",
-					"eng": "en_US",
-					"fre": "fr_FR",
-					"jpn": "ja_JP",
-					"kor": "ko_KO",
-					"spa": "es_ES",
-					"tha": "th_TH"
-				}
-				if line in language_translation:
-					self.language = language_translation[line]
-					print("  Language:", self.language)
-			elif line.startswith("Name: "):
-				line = line[len("Name: "):]
-				self.name = line
-				print("  Name:", self.name)
-			elif line.startswith("Pixel width: "):
-				line = line[len("Pixel width: "):]
-				try:
-					self.pixel_width = int(line)
-					print("  Pixel width:", self.pixel_width)
-				except ValueError: #Not an integer.
-					pass
-			elif line.startswith("Pixel height: "):
-				line = line[len("Pixel height: "):]
-				try:
-					self.pixel_height = int(line)
-					print("  Pixel height:", self.pixel_height)
-				except ValueError: #Not an integer.
-					pass
-			elif line.startswith("Display width: "):
-				line = line[len("Display width: "):]
-				try:
-					self.display_width = int(line)
-					print("  Display width:", self.display_width)
-				except ValueError: #Not an integer.
-					pass
-			elif line.startswith("Display height: "):
-				line = line[len("Display height: "):]
-				try:
-					self.display_height = int(line)
-					print("  Display height:", self.display_height)
-				except ValueError: #Not an integer.
-					pass
-			elif line.startswith("Sampling frequency: "):
-				line = line[len("Sampling frequency: "):]
-				try:
-					self.frequency = int(line)
-					print("  Frequency:", self.frequency)
-				except ValueError: #Not an integer.
-					pass
-			elif line.startswith("Channels: "):
-				line = line[len("Channels: "):]
-				try:
-					self.channels = int(line)
-					print("  Channels:", self.channels)
-				except ValueError: #Not an integer.
-					pass
-			elif line.startswith("Bit depth: "):
-				line = line[len("Bit depth: "):]
-				try:
-					self.bit_depth = int(line)
-					print("  Bit depth:", self.bit_depth)
-				except ValueError: #Not an integer.
-					pass
-
-	def from_ffmpeg(self, track_nr, track_type, track_codec, interlaced=False, interlace_field_order="tff", pixel_aspect_ratio=1.0):
-		self.track_nr = int(track_nr)
+		properties = mkv_track.get("properties", {})
+		self.track_nr = mkv_track["id"]
+		print("  Track Nr:", self.track_nr)
+		self.uid = properties.get("uid", -1)
+		print("  UID:", self.uid)
 
 		type_translation = {
-			"Video": "video",
-			"Audio": "audio",
+			"video": "video",
+			"audio": "audio",
+			"subtitles": "subtitle"
+		}
+		if mkv_track.get("type") in type_translation:
+			self.type = type_translation[mkv_track["type"]]
+			print("  Type:", self.type)
+
+		codec_translation = {
+			"A_AAC": "aac",
+			"A_FLAC": "flac",
+			"A_TRUEHD": "truehd",
+			"S_TEXT/ASS": "ass",
+			"S_TEXT/UTF8": "srt",
+			"V_MPEG4/ISO/AVC": "h264",
+			"V_MPEGH/ISO/HEVC": "h265"
+		}
+		codec_id = properties.get("codec_id", "")
+		if codec_id in codec_translation:
+			self.codec = codec_translation[codec_id]
+			print("  Codec:", self.codec)
+
+		if properties.get("default_duration"): #In nanoseconds per frame.
+			self.fps = 1000000000.0 / properties["default_duration"]
+			print("  FPS:", self.fps)
+
+		language_translation = {
+			"und": "",
+			"chi": "zh_CN",
+			"eng": "en_US",
+			"fre": "fr_FR",
+			"jpn": "ja_JP",
+			"kor": "ko_KO",
+			"spa": "es_ES",
+			"tha": "th_TH"
 		}
-		self.type = type_translation.get(track_type, "unknown")
+		if properties.get("language") in language_translation:
+			self.language = language_translation[properties["language"]]
+			print("  Language:", self.language)
+		if "track_name" in properties:
+			self.name = properties["track_name"]
+			print("  Name:", self.name)
+
+		if "pixel_dimensions" in properties:
+			self.pixel_width, self.pixel_height = [int(part) for part in properties["pixel_dimensions"].split("x")]
+			print("  Pixel size:", self.pixel_width, "x", self.pixel_height)
+		if "display_dimensions" in properties:
+			self.display_width, self.display_height = [int(part) for part in properties["display_dimensions"].split("x")]
+			print("  Display size:", self.display_width, "x", self.display_height)
 		if self.type == "video":
-			self.interlaced = interlaced
-			self.interlace_field_order = interlace_field_order
-			#Convert pixel aspect ratio from float to ratio.
-			ratio = "1:1"
-			for divisor in range(1, 1000):
-				rounded = round(pixel_aspect_ratio * divisor)
-				reconstructed = rounded / divisor
-				difference = abs(reconstructed - pixel_aspect_ratio)
-				if difference < 0.0005:
-					ratio = "{rounded}:{divisor}".format(rounded=rounded, divisor=divisor)
-					print("Aspect ratio", pixel_aspect_ratio, "converted into", ratio)
-					break
-			self.pixel_aspect_ratio = ratio
+			if properties.get("tag_number_of_frames"): #Statistics tags written by MKVMerge.
+				self.num_frames = int(properties["tag_number_of_frames"])
+			elif self.fps > 0 and duration > 0:
+				self.estimated_frames = round(duration * self.fps)
+			if self.num_frames > 0:
+				print("  Frames:", self.num_frames)
+			elif self.estimated_frames > 0:
+				print("  Frames: about", self.estimated_frames)
+
+		self.frequency = properties.get("audio_sampling_frequency", 0)
+		self.channels = properties.get("audio_channels", 0)
+		self.bit_depth = properties.get("audio_bits_per_sample", 0)
+		if self.type == "audio":
+			print("  Frequency:", self.frequency)
+			print("  Channels:", self.channels)
+			print("  Bit depth:", self.bit_depth)
+
+	def from_ffprobe(self, stream):
+		"""
+		Fills in the metadata from a stream in FFprobe's JSON output.
+		:param stream: One of the elements of "streams" in the output.
+		"""
+		self.track_nr = int(stream["index"])
+
+		type_translation = {
+			"video": "video",
+			"audio": "audio",
+			"subtitle": "subtitle"
+		}
+		self.type = type_translation.get(stream.get("codec_type"), "unknown")
 
-		codec_parts = track_codec.split(", ")
 		codec_translation = {
 			"ac3": "ac3",
 			"dts": "dts",
@@ -194,24 +137,47 @@ class Track:
 			"h264": "h264",
 			"mpeg2video": "mpg",
 			"vc1": "vc1",
-			"hdmv_pgs_subtitle": "pgs"
+			"hdmv_pgs_subtitle": "pgs",
+			"dvd_subtitle": "sub"
+		}
+		self.codec = codec_translation.get(stream.get("codec_name"), "unknown")
+
+		language_translation = {
+			"und": "",
+			"chi": "zh_CN",
+			"eng": "en_US",
+			"fre": "fr_FR",
+			"jpn": "ja_JP",
+			"kor": "ko_KO",
+			"spa": "es_ES",
+			"tha": "th_TH"
 		}
-		self.codec = codec_translation.get(codec_parts[0].strip(), "unknown")
-		if self.codec in ["ac3", "flac", "dts", "pcm_bluray"]:
-			if len(codec_parts) >= 2:
-				frequency_str = codec_parts[1]
-				if frequency_str.endswith(" Hz"):
-					self.frequency = int(codec_parts[1][:-3])  # Remove " Hz"
-			if len(codec_parts) >= 3:
-				self.channels = 2 if codec_parts[2] == "stereo" else (1 if codec_parts[2] == "mono" else 0)
-		elif self.codec in ["mpg", "h264", "vc1"]:
-			fps_match = re.findall(r"[\.\d]+ fps", track_codec)
-			if fps_match:
-				self.fps = float(fps_match[0][:-4])  # Remove " fps"
-				if self.interlaced:
-					self.fps *= 2
-			size_match = re.findall(r"\d+x\d+", track_codec)
-			if size_match:
-				size_parts = size_match[0].split("x")
-				self.display_width = int(size_parts[0])
-				self.display_height = int(size_parts[1])
+		self.language = language_translation.get(stream.get("tags", {}).get("language"), "")
+
+		if self.type == "video":
+			field_order = stream.get("field_order", "progressive")
+			self.interlaced = field_order in ["tt", "bb", "tb", "bt"]
+			self.interlace_field_order = "bff" if field_order in ["bb", "bt"] else "tff"
+			print("Interlace detection:", self.interlaced, self.interlace_field_order, "(", field_order, ")")
+			sample_aspect_ratio = stream.get("sample_aspect_ratio", "1:1")
+			if sample_aspect_ratio.startswith("0:"): #Unknown.
+				sample_aspect_ratio = "1:1"
+			self.pixel_aspect_ratio = sample_aspect_ratio
+			print("Pixel aspect ratio:", self.pixel_aspect_ratio)
+
+			self.pixel_width = self.display_width = int(stream.get("width", 0))
+			self.pixel_height = self.display_height = int(stream.get("height", 0))
+			for frame_rate in [stream.get("avg_frame_rate", "0/0"), stream.get("r_frame_rate", "0/0")]:
+				numerator, denominator = [int(part) for part in frame_rate.split("/")]
+				if numerator > 0 and denominator > 0:
+					self.fps = numerator / denominator
+					break
+			if self.interlaced:
+				self.fps *= 2
+			try:
+				self.num_frames = int(stream.get("nb_frames", 0))
+			except ValueError: #N/A.
+				pass
+		elif self.type == "audio":
+			self.frequency = int(stream.get("sample_rate", 0))
+			self.channels = int(stream.get("channels", 0))
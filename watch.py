@@ -1,54 +1,114 @@
 #!/usr/bin/env python
 
 import argparse  # To receive the argument of which directory to watch.
-import functools  # To start a thread with a parameter.
+import functools  # To start a job with a parameter.
 import os  # To walk the files recursively.
-import threading  # To have a consuming thread process the files coming in.
-import time  # To sleep the producing thread.
+import time  # To know when to rescan.
 
+import dirwatch  # To get notified of new files.
 import encode  # The module that will do the actual work of transcoding.
+import jobstore  # To remember the progress of jobs across restarts.
+import readiness  # To wait until files are completely written.
+import scheduler  # To run multiple encodes at the same time.
+import scratch  # To place intermediate files on fast storage.
 
-def rescan(directory, todo):
-	for root, dirs, files in os.walk(directory):
-		dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.join(directory, "output")]  # Ignore output directory.
-		for f in files:
-			path = os.path.join(root, f)
-			if path not in todo:
-				todo.append(path)
-
-	filesizes = {}
-	for path in todo:
-		try:
-			filesizes[path] = os.path.getsize(path)
-		except FileNotFoundError:
-			pass
-	#todo[:] = sorted(todo, key=lambda p: -filesizes[p])
-	todo[:] = reversed(sorted(todo))
-
-def process_thread(prefix, todo):
-	while True:  # Wait indefinitely for files to arrive in this thread.
-		while len(todo) > 0:
-			input_filename = todo.pop()
-			relative_path = input_filename[len(prefix) + 1:]
-			output_filename = os.path.join(prefix, "output", relative_path)
-			preset = relative_path[:relative_path.find(os.path.sep)]
-			try:
-				encode.process(input_filename, output_filename, preset)
-			except Exception as e:
-				print(e)
-		time.sleep(10)  # Don't spinloop! Just poll every 10 seconds.
+# Which fraction of the machine each preset occupies while encoding.
+# Presets that are not listed are lightweight, and only take a single slot.
+preset_weights = {
+    "uhd": 1.0,
+    "hd": 0.5,
+    "hdanime": 0.5,
+    "dvd": 0.25,
+    "dvd-lo": 0.25,
+    "dedup": 0.25
+}
+
+def rescan(directory, tracker):
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.join(directory, "output")]  # Ignore output directory.
+        for f in files:
+            path = os.path.join(root, f)
+            if not path.endswith(".part"):  # Titles that are still being extracted from a disc.
+                tracker.observe(path)
+
+def submit(prefix, input_filename, jobs, store, resumed=False):
+    relative_path = input_filename[len(prefix) + 1:]
+    preset = relative_path[:relative_path.find(os.path.sep)]
+    weight = max(1, round(preset_weights.get(preset, 0) * jobs.slots))
+    job = store.discover(input_filename, os.path.join(prefix, "output", relative_path), preset)
+    if job is None:  # Already done, or failed and not due for a retry yet.
+        return
+    # Index the video while other jobs are still encoding. This is a light job, so it goes before the encodes.
+    jobs.submit(input_filename + "#index", functools.partial(encode.preindex, input_filename, preset), priority=(not resumed, 0, input_filename))
+    # Resume interrupted jobs first. Then start lightweight jobs first, so they don't wait behind big encodes. Then in alphabetical order.
+    jobs.submit(input_filename, functools.partial(process_file, prefix, input_filename, job["guid"], jobs, store), weight=weight, priority=(not resumed, weight, input_filename))
+
+def process_file(prefix, input_filename, guid, jobs, store):
+    relative_path = input_filename[len(prefix) + 1:]
+    output_filename = os.path.join(prefix, "output", relative_path)
+    preset = relative_path[:relative_path.find(os.path.sep)]
+    try:
+        # Titles of discs are queued as soon as they are extracted, to encode them while the rest of the disc is extracted.
+        encode.process(input_filename, output_filename, preset, guid=guid, progress=functools.partial(store.set_state, input_filename), on_title=lambda title: submit(prefix, title, jobs, store))
+    except Exception as e:
+        store.set_state(input_filename, "failed", error=str(e))
+        raise
+    store.set_state(input_filename, "done")
 
 if __name__ == "__main__":
-	parser = argparse.ArgumentParser(description="Look for files to transcode.")
-	parser.add_argument("watch_directory", metavar="directory", type=str, help="The directory to transcode files in.")
-	args = parser.parse_args()
+    parser = argparse.ArgumentParser(description="Look for files to transcode.")
+    parser.add_argument("watch_directory", metavar="directory", type=str, help="The directory to transcode files in.")
+    parser.add_argument("--slots", type=int, default=os.cpu_count(), help="How many resource slots to divide among the jobs. A job that takes the whole machine occupies all of them.")
+    parser.add_argument("--settle-time", type=float, default=60, help="How long a file must be unchanged before it gets processed, in seconds.")
+    parser.add_argument("--database", type=str, default=None, help="Where to store the progress of the jobs. By default this is in the output directory.")
+    parser.add_argument("--rescan-interval", type=float, default=600, help="How often to scan the whole directory for files that were missed, in seconds.")
+    parser.add_argument("--scratch-small", type=str, action="append", default=[], help="A directory for small intermediate files, such as a tmpfs. May be given multiple times, fastest first.")
+    parser.add_argument("--scratch-large", type=str, action="append", default=[], help="A directory for big intermediate files, such as an NVMe drive. May be given multiple times, fastest first.")
+    parser.add_argument("--work-directory", type=str, default=None, help="Where to make the work directories of the jobs, which hold their progress and the intermediate files that don't fit in any scratch directory. By default the current directory.")
+    parser.add_argument("--scratch-reserve", type=float, default=1, help="How much space to leave free in each scratch directory, in GiB.")
+    parser.add_argument("--parallel-chunks", type=int, default=1, help="How many chunks of a video to encode at the same time. Videos are split into chunks at scene cuts.")
+    parser.add_argument("--vector-cache", type=str, default=None, help="Where to keep the motion vectors of the filters, so that later passes and retries of an encode don't need to search them again. This can take many GiB per video.")
+    parser.add_argument("--crop", type=str, action="append", default=[], metavar="PRESET", help="Crop the black borders off the videos of this preset. May be given multiple times.")
+    args = parser.parse_args()
+
+    scratch.small_tiers = args.scratch_small
+    scratch.large_tiers = args.scratch_large
+    scratch.work_root = args.work_directory
+    scratch.reserve = int(args.scratch_reserve * 1024 * 1024 * 1024)
+    encode.vector_cache_file = args.vector_cache
+    encode.parallel_chunks = args.parallel_chunks
+    encode.crop_presets = args.crop
 
-	todo = list()
+    store = jobstore.JobStore(args.database or os.path.join(args.watch_directory, "output", "jobs.sqlite"))
+    jobs = scheduler.Scheduler(args.slots)
+    for job in store.unfinished():  # Were interrupted by a restart.
+        if os.path.exists(job["input"]):
+            print("Resuming", job["input"], "after stage", job["state"])
+            submit(args.watch_directory, job["input"], jobs, store, resumed=True)
+    # This becomes the producer thread then.
 
-	consumer_thread = threading.Thread(target=functools.partial(process_thread, args.watch_directory, todo))
-	consumer_thread.start()
-	# This becomes the producer thread then.
+    try:
+        watcher = dirwatch.DirectoryWatcher(args.watch_directory, exclude=[os.path.join(args.watch_directory, "output")])
+    except (OSError, AttributeError) as e:  # No inotify on this system. Fall back to polling.
+        print("Could not watch for new files, falling back to polling:", e)
+        watcher = None
+        args.rescan_interval = 10
 
-	while True:
-		rescan(args.watch_directory, todo)
-		time.sleep(10)
+    tracker = readiness.ReadinessTracker(args.settle_time)
+    rescan(args.watch_directory, tracker)
+    last_rescan = time.time()
+    while True:
+        if watcher is not None:
+            new_files, overflowed = watcher.read(timeout=10)  # Wake up regularly to see which files are ready.
+            for path in new_files:
+                if not path.endswith(".part"):
+                    tracker.observe(path)
+        else:
+            overflowed = False
+            time.sleep(10)
+        for path in tracker.ready():
+            submit(args.watch_directory, path, jobs, store)
+        # Now and then, do a full scan anyway in case we missed something.
+        if overflowed or time.time() - last_rescan >= args.rescan_interval:
+            rescan(args.watch_directory, tracker)
+            last_rescan = time.time()